@@ -1,4 +1,14 @@
 # -*- mode: python ; coding: utf-8 -*-
+import importlib.util
+
+from PyInstaller.utils.hooks import collect_submodules
+
+# backends.py imports its accelerators by name, so bundle whichever are
+# installed; check a build with python bench/bench_backends.py --exe
+backend_imports = []
+for module in ('orjson', 'uvloop', 'winloop'):
+    if importlib.util.find_spec(module) is not None:
+        backend_imports += collect_submodules(module)
 
 
 a = Analysis(
@@ -6,7 +16,7 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[('*.html', '.'), ('*.js', '.'), ('*.css', '.')],
-    hiddenimports=['PIL._tkinter', 'PIL._imagingtk', 'PIL._tkinter_finder'],
+    hiddenimports=['PIL._tkinter', 'PIL._imagingtk', 'PIL._tkinter_finder'] + backend_imports,
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
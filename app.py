@@ -1,31 +1,34 @@
+import time
+
+# Cold start is measured from here to the server accepting connections
+START_TIME = time.perf_counter()
+
+import argparse
 import asyncio
-import json
 import websockets
-import time
-import socket
 import threading
-import http.server
-import socketserver
-import webbrowser
 import os
 import sys
-import qrcode
-from PIL import Image, ImageTk
-import tkinter as tk
-from io import BytesIO
-import threading
+import urllib.parse
+
+import backends
+from rooms import COALESCE_WINDOW, RoomRegistry
+from message_engine import MessageEngine
+from event_log import EventLog
+from history_store import HistoryStore
+from relay import Relay
+from discovery import DISCOVERY_PORT, Discovery, local_addresses, request_hostname
+from capture import CaptureRecorder
+from loop_monitor import LoopMonitor, SamplingProfiler
+from connection_profile import PROFILES, raise_file_limit, serve_options
+from static_server import Response, StaticServer
+from server_log import setup_logging, stop_logging
+from metrics import registry as metrics
 
 # Global variables
 HTTP_PORT = 8000
 WS_PORT = 8765
-counters = {}
-connected_clients = set()
-timer_state = {
-    "type": "timer-sync",
-    "isRunning": False,
-    "startTime": 0,
-    "pausedTime": 0
-}
+rooms = RoomRegistry()
 
 # Get the application directory 
 if getattr(sys, 'frozen', False):
@@ -38,325 +41,247 @@ else:
 # Change to the application directory to ensure access to HTML/JS/CSS files
 os.chdir(app_dir)
 
+# Match state is journaled here so a restart picks up where it left off
+DATA_DIR = os.path.join(app_dir, "match-data")
+
+# Generated QR codes are cached in this folder of the data directory
+QR_CACHE_DIRNAME = "qr-cache"
+
+# Profiles asked for with {"type": "profile"} are written here
+PROFILE_DIRNAME = "profiles"
+
 # HTTP Server setup
 class ScoreCounterHTTPServer(threading.Thread):
     def __init__(self):
         threading.Thread.__init__(self, daemon=True)
-        self.httpd = None
+        self.loop = None
+        self.static_server = StaticServer(app_dir)
         
     def run(self):
-        handler = http.server.SimpleHTTPRequestHandler
-        self.httpd = socketserver.TCPServer(("0.0.0.0", HTTP_PORT), handler)
-        print(f"HTTP server started at http://localhost:{HTTP_PORT}")
-        self.httpd.serve_forever()
+        # Serve assets from memory on this thread's own event loop
+        self.loop = backends.new_event_loop()
+        self.loop.run_until_complete(self.static_server.start("0.0.0.0", HTTP_PORT))
+        self.loop.run_forever()
     
     def stop(self):
-        if self.httpd:
-            self.httpd.shutdown()
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.loop.stop)
 
-# WebSocket server handler
-async def counter_server(websocket):
-    global timer_state
-    client_info = f"{websocket.remote_address[0]}:{websocket.remote_address[1]}"
-    print(f"Client connected: {client_info}")
-    
-    connected_clients.add(websocket)
-    try:
-        # Send initial counter values
-        await websocket.send(json.dumps({
-            "type": "counters", 
-            "values": counters
-        }))
-        
-        # Send initial timer state
-        await websocket.send(json.dumps(timer_state))
-        
-        async for message in websocket:
-            data = json.loads(message)
+# WebSocket server handler: one engine dispatches every message type
+engine = MessageEngine(rooms)
+counter_server = engine.handle_connection
 
-            if data['type'] == 'subtract-counter':
-                counter_id = data.get('counterId')
-                if not counter_id:
-                    print("Warning: Received subtract-counter without counter ID")
-                    continue
-                value = data.get('value', 1)
-                
-                # Prevent negative values
-                current_value = counters.get(counter_id, 0)
-                new_value = max(0, current_value - value)
-                
-                counters[counter_id] = new_value
-                
-                # Broadcast updated counter values
-                await broadcast({"type": "counters", "values": counters})
-            
-            elif data.get("type") == "increment":
-                counter_id = data.get("counterId")
-                value = data.get("value", 1)
-                
-                # Create the counter if it doesn't exist
-                if counter_id not in counters:
-                    counters[counter_id] = 0
-                
-                # Increment the counter
-                counters[counter_id] += value
-                
-                # Broadcast updated counter values
-                await broadcast({"type": "counters", "values": counters})
-                
-            elif data.get("type") == "reset-counters":
-                # Reset all counters to zero
-                counters.clear()
-                
-                # Broadcast updated counter values
-                await broadcast({"type": "counters", "values": counters})
-                
-            elif data.get("type") == "timer-start":
-                # Store the duration in a local variable
-                duration = data.get("duration", timer_state.get("duration", 60))
-                
-                # Calculate current timestamp for elapsed time calculation
-                current_time = int(time.time() * 1000)
-                start_time = data.get("startTime", current_time)
-                
-                # Calculate elapsed time
-                elapsed_time = data.get("elapsedTime", 0)
-                
-                timer_state = {
-                    "type": "timer-start",
-                    "isRunning": True,
-                    "startTime": start_time,
-                    "elapsedTime": elapsed_time,
-                    "pausedTime": 0,
-                    "pausedTimeRemaining": 0,
-                    "duration": duration
-                }
-                
-                # Broadcast to all clients
-                await broadcast(timer_state)
-                            
-            elif data.get("type") == "timer-pause":
-                # Get a valid pausedTime value
-                pausedTime = data.get("pausedTime")
-                pausedTimeRemaining = data.get("pausedTimeRemaining")
-                
-                # Make sure we have at least one valid value
-                if pausedTime is None and pausedTimeRemaining is not None:
-                    pausedTime = pausedTimeRemaining
-                elif pausedTime is None and pausedTimeRemaining is None:
-                    # Calculate from startTime if possible
-                    if "startTime" in timer_state and timer_state["startTime"] > 0:
-                        elapsed = int(time.time() * 1000) - timer_state["startTime"]
-                        pausedTime = max(0, (timer_state.get("duration", 60) * 1000) - elapsed)
-                    else:
-                        # Fallback to full duration
-                        pausedTime = timer_state.get("duration", 60) * 1000
-                
-                # Update timer state with valid pausedTime
-                global_timer_update({
-                    "type": "timer-pause",
-                    "pausedTime": pausedTime,
-                    "pausedTimeRemaining": pausedTime  # Make them consistent
-                })
-                
-                # Broadcast to all clients
-                await broadcast(timer_state)
-                
-            elif data.get("type") == "timer-reset":
-                # Store the duration before resetting
-                duration = timer_state.get("duration", 60)
-                
-                timer_state = {
-                    "type": "timer-reset",
-                    "isRunning": False,
-                    "startTime": 0,
-                    "pausedTime": duration * 1000,
-                    "pausedTimeRemaining": duration * 1000,
-                    "duration": duration
-                }
-                
-                # Broadcast just once
-                await broadcast(timer_state)
-                
-            elif data.get("type") == "timer-sync-request":
-                # Send current timer state to the client
-                await websocket.send(json.dumps(timer_state))
-                
-            elif data.get("type") == "ping":
-                # Just respond with a pong to keep the connection alive
-                await websocket.send(json.dumps({"type": "pong"}))
-    except Exception as e:
-        print(f"Error handling client {client_info}: {e}")
-    finally:
-        connected_clients.remove(websocket)
-        print(f"Client disconnected: {client_info}")
+def get_local_ip():
+    # Read from the network interfaces; works without a route to the internet
+    addresses = local_addresses()
+    return addresses[0] if addresses else 'localhost'
 
-def global_timer_update(new_state):
-    global timer_state
-    
-    if new_state.get('type') == 'timer-pause':
-        # Ensure pausedTime is valid
-        if 'pausedTime' in new_state and new_state['pausedTime'] is None:
-            new_state['pausedTime'] = new_state.get('pausedTimeRemaining', 0)
-        
-        # Ensure isRunning is set to false
-        new_state['isRunning'] = False
-    
-    elif new_state.get('type') == 'timer-reset':
-        # Start fresh with only essential properties
-        reset_data = {
-            "type": "timer-reset",
-            "isRunning": False,
-            "startTime": 0,
-            "pausedTime": 0,
-            "pausedTimeRemaining": 0,
-            "duration": new_state.get('duration', 60)
-        }
-        timer_state.clear()
-        timer_state.update(reset_data)
-        return
-    
-    # Normal property update
-    updated_state = timer_state.copy()
-    updated_state.update(new_state)
-    timer_state = updated_state
-    
-    # Ensure we have valid type
-    if 'type' not in timer_state:
-        timer_state['type'] = 'timer-sync'
+def mount_metrics(static_server, event_log, loop=None):
+    # Prometheus-style text at /metrics; with loop set, state is read on that loop
+    static_server.add_route("/metrics", metrics.route(rooms, event_log, static_server, loop))
 
-async def broadcast(message):
-    if connected_clients:
-        # Convert message to JSON string if it's a dict
-        if isinstance(message, dict):
-            message_str = json.dumps(message)
-        else:
-            message_str = message
-        
-        # Send to all clients
-        websockets_to_remove = set()
-        for websocket in connected_clients:
-            try:
-                await websocket.send(message_str if isinstance(message_str, str) else json.dumps(message_str))
-            except websockets.exceptions.ConnectionClosed:
-                websockets_to_remove.add(websocket)
-        
-        # Clean up any closed connections
-        for websocket in websockets_to_remove:
-            connected_clients.remove(websocket)
+def mount_discovery(static_server, discovery, loop=None):
+    # Where to connect plus the current match state, for a page's first frame
+    static_server.add_route("/discover", discovery.route(loop))
 
-def get_local_ip():
-    try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(('8.8.8.8', 1))
-        local_ip = s.getsockname()[0]
-        s.close()
-        return local_ip
-    except Exception as e:
-        try:
-            hostname = socket.gethostname()
-            local_ip = socket.gethostbyname(hostname)
-            if local_ip != '127.0.0.1':
-                return local_ip
-        except:
-            pass
-        return 'localhost'
+def mount_history(static_server, history):
+    # Round and match results as JSON or CSV; reads never touch the WebSocket loop
+    for path, route in history.routes().items():
+        static_server.add_route(path, route)
 
-class QRCodeWindow:
-    def __init__(self, url):
-        self.root = tk.Tk()
-        self.root.title("Score Counter - Mobile Controls")
-        
-        # Window dimensions and positioning
-        window_width = 400
-        window_height = 500
-        screen_width = self.root.winfo_screenwidth()
-        screen_height = self.root.winfo_screenheight()
-        x_position = screen_width - window_width - 20
-        y_position = 20
-        self.root.geometry(f"{window_width}x{window_height}+{x_position}+{y_position}")
-        
-        # Create and pack main frame
-        main_frame = tk.Frame(self.root, padx=20, pady=20)
-        main_frame.pack(fill=tk.BOTH, expand=True)
-        
-        # Title
-        title = tk.Label(main_frame, text="Score Counter", font=("Arial", 18, "bold"))
-        title.pack(pady=(0, 20))
-        
-        # Instructions
-        instructions = tk.Label(main_frame, 
-                                text="Scan this QR code with your mobile device\nto control the score counter",
-                                font=("Arial", 12),
-                                justify=tk.CENTER)
-        instructions.pack(pady=(0, 15))
-        
-        # Generate QR code
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(url)
-        qr.make(fit=True)
-        
-        # Convert QR code to a Tkinter-compatible image
-        qr_img = qr.make_image(fill_color="black", back_color="white")
-        buffer = BytesIO()
-        qr_img.save(buffer, format="PNG")
-        buffer.seek(0)
-        img = ImageTk.PhotoImage(Image.open(buffer))
-        
-        # Display QR code
-        qr_label = tk.Label(main_frame, image=img)
-        qr_label.image = img  # Keep a reference to prevent garbage collection
-        qr_label.pack(pady=10)
-        
-        # URL text display
-        url_label = tk.Label(main_frame, text=url, font=("Arial", 10), fg="blue")
-        url_label.pack(pady=5)
-        
-        # Add server info
-        server_info = tk.Label(main_frame, 
-                               text=f"HTTP Server: Port {HTTP_PORT}\nWebSocket Server: Port {WS_PORT}",
-                               font=("Arial", 10),
-                               justify=tk.CENTER)
-        server_info.pack(pady=(20, 0))
+def mount_history_redirect(static_server, port):
+    # The WebSocket port can't stream, so exports are sent to the discovery listener
+    def redirect(request):
+        query = urllib.parse.urlencode(request.query, doseq=True)
+        location = f"http://{request_hostname(request)}:{port}{request.path}" + (f"?{query}" if query else "")
+        return Response(307, headers={"Location": location, "Cache-Control": "no-store"})
+    for path in engine.history.routes():
+        static_server.add_route(path, redirect)
 
-    def run(self):
-        self.root.mainloop()
-
-async def start_websocket_server():
-    async with websockets.serve(counter_server, "0.0.0.0", WS_PORT):
-        print(f"WebSocket server started on 0.0.0.0:{WS_PORT}")
+async def start_websocket_server(static_server=None, http_server=None, event_log=None, port=WS_PORT, profile="default",
+                                 discovery_port=DISCOVERY_PORT):
+    # In single-port mode the same listener also answers plain HTTP asset requests
+    process_request = static_server.process_request if static_server else None
+    engine.loop_monitor = LoopMonitor()
+    engine.loop_monitor.start()
+    discovery = Discovery(rooms, engine, port)
+    if static_server:
+        static_server.assets.preload()
+        mount_metrics(static_server, event_log)
+        mount_discovery(static_server, discovery)
+    if http_server:
+        mount_metrics(http_server.static_server, event_log, asyncio.get_running_loop())
+        mount_discovery(http_server.static_server, discovery, asyncio.get_running_loop())
+        if engine.history:
+            mount_history(http_server.static_server, engine.history)
+    # In single-port mode history exports are streamed from the discovery listener
+    history_on_discovery = False
+    if discovery_port:
+        routes = engine.history.routes() if static_server and engine.history else None
+        try:
+            await discovery.serve("0.0.0.0", discovery_port, routes)
+            history_on_discovery = routes is not None
+            print(f"Discovery on port {discovery_port}: {', '.join(discovery.endpoints) or 'no LAN address'}")
+        except OSError as e:
+            # Pages still find it on the main port
+            print(f"Discovery port {discovery_port} unavailable: {e}")
+    if static_server and engine.history:
+        if history_on_discovery:
+            mount_history_redirect(static_server, discovery_port)
+        else:
+            # Buffered, up to static_server.MAX_BUFFERED_BODY
+            mount_history(static_server, engine.history)
+    async with websockets.serve(counter_server, "0.0.0.0", port, process_request=process_request,
+                                **serve_options(profile)):
+        if static_server:
+            print(f"HTTP + WebSocket server started on 0.0.0.0:{port}")
+        else:
+            print(f"WebSocket server started on 0.0.0.0:{port}")
+        print(f"Ready in {(time.perf_counter() - START_TIME) * 1000:.0f} ms")
         await asyncio.Future()  # Keep the server running forever
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Score Counter server")
+    parser.add_argument("--two-port", action="store_true",
+                        help=f"serve pages on port {HTTP_PORT} and WebSocket on port {WS_PORT} "
+                             f"(default: both on port {WS_PORT})")
+    parser.add_argument("--headless", action="store_true",
+                        default=os.environ.get("SCORECOUNTER_HEADLESS", "") not in ("", "0"),
+                        help="no QR code window and no browser, for machines without a screen "
+                             "(also set by SCORECOUNTER_HEADLESS=1)")
+    parser.add_argument("--no-browser", action="store_true", help="don't open the display page")
+    parser.add_argument("--port", type=int, default=WS_PORT,
+                        help=f"port for pages and WebSocket (default: {WS_PORT})")
+    parser.add_argument("--relay", metavar="URL",
+                        help="mirror matches from another ScoreCounter server (e.g. ws://192.168.1.10:8765) "
+                             "and serve them to clients here")
+    parser.add_argument("--profile", choices=PROFILES, default="default",
+                        help="connection settings; 'scale' trims per-connection memory for thousands "
+                             "of mostly idle screens (default: default)")
+    parser.add_argument("--discovery-port", type=int, default=DISCOVERY_PORT,
+                        help=f"port answering /discover only, 0 to turn it off (default: {DISCOVERY_PORT})")
+    parser.add_argument("--capture", metavar="FILE",
+                        help="record every frame clients send to FILE, for python bench/replay.py FILE")
+    parser.add_argument("--admin-token", default=os.environ.get("SCORECOUNTER_ADMIN_TOKEN"),
+                        help="secret that allows the profile command (also SCORECOUNTER_ADMIN_TOKEN); "
+                             "without it profiling is off")
+    parser.add_argument("--loop", choices=("auto",) + backends.LOOPS,
+                        default=os.environ.get("SCORECOUNTER_LOOP", "auto"),
+                        help="event loop; auto uses uvloop or winloop when installed (also SCORECOUNTER_LOOP)")
+    parser.add_argument("--codec", choices=("auto",) + backends.CODECS,
+                        default=os.environ.get("SCORECOUNTER_CODEC", "auto"),
+                        help="JSON codec; auto uses orjson when installed (also SCORECOUNTER_CODEC)")
+    parser.add_argument("--list-backends", action="store_true",
+                        help="print which event loops and codecs this build has, and exit")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="where match state is saved (default: match-data)")
+    parser.add_argument("--coalesce-ms", type=float, default=COALESCE_WINDOW * 1000,
+                        help="send counter updates at most once per this many ms, e.g. 16 or 33 (default: 0, at once)")
+    parser.add_argument("--log-level", default="INFO",
+                        help="DEBUG, INFO, WARNING or ERROR (default: INFO)")
+    parser.add_argument("--log-file", help="also write a rotating log file here")
+    return parser.parse_args()
+
+def list_backends():
+    found = backends.available()
+    for kind, candidates in (("loop", backends.LOOPS), ("codec", backends.CODECS)):
+        for name in candidates:
+            status = backends.version(name) if name in found[kind] else "not available"
+            print(f"{kind:6} {name:8} {status}")
+
 def main():
+    args = parse_args()
+    if args.list_backends:
+        list_backends()
+        return
+    setup_logging(args.log_level, args.log_file)
+    backends.select(args.loop, args.codec)
+    print(f"Backends: {backends.describe()}")
+    if args.profile == "scale":
+        file_limit = raise_file_limit()
+        if file_limit:
+            print(f"Scale profile: open file limit {file_limit}")
+    
+    rooms.coalesce_window = args.coalesce_ms / 1000
+
+    if args.relay:
+        # State comes from upstream; nothing to restore or journal here
+        event_log = None
+        engine.upstream = rooms.upstream = Relay(args.relay, args.admin_token)
+        print(f"Relaying matches from {args.relay}")
+    else:
+        # Restore matches from the event log before accepting clients
+        event_log = EventLog(args.data_dir)
+        restore_start = time.perf_counter()
+        replayed = rooms.attach_journal(event_log)
+        restore_ms = (time.perf_counter() - restore_start) * 1000
+        print(f"Restored {len(rooms)} match(es), replayed {replayed} event(s) in {restore_ms:.1f} ms")
+        
+        # Finished rounds and matches are kept next to the event log
+        engine.history = HistoryStore(args.data_dir)
+        engine.history.start()
+    
+    if args.admin_token:
+        engine.admin_token = args.admin_token
+        engine.profiler = SamplingProfiler(os.path.join(args.data_dir, PROFILE_DIRNAME))
+    
+    if args.capture:
+        # Starts from the restored state so a replay can too
+        engine.capture = CaptureRecorder(args.capture, rooms)
+        engine.capture.start()
+        print(f"Capturing client traffic to {args.capture}")
+    
     # Get local IP
     local_ip = get_local_ip()
     
-    # Start HTTP server in a separate thread
-    http_server = ScoreCounterHTTPServer()
-    http_server.start()
-    print(f"HTTP server started on port {HTTP_PORT}")
+    if args.two_port:
+        # Compatibility layout: HTTP server in a separate thread on its own port
+        http_server = ScoreCounterHTTPServer()
+        http_server.start()
+        static_server = None
+        page_port = HTTP_PORT
+        server_info_text = f"HTTP Server: Port {HTTP_PORT}\nWebSocket Server: Port {args.port}"
+    else:
+        # Pages and WebSocket share one port and one event loop
+        http_server = None
+        static_server = StaticServer(app_dir)
+        page_port = args.port
+        server_info_text = f"Server: Port {args.port} (pages and WebSocket)"
     
-    # Create and display the QR code window in a separate thread
-    url = f"http://{local_ip}:{HTTP_PORT}/buttons.html"
-    qr_thread = threading.Thread(target=lambda: QRCodeWindow(url).run(), daemon=True)
-    qr_thread.start()
+    url = f"http://{local_ip}:{page_port}/buttons.html"
+    display_url = f"http://localhost:{page_port}/display.html"
+    if args.headless:
+        print(f"Controls: {url}")
+        print(f"Display:  http://{local_ip}:{page_port}/display.html")
+    else:
+        # GUI modules are only loaded when there is a window to show
+        from qr_window import QRCodeWindow
+        qr_cache_dir = os.path.join(args.data_dir, QR_CACHE_DIRNAME)
+        
+        # Create and display the QR code window in a separate thread
+        qr_thread = threading.Thread(target=lambda: QRCodeWindow(url, server_info_text, qr_cache_dir).run(), daemon=True)
+        qr_thread.start()
     
     # Open the display page in the default browser
-    display_url = f"http://localhost:{HTTP_PORT}/display.html"
-    webbrowser.open(display_url)
+    if not args.headless and not args.no_browser:
+        import webbrowser
+        webbrowser.open(display_url)
     
     # Start WebSocket server in the main thread
     try:
-        asyncio.run(start_websocket_server())
+        backends.run(start_websocket_server(static_server, http_server, event_log, args.port, args.profile,
+                                            args.discovery_port))
     except KeyboardInterrupt:
         print("\nShutting down servers...")
     finally:
-        http_server.stop()
+        if http_server:
+            http_server.stop()
+        if engine.capture:
+            engine.capture.close()
+        if event_log:
+            event_log.close()
+        if engine.history:
+            engine.history.close()
+        stop_logging()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
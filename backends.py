@@ -0,0 +1,134 @@
+# Optional accelerators for the event loop and the JSON codec, picked at
+# startup. Neither is required: when a module isn't installed (or doesn't
+# work on this platform) the server runs on the stdlib asyncio loop and json
+# exactly as before.
+#
+#   loop   uvloop (Linux/macOS) or winloop (Windows), else asyncio
+#   codec  orjson, else json
+#
+# "auto" takes the first candidate that imports; a name asks for that one
+# and falls back with a warning if it isn't available. app.py takes --loop
+# and --codec (or SCORECOUNTER_LOOP / SCORECOUNTER_CODEC) and prints what
+# is active. The codec is swapped in through codec.set_codec(), so frames
+# are decoded and encoded by it everywhere; the loop is used by run() and
+# new_event_loop(). orjson writes compact JSON ({"type":"pong"}), which
+# every client parses the same.
+#
+# The modules are imported by name, so a PyInstaller build only bundles
+# them when ScoreCounter.spec lists them; python bench/bench_backends.py
+# --exe dist/ScoreCounter checks what a build actually got.
+
+import asyncio
+import importlib
+import sys
+
+import codec
+from metrics import registry as metrics
+from server_log import get_logger
+
+# Candidates in order of preference; the stdlib one always works
+LOOPS = ("uvloop", "winloop", "asyncio")
+CODECS = ("orjson", "json")
+
+# What select() settled on, for the startup report and /metrics
+active = {"loop": "asyncio", "codec": codec.name}
+
+_loop_factory = None
+
+log = get_logger("backends")
+
+
+def _import(name):
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+def load_loop(name):
+    # new_event_loop function for a loop backend, or None if unavailable
+    if name == "asyncio":
+        return asyncio.new_event_loop
+    module = _import(name)
+    if module is None:
+        return None
+    return getattr(module, "new_event_loop", None)
+
+
+def load_codec(name):
+    # (loads, dumps) for a codec backend, or None if unavailable
+    if name == "json":
+        import json
+        return json.loads, json.dumps
+    if name == "orjson":
+        orjson = _import("orjson")
+        if orjson is None:
+            return None
+        orjson_dumps = orjson.dumps
+        # Integer keys become strings like json does; frames must stay text
+        # frames, so dumps returns str
+        option = orjson.OPT_NON_STR_KEYS
+        return orjson.loads, lambda obj: orjson_dumps(obj, option=option).decode("utf-8")
+    return None
+
+
+def version(name):
+    if name in ("asyncio", "json"):
+        return f"stdlib {sys.version_info[0]}.{sys.version_info[1]}"
+    module = _import(name)
+    return getattr(module, "__version__", None) if module is not None else None
+
+
+def available():
+    # {"loop": [...], "codec": [...]} that import here
+    return {
+        "loop": [name for name in LOOPS if load_loop(name) is not None],
+        "codec": [name for name in CODECS if load_codec(name) is not None],
+    }
+
+
+def _pick(requested, candidates, loader, kind):
+    if requested not in ("auto", None, ""):
+        if requested not in candidates:
+            log.warning("Unknown %s backend %r, choosing automatically", kind, requested)
+        else:
+            backend = loader(requested)
+            if backend is not None:
+                return requested, backend
+            log.warning("%s backend %s is not installed, choosing automatically", kind.capitalize(), requested)
+    for name in candidates:
+        backend = loader(name)
+        if backend is not None:
+            return name, backend
+    raise RuntimeError(f"no {kind} backend")
+
+
+def select(loop="auto", codec_name="auto"):
+    # Pick and install the backends; returns active
+    global _loop_factory
+    loop_name, factory = _pick(loop, LOOPS, load_loop, "loop")
+    codec_choice, (codec_loads, codec_dumps) = _pick(codec_name, CODECS, load_codec, "codec")
+
+    _loop_factory = None if loop_name == "asyncio" else factory
+    codec.set_codec(codec_choice, codec_loads, codec_dumps)
+    active["loop"] = loop_name
+    active["codec"] = codec_choice
+    metrics.backends = active
+    return active
+
+
+def describe():
+    return ", ".join(f"{kind} {name} ({version(name)})" for kind, name in active.items())
+
+
+def new_event_loop():
+    # For threads that run a loop of their own (the --two-port HTTP server)
+    return (_loop_factory or asyncio.new_event_loop)()
+
+
+def run(main):
+    # asyncio.run() on the selected loop
+    if _loop_factory is None:
+        return asyncio.run(main)
+    with asyncio.Runner(loop_factory=_loop_factory) as runner:
+        return runner.run(main)
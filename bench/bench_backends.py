@@ -0,0 +1,154 @@
+# Compares the event loop and codec backends (backends.py).
+#
+#   python bench/bench_backends.py [--iterations 100000] [--duration 10]
+#   python bench/bench_backends.py --codec-only
+#   python bench/bench_backends.py --exe dist/ScoreCounter.exe
+#
+# First the codec alone: decode and encode time for the frames the server
+# handles most (incoming mutations, outgoing counter states and deltas,
+# timer states). Then every loop x codec combination installed here end to
+# end: bench/loadgen.py against a server subprocess started with that
+# combination, reporting messages delivered per second, display latency and
+# server CPU per delivered message.
+#
+# With --exe, the frozen build is asked which backends it bundled
+# (--list-backends) and compared with what is installed here; an
+# accelerator installed but missing from the build means ScoreCounter.spec
+# didn't pick it up, and the exit status is 1.
+
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import backends
+from match_state import CounterState, TimerState
+
+COUNTERS = CounterState()
+for name, value in (("Hong", 7), ("Chung", 5), ("HongGamjeom", 1), ("ChungGamjeom", 2)):
+    COUNTERS.increment(name, value)
+
+FRAMES = {
+    "increment": {"type": "increment", "counterId": "Hong", "value": 1},
+    "timer-clock": {"type": "timer-clock", "clientTime": 1760000000123.5, "rtt": 12.5},
+    "counters": COUNTERS.snapshot(),
+    "counters-delta": COUNTERS.increment("Hong"),
+    "timer": TimerState().state,
+}
+
+
+def time_per_call(function, argument, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function(argument)
+    return (time.perf_counter() - start) / iterations
+
+
+def bench_codecs(iterations):
+    names = backends.available()["codec"]
+    print(f"Codec, µs per frame ({iterations} iterations)")
+    print(f"  {'frame':16}" + "".join(f"{name + ' loads':>14}{name + ' dumps':>14}" for name in names))
+    for frame_name, message in FRAMES.items():
+        row = f"  {frame_name:16}"
+        for name in names:
+            loads, dumps = backends.load_codec(name)
+            text = json.dumps(message)
+            row += f"{time_per_call(loads, text, iterations) * 1e6:14.2f}"
+            row += f"{time_per_call(dumps, message, iterations) * 1e6:14.2f}"
+        print(row)
+    print()
+
+
+def bench_end_to_end(args):
+    found = backends.available()
+    combinations = list(itertools.product(found["loop"], found["codec"]))
+    print(f"End to end, {args.displays} displays, {args.controllers} controllers at {args.rate}/s, "
+          f"{args.duration:g} s each")
+    print(f"  {'loop':10}{'codec':8}{'delivered/s':>14}{'p50 ms':>10}{'p99 ms':>10}"
+          f"{'CPU %':>8}{'CPU µs/msg':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        for loop, codec_name in combinations:
+            output = os.path.join(directory, f"{loop}-{codec_name}.json")
+            command = [sys.executable, os.path.join(ROOT, "bench", "loadgen.py"),
+                       "--loop", loop, "--codec", codec_name, "--no-rate-limit",
+                       "--displays", str(args.displays), "--controllers", str(args.controllers),
+                       "--rate", str(args.rate), "--duration", str(args.duration), "--output", output]
+            result = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+            if result.returncode != 0 or not os.path.exists(output):
+                print(f"  {loop:10}{codec_name:8}  failed: {result.stderr.strip()[-200:]}")
+                continue
+            with open(output) as f:
+                results = json.load(f)
+
+            received = results["receivedPerSecond"]
+            latency = results["latency"].get("counter", {})
+            cpu_seconds = results["server"]["cpuSeconds"]
+            cpu_percent = results["server"]["cpuPercent"]
+            per_message = None
+            if cpu_seconds is not None and received:
+                per_message = cpu_seconds / (received * args.duration) * 1e6
+            print(f"  {loop:10}{codec_name:8}{received:14,.0f}"
+                  f"{format_number(latency.get('p50_ms')):>10}{format_number(latency.get('p99_ms')):>10}"
+                  f"{format_number(cpu_percent, 1):>8}{format_number(per_message, 1):>12}")
+    print()
+
+
+def format_number(value, digits=3):
+    return "-" if value is None else f"{value:.{digits}f}"
+
+
+def check_exe(path):
+    # Which backends the frozen build has, against those installed here
+    result = subprocess.run([path, "--list-backends"], capture_output=True, text=True, timeout=60)
+    if result.returncode != 0:
+        print(f"{path} --list-backends failed:\n{result.stdout}{result.stderr}")
+        return 1
+    bundled = set()
+    for line in result.stdout.splitlines():
+        parts = line.split()
+        if len(parts) >= 3 and parts[2] != "not":
+            bundled.add(parts[1])
+
+    found = backends.available()
+    installed = set(found["loop"]) | set(found["codec"])
+    print(f"Backends in {path}:")
+    print(result.stdout.rstrip())
+    missing = sorted(installed - bundled)
+    if missing:
+        print(f"Installed here but not bundled: {', '.join(missing)} (add them to ScoreCounter.spec)")
+        return 1
+    print("Every backend installed here is bundled")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=100000, help="codec iterations per frame")
+    parser.add_argument("--codec-only", action="store_true", help="skip the end-to-end runs")
+    parser.add_argument("--displays", type=int, default=50, help="display clients per run (default: 50)")
+    parser.add_argument("--controllers", type=int, default=4, help="controller clients per run (default: 4)")
+    parser.add_argument("--rate", type=float, default=20, help="messages per second per controller (default: 20)")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per run (default: 10)")
+    parser.add_argument("--exe", help="check which backends a PyInstaller build bundled")
+    args = parser.parse_args()
+
+    if args.exe:
+        sys.exit(check_exe(args.exe))
+
+    found = backends.available()
+    print(f"Installed: loops {', '.join(found['loop'])}; codecs {', '.join(found['codec'])}")
+    print()
+    bench_codecs(args.iterations)
+    if not args.codec_only:
+        bench_end_to_end(args)
+
+
+if __name__ == "__main__":
+    main()
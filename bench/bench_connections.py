@@ -0,0 +1,127 @@
+# Memory footprint of mostly-idle connections: starts app.py --headless,
+# opens N display connections that only listen, and reports the server's
+# resident memory before and after, per connection.
+#
+#   python bench/bench_connections.py [--connections 10000] [--profile scale]
+#
+# Linux only (reads /proc/<pid>/status). The client side needs a file
+# descriptor per connection too, so raise `ulimit -n` above N first.
+
+import argparse
+import asyncio
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Connections opened at once while ramping up
+CONNECT_BATCH = 200
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def resident_kb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+async def wait_for_port(port, timeout=30):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.05)
+    raise RuntimeError("server did not start")
+
+
+async def open_display(url, compression):
+    websocket = await websockets.connect(url, compression=compression, max_size=None, open_timeout=60)
+    # Initial snapshot: counters and timer
+    await websocket.recv()
+    await websocket.recv()
+    return websocket
+
+
+async def settle(pid, seconds=2.0):
+    # Let the server's allocator settle before reading its footprint
+    await asyncio.sleep(seconds)
+    return resident_kb(pid)
+
+
+async def run(args):
+    port = free_port()
+    command = [sys.executable, os.path.join(ROOT, "app.py"), "--headless", "--port", str(port),
+               "--log-level", "WARNING", "--profile", args.profile]
+    with tempfile.TemporaryDirectory() as data_dir:
+        process = subprocess.Popen(command + ["--data-dir", data_dir],
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=ROOT)
+        try:
+            await wait_for_port(port)
+            baseline = await settle(process.pid)
+
+            url = f"ws://127.0.0.1:{port}/?match=bench"
+            compression = None if args.client_compression == "none" else "deflate"
+            connections = []
+            start = time.perf_counter()
+            while len(connections) < args.connections:
+                count = min(CONNECT_BATCH, args.connections - len(connections))
+                connections.extend(await asyncio.gather(*(open_display(url, compression) for _ in range(count))))
+            connect_time = time.perf_counter() - start
+
+            loaded = await settle(process.pid)
+            if args.hold:
+                # Stay connected through a few server pings
+                await asyncio.sleep(args.hold)
+            held = resident_kb(process.pid)
+            alive = sum(1 for websocket in connections if websocket.state is websockets.protocol.State.OPEN)
+
+            await asyncio.gather(*(websocket.close() for websocket in connections))
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+
+    per_connection = (max(loaded, held) - baseline) / args.connections
+    print(f"Profile {args.profile}, client compression {args.client_compression}, {args.connections} connections")
+    print(f"  connected in {connect_time:.1f} s, {alive} still open after {args.hold:.0f} s")
+    print(f"  server RSS  idle {baseline / 1024:7.1f} MiB   loaded {loaded / 1024:7.1f} MiB"
+          f"   after hold {held / 1024:7.1f} MiB")
+    print(f"  per connection {per_connection:.1f} KiB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--profile", default="default", help="server connection profile (default or scale)")
+    parser.add_argument("--client-compression", choices=("deflate", "none"), default="deflate",
+                        help="whether clients offer permessage-deflate, as browsers do (default: deflate)")
+    parser.add_argument("--hold", type=float, default=0, help="seconds to stay connected after ramp-up")
+    args = parser.parse_args()
+
+    # One descriptor per connection on this side as well
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = args.connections + 100
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# Message engine microbenchmarks: decode + validation cost per message type,
+# rejection cost for malformed frames, and full dispatch into a room.
+#
+#   python bench/bench_dispatch.py [--iterations 200000]
+#
+# Also checks that every malformed frame is answered with an error and
+# leaves the match alone; exits 1 if one isn't.
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import codec
+from message_engine import MessageEngine, MessageError, Session, decode_frame
+from rate_limit import ClientLimiter
+from rooms import DEFAULT_MATCH_ID, RoomRegistry
+from server_log import setup_logging, stop_logging
+
+VALID_FRAMES = {
+    "increment": {"type": "increment", "counterId": "Hong", "value": 1},
+    "subtract-counter": {"type": "subtract-counter", "counterId": "Chung", "value": 1},
+    "reset-counters": {"type": "reset-counters"},
+    "hello": {"type": "hello", "deltas": True},
+    "timer-start": {"type": "timer-start", "duration": 120},
+    "timer-pause": {"type": "timer-pause"},
+    "timer-sync-request": {"type": "timer-sync-request"},
+    "ping": {"type": "ping"},
+}
+
+INVALID_FRAMES = {
+    "not JSON": "{\"type\": \"increment\"",
+    "not an object": "[1, 2, 3]",
+    "unknown type": json.dumps({"type": "explode"}),
+    "missing field": json.dumps({"type": "increment", "value": 1}),
+    "wrong field type": json.dumps({"type": "increment", "counterId": "Hong", "value": "1"}),
+    "oversized": json.dumps({"type": "increment", "counterId": "x" * 20000}),
+    "huge duration": json.dumps({"type": "timer-reset", "duration": 1e308}),
+    "negative duration": json.dumps({"type": "timer-start", "duration": -60}),
+    "batch duration": json.dumps({"type": "batch", "ops": [{"type": "timer-reset", "duration": 10**9}]}),
+    "far-off start time": json.dumps({"type": "match-end", "rounds": 3, "startedAt": 1e300}),
+    "non-finite value": '{"type": "increment", "counterId": "Hong", "value": 1e400}',
+}
+
+# Messages the dispatch benchmark replays; no hello, it re-sends snapshots
+DISPATCH_TYPES = ("increment", "subtract-counter", "timer-start", "timer-pause", "ping")
+
+
+class NullWebSocket:
+    remote_address = ("bench", 0)
+    path = ""
+
+    async def send(self, payload):
+        pass
+
+
+class RecordingWebSocket(NullWebSocket):
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, payload):
+        self.sent.append(payload)
+
+
+def per_message_us(elapsed, iterations):
+    return elapsed / iterations * 1e6
+
+
+def bench_decode(iterations):
+    print("Decode + validate (µs/message):")
+    for message_type, message in VALID_FRAMES.items():
+        frame = json.dumps(message)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            decode_frame(frame)
+        elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            codec.loads(frame)
+        baseline = time.perf_counter() - start
+        print(f"  {message_type:20} {per_message_us(elapsed, iterations):6.2f}"
+              f"   (codec alone {per_message_us(baseline, iterations):.2f})")
+
+
+def bench_reject(iterations):
+    print("Reject (µs/message):")
+    for reason, frame in INVALID_FRAMES.items():
+        start = time.perf_counter()
+        for _ in range(iterations):
+            try:
+                decode_frame(frame)
+            except MessageError:
+                pass
+        elapsed = time.perf_counter() - start
+        print(f"  {reason:20} {per_message_us(elapsed, iterations):6.2f}")
+
+
+async def check_rejected():
+    # Each malformed frame gets an error reply and changes nothing
+    rooms = RoomRegistry()
+    engine = MessageEngine(rooms, rate_limit=False)
+    failed = []
+    for reason, frame in INVALID_FRAMES.items():
+        websocket = RecordingWebSocket()
+        session = Session(engine, websocket)
+        session.room = rooms.join(websocket, DEFAULT_MATCH_ID)
+        before = session.room.snapshot()
+        await engine.dispatch(session, frame)
+        await asyncio.sleep(0.01)
+        replies = [codec.loads(payload) for payload in websocket.sent]
+        if not any(reply.get("type") == "error" for reply in replies) or session.room.snapshot() != before:
+            failed.append(reason)
+        rooms.leave(websocket, session.room)
+    print(f"Malformed frames answered with an error: {len(INVALID_FRAMES) - len(failed)}/{len(INVALID_FRAMES)}")
+    for reason in failed:
+        print(f"  not rejected: {reason}")
+    return not failed
+
+
+def check_relay_limits():
+    # Only a relay with the admin token skips the rate limits
+    engine = MessageEngine(RoomRegistry())
+    engine.admin_token = "secret"
+    cases = {"controller": ("", True), "relay without token": ("?role=relay", True),
+             "relay with wrong token": ("?role=relay&token=guess", True),
+             "relay with token": ("?role=relay&token=secret", False)}
+    failed = []
+    for name, (query, limited) in cases.items():
+        websocket = NullWebSocket()
+        websocket.path = "/" + query
+        if (Session(engine, websocket).limiter is not None) != limited:
+            failed.append(name)
+    print(f"Relay rate limits: {len(cases) - len(failed)}/{len(cases)} as expected")
+    for name in failed:
+        print(f"  wrong: {name}")
+    return not failed
+
+
+def bench_rate_limit(iterations):
+    limiter = ClientLimiter({"increment": (float("inf"), float("inf"), "dropped")})
+    start = time.perf_counter()
+    for _ in range(iterations):
+        limiter.allow("increment")
+    elapsed = time.perf_counter() - start
+    print(f"Rate limit check (µs/message): {per_message_us(elapsed, iterations):.2f}")
+
+
+async def bench_dispatch(iterations):
+    rooms = RoomRegistry()
+    engine = MessageEngine(rooms, rate_limit=False)
+    websocket = NullWebSocket()
+    session = Session(engine, websocket)
+    session.room = rooms.join(websocket, DEFAULT_MATCH_ID)
+
+    print("Full dispatch into a room, one client, no rate limit (µs/message):")
+    for message_type in DISPATCH_TYPES:
+        frame = json.dumps(VALID_FRAMES[message_type])
+        start = time.perf_counter()
+        for i in range(iterations):
+            await engine.dispatch(session, frame)
+            if i % 32 == 0:
+                # Let the writer drain so the queue stays short
+                await asyncio.sleep(0)
+        elapsed = time.perf_counter() - start
+        print(f"  {message_type:20} {per_message_us(elapsed, iterations):6.2f}")
+
+    rooms.leave(websocket, session.room)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+
+    print(f"Codec: {codec.name}, {args.iterations} iterations\n")
+    bench_decode(args.iterations)
+    print()
+    bench_reject(args.iterations)
+    print()
+    bench_rate_limit(args.iterations)
+    print()
+    asyncio.run(bench_dispatch(args.iterations // 4))
+    print()
+    # The rejections are expected; keep their warnings out of the report
+    setup_logging("ERROR")
+    try:
+        rejected = asyncio.run(check_rejected())
+    finally:
+        stop_logging()
+    if not check_relay_limits() or not rejected:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# Cold start benchmark: time from launching app.py --headless to the
+# server accepting connections.
+#
+#   python bench/bench_startup.py [--runs 5] [--exe dist/ScoreCounter.exe]
+#
+# Reports the wall-clock time measured from outside (interpreter or exe
+# startup included) and the "Ready in" time app.py prints itself (from its
+# first import to listening). With --imports, also lists the slowest
+# imports from python -X importtime.
+
+import argparse
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+                return
+        except OSError:
+            time.sleep(0.005)
+    raise RuntimeError("server did not start")
+
+
+def run_once(command):
+    port = free_port()
+    with tempfile.TemporaryDirectory() as data_dir:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            command + ["--headless", "--port", str(port), "--data-dir", data_dir, "--log-level", "WARNING"],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, cwd=ROOT)
+        try:
+            wait_for_port(port, process)
+            wall = time.perf_counter() - start
+        finally:
+            process.terminate()
+            output = process.communicate(timeout=10)[0]
+
+    match = re.search(r"Ready in (\d+) ms", output)
+    return wall * 1000, int(match.group(1)) if match else None
+
+
+def slowest_imports(count):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"],
+                            capture_output=True, text=True, cwd=ROOT)
+    rows = []
+    for line in result.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]), parts[2].rstrip()))
+    rows.sort(reverse=True)
+    return rows[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--exe", help="frozen executable to measure instead of python app.py")
+    parser.add_argument("--imports", type=int, default=0, help="list the N slowest imports")
+    args = parser.parse_args()
+
+    command = [args.exe] if args.exe else [sys.executable, os.path.join(ROOT, "app.py")]
+    walls, readies = [], []
+    for _ in range(args.runs):
+        wall, ready = run_once(command)
+        walls.append(wall)
+        if ready is not None:
+            readies.append(ready)
+
+    print(f"Cold start over {args.runs} runs ({' '.join(command)} --headless):")
+    print(f"  wall clock to listening  median {statistics.median(walls):7.1f} ms   min {min(walls):7.1f} ms")
+    if readies:
+        print(f"  app-reported ready       median {statistics.median(readies):7.1f} ms   min {min(readies):7.1f} ms")
+
+    if args.imports:
+        print(f"\nSlowest imports (cumulative µs):")
+        for cumulative, name in slowest_imports(args.imports):
+            print(f"  {cumulative:9d}  {name}")
+
+
+if __name__ == "__main__":
+    main()
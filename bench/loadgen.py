@@ -0,0 +1,518 @@
+# Load generator for the WebSocket server.
+#
+#   python bench/loadgen.py --displays 50 --controllers 4 --rate 10 --duration 20
+#   python bench/loadgen.py --in-process --output results.json
+#   python bench/loadgen.py --url ws://192.168.1.20:8765/ --displays 20
+#   python bench/loadgen.py --compare baseline.json --output current.json
+#
+# Starts the server (as a subprocess by default, or in a thread with
+# --in-process, or not at all with --url), connects N displays and M
+# controllers speaking the real protocol, and measures end-to-end latency:
+# from a controller sending a message to each display receiving the
+# resulting update. Spectators (--spectators) are timed the same way, but
+# only see the states their throttled tier sends. Controllers also time
+# ping and timer-sync-request round trips.
+#
+# Each controller increments its own counter, so the display can match a
+# counter value back to the moment it was sent. Timer starts and resets
+# carry a duration unique to that send, which the server echoes, so they
+# are matched by it; pauses echo whatever duration is current and are sent
+# but not timed.
+#
+# All clients share one event loop, so with hundreds of displays the
+# generator itself can become the limit; watch its CPU, or split the
+# clients over several loadgen processes pointed at one server with --url.
+#
+# Results are JSON. With --compare, p99 latencies are checked against an
+# earlier result and the exit status is 1 if any got worse than
+# --max-regression allows.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import websockets
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Share of controller messages by type
+DEFAULT_MIX = {
+    "increment": 70,
+    "subtract-counter": 10,
+    "timer": 10,
+    "ping": 5,
+    "timer-sync-request": 5,
+}
+
+TIMER_CYCLE = ("timer-start", "timer-pause", "timer-reset")
+
+# Timer durations used as send IDs: 5 to 24 hours (match_state.MAX_DURATION)
+MARKER_BASE = 5 * 3600
+MARKER_SPAN = 19 * 3600
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def summarize(samples):
+    values = sorted(samples)
+    ms = lambda value: None if value is None else round(value * 1000, 3)
+    return {
+        "count": len(values),
+        "p50_ms": ms(percentile(values, 0.50)),
+        "p95_ms": ms(percentile(values, 0.95)),
+        "p99_ms": ms(percentile(values, 0.99)),
+        "max_ms": ms(values[-1] if values else None),
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.sent = {}
+        self.received = 0
+        self.errors = 0
+        self.recording = False
+        # Send times of in-flight mutations, matched by displays
+        self.pending = {}
+        # Timer sends by their unique duration: [type, send time, displays yet to see it]
+        self.pending_timers = {}
+        # Durations double as per-send IDs; hours long, so never running out during a run
+        self.next_marker = MARKER_BASE
+
+    def sent_message(self, message_type):
+        if self.recording:
+            self.sent[message_type] = self.sent.get(message_type, 0) + 1
+
+    def timer_sent(self, message_type, now, displays):
+        # Wraps within the durations the server accepts; unique for any sane run
+        self.next_marker = MARKER_BASE + (self.next_marker - MARKER_BASE + 1) % MARKER_SPAN
+        self.pending_timers[self.next_marker] = [message_type, now, displays]
+        return self.next_marker
+
+    def timer_seen(self, message_type, marker, counted=True):
+        # Send time of the timer message a display just got, or None; the
+        # entry goes once every display has seen it
+        entry = self.pending_timers.get(marker)
+        if entry is None or entry[0] != message_type:
+            return None
+        if counted:
+            entry[2] -= 1
+            if entry[2] <= 0:
+                del self.pending_timers[marker]
+        return entry[1]
+
+    def observe(self, kind, seconds):
+        if self.recording:
+            self.latencies.setdefault(kind, []).append(seconds)
+
+
+# Server side
+
+def serve_forever(port, coalesce_ms, journal_dir, rate_limit=True, ready=None, stop=None, loop="auto", codec="auto"):
+    # Runs the real engine on its own event loop
+    import backends
+    from event_log import EventLog
+    from message_engine import MessageEngine
+    from rooms import RoomRegistry
+    from server_log import setup_logging
+
+    setup_logging("WARNING")
+    backends.select(loop, codec)
+    rooms = RoomRegistry(coalesce_window=coalesce_ms / 1000)
+    event_log = None
+    if journal_dir:
+        event_log = EventLog(journal_dir)
+        rooms.attach_journal(event_log)
+    engine = MessageEngine(rooms, rate_limit=rate_limit)
+
+    async def main():
+        async with websockets.serve(engine.handle_connection, "127.0.0.1", port) as server:
+            bound_port = server.sockets[0].getsockname()[1]
+            if ready is not None:
+                ready(bound_port)
+            else:
+                print(f"READY {bound_port}", flush=True)
+            if stop is not None:
+                while not stop.is_set():
+                    await asyncio.sleep(0.05)
+            else:
+                await asyncio.Future()
+
+    try:
+        backends.run(main())
+    finally:
+        if event_log is not None:
+            event_log.close()
+
+
+class InProcessServer:
+    def __init__(self, args):
+        self.args = args
+        self.port = None
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        self._ready.wait()
+        return self.port
+
+    def _run(self):
+        def ready(port):
+            self.port = port
+            self._ready.set()
+        serve_forever(0, self.args.coalesce_ms, self.args.journal_dir, not self.args.no_rate_limit, ready, self._stop,
+                      self.args.loop, self.args.codec)
+
+    def usage(self):
+        # CPU of the server thread only; RSS is the whole process, clients included
+        try:
+            cpu = time.clock_gettime(time.pthread_getcpuclockid(self.thread.ident))
+        except (AttributeError, OSError):
+            cpu = None
+        return {"cpu_seconds": cpu, "rss_mb": process_rss_mb(os.getpid())}
+
+    def stop(self):
+        self._stop.set()
+        self.thread.join(5)
+
+
+class SubprocessServer:
+    def __init__(self, args):
+        self.args = args
+        self.process = None
+
+    def start(self):
+        command = [sys.executable, os.path.abspath(__file__), "--serve", "--port", "0",
+                   "--coalesce-ms", str(self.args.coalesce_ms), "--loop", self.args.loop, "--codec", self.args.codec]
+        if self.args.journal_dir:
+            command += ["--journal-dir", self.args.journal_dir]
+        if self.args.no_rate_limit:
+            command += ["--no-rate-limit"]
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True, cwd=ROOT)
+        line = self.process.stdout.readline()
+        if not line.startswith("READY"):
+            raise RuntimeError(f"server did not start: {line!r}")
+        return int(line.split()[1])
+
+    def usage(self):
+        return {"cpu_seconds": process_cpu_seconds(self.process.pid), "rss_mb": process_rss_mb(self.process.pid)}
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def process_cpu_seconds(pid):
+    if psutil is not None:
+        times = psutil.Process(pid).cpu_times()
+        return times.user + times.system
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def process_rss_mb(pid):
+    if psutil is not None:
+        return round(psutil.Process(pid).memory_info().rss / 2**20, 1)
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+# Client side
+
+async def display_client(url, recorder, connections, prefix=""):
+    # Runs until run_load() closes the connection; prefix tells spectator
+    # latencies apart from display ones
+    last_values = {}
+    async with websockets.connect(url, max_queue=None) as websocket:
+        connections.append(websocket)
+        await websocket.send(json.dumps({"type": "hello", "deltas": True}))
+        async for frame in websocket:
+            now = time.perf_counter()
+            recorder.received += 1
+            data = json.loads(frame)
+            message_type = data.get("type")
+            if message_type == "counters-delta":
+                changes = data.get("changes", {})
+            elif message_type == "counters":
+                # Snapshots repeat unchanged counters; only time the ones that moved
+                values = data.get("values", {})
+                changes = {k: v for k, v in values.items() if last_values.get(k) != v}
+                last_values = values
+            elif message_type in TIMER_CYCLE:
+                # The server keeps the time, so the duration is the one field echoed back.
+                # Spectators may skip states, so only displays count towards popping it.
+                sent_at = recorder.timer_seen(message_type, data.get("duration"), counted=not prefix)
+                if sent_at is not None:
+                    recorder.observe(prefix + "timer", now - sent_at)
+                continue
+            else:
+                continue
+            for counter_id, value in changes.items():
+                sent_at = recorder.pending.get((counter_id, value))
+                if sent_at is not None:
+                    recorder.observe(prefix + "counter", now - sent_at)
+
+
+async def controller_client(url, index, args, recorder, stop):
+    counter_id = f"bench-{index}"
+    sub_counter_id = f"bench-{index}-sub"
+    value = 0
+    timer_step = 0
+    rtt_waiters = {}
+    types = list(args.mix)
+    weights = [args.mix[t] for t in types]
+
+    async with websockets.connect(url, max_queue=None) as websocket:
+        await websocket.send(json.dumps({"type": "hello", "deltas": True}))
+
+        async def reader():
+            async for frame in websocket:
+                data = json.loads(frame)
+                message_type = data.get("type")
+                if message_type == "error":
+                    recorder.errors += 1
+                # Replies to this controller's own round-trip probes; the timer
+                # reply carries the current state's type, so any timer message counts
+                if message_type == "pong":
+                    key = "ping"
+                elif message_type == "timer-sync" or message_type in TIMER_CYCLE:
+                    key = "timer-sync-request"
+                else:
+                    key = None
+                if key in rtt_waiters:
+                    recorder.observe(key, time.perf_counter() - rtt_waiters.pop(key))
+
+        reader_task = asyncio.create_task(reader())
+        interval = 1 / args.rate
+        next_send = time.perf_counter() + random.random() * interval
+        try:
+            while not stop.is_set():
+                delay = next_send - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                next_send += interval
+
+                choice = random.choices(types, weights)[0]
+                now = time.perf_counter()
+                if choice == "increment":
+                    value += 1
+                    recorder.pending[(counter_id, value)] = now
+                    message = {"type": "increment", "counterId": counter_id, "value": 1}
+                elif choice == "subtract-counter":
+                    message = {"type": "subtract-counter", "counterId": sub_counter_id, "value": 1}
+                elif choice == "timer":
+                    timer_type = TIMER_CYCLE[timer_step % len(TIMER_CYCLE)]
+                    timer_step += 1
+                    message = {"type": timer_type}
+                    # A pause can't carry an ID of its own, so only starts and resets are timed
+                    if timer_type != "timer-pause":
+                        message.update(duration=recorder.timer_sent(timer_type, now, args.displays))
+                else:
+                    if choice in rtt_waiters:
+                        # Previous probe still outstanding, don't overlap them
+                        continue
+                    rtt_waiters[choice] = now
+                    message = {"type": choice}
+
+                await websocket.send(json.dumps(message))
+                recorder.sent_message(message["type"])
+        finally:
+            reader_task.cancel()
+
+
+async def run_load(url, args, server):
+    recorder = Recorder()
+    stop = asyncio.Event()
+
+    displays = []
+    display_connections = []
+    for _ in range(args.displays):
+        displays.append(asyncio.create_task(display_client(url, recorder, display_connections)))
+        # Don't hit the listener with every handshake at once
+        await asyncio.sleep(0.002)
+    spectator_url = url + ("&" if "?" in url else "?") + "role=spectator"
+    for _ in range(args.spectators):
+        displays.append(asyncio.create_task(
+            display_client(spectator_url, recorder, display_connections, "spectator-")))
+        await asyncio.sleep(0.002)
+    await asyncio.sleep(0.5)
+
+    controllers = [
+        asyncio.create_task(controller_client(url, index, args, recorder, stop))
+        for index in range(args.controllers)
+    ]
+
+    await asyncio.sleep(args.warmup)
+    usage_before = server.usage() if server is not None else {}
+    recorder.recording = True
+    started = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    recorder.recording = False
+    elapsed = time.perf_counter() - started
+    usage = server.usage() if server is not None else {}
+
+    # Server CPU spent during the measured window only
+    if usage.get("cpu_seconds") is not None and usage_before.get("cpu_seconds") is not None:
+        usage["cpu_seconds"] -= usage_before["cpu_seconds"]
+    else:
+        usage["cpu_seconds"] = None
+
+    stop.set()
+    for websocket in display_connections:
+        await websocket.close()
+    results = await asyncio.gather(*controllers, *displays, return_exceptions=True)
+    failures = [r for r in results if isinstance(r, Exception)]
+    return recorder, elapsed, usage, failures
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, max_regression):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    regressions = []
+    print(f"Compared with {baseline_path} ({baseline.get('commit')}):", file=sys.stderr)
+    for kind, summary in results["latency"].items():
+        before = baseline.get("latency", {}).get(kind, {}).get("p99_ms")
+        after = summary["p99_ms"]
+        if before is None or after is None:
+            continue
+        change = (after - before) / before if before else 0
+        print(f"  {kind:20} p99 {before:8.3f} -> {after:8.3f} ms ({change:+.0%})", file=sys.stderr)
+        if change > max_regression:
+            regressions.append(kind)
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="WebSocket load generator")
+    parser.add_argument("--displays", type=int, default=20, help="display clients (default: 20)")
+    parser.add_argument("--spectators", type=int, default=0,
+                        help="read-only spectator clients on the throttled tier (default: 0)")
+    parser.add_argument("--controllers", type=int, default=2, help="controller clients (default: 2)")
+    parser.add_argument("--rate", type=float, default=5, help="messages per second per controller (default: 5)")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to measure (default: 10)")
+    parser.add_argument("--warmup", type=float, default=1, help="seconds before measuring (default: 1)")
+    parser.add_argument("--mix", type=json.loads, default=DEFAULT_MIX,
+                        help=f"message mix as JSON weights (default: {json.dumps(DEFAULT_MIX)})")
+    parser.add_argument("--coalesce-ms", type=float, default=0, help="server coalescing window")
+    parser.add_argument("--journal-dir", help="journal matches to this directory (default: off)")
+    parser.add_argument("--no-rate-limit", action="store_true", help="turn off per-client rate limits")
+    parser.add_argument("--loop", default="auto", help="server event loop: auto, asyncio, uvloop, winloop")
+    parser.add_argument("--codec", default="auto", help="server JSON codec: auto, json, orjson")
+    parser.add_argument("--in-process", action="store_true", help="run the server in a thread of this process")
+    parser.add_argument("--url", help="load an already running server instead of starting one")
+    parser.add_argument("--output", help="write the JSON results here (default: stdout)")
+    parser.add_argument("--compare", help="earlier results to compare p99 latency against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="allowed p99 increase with --compare (default: 0.2 = 20%%)")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.serve:
+        serve_forever(args.port, args.coalesce_ms, args.journal_dir, not args.no_rate_limit,
+                      loop=args.loop, codec=args.codec)
+        return
+
+    if args.url:
+        server = None
+        url = args.url
+    else:
+        server = InProcessServer(args) if args.in_process else SubprocessServer(args)
+        url = f"ws://127.0.0.1:{server.start()}/"
+
+    try:
+        recorder, elapsed, usage, failures = asyncio.run(run_load(url, args, server))
+    finally:
+        if server is not None:
+            server.stop()
+
+    cpu_seconds = usage.get("cpu_seconds")
+    results = {
+        "commit": git_commit(),
+        "config": {
+            "displays": args.displays,
+            "spectators": args.spectators,
+            "controllers": args.controllers,
+            "rate": args.rate,
+            "duration": args.duration,
+            "mix": args.mix,
+            "coalesceMs": args.coalesce_ms,
+            "journal": bool(args.journal_dir),
+            "rateLimit": not args.no_rate_limit,
+            "loop": args.loop,
+            "codec": args.codec,
+            "server": "url" if args.url else "in-process" if args.in_process else "subprocess",
+        },
+        "latency": {kind: summarize(samples) for kind, samples in sorted(recorder.latencies.items())},
+        "sent": recorder.sent,
+        "sentPerSecond": round(sum(recorder.sent.values()) / elapsed, 1),
+        "receivedPerSecond": round(recorder.received / elapsed, 1),
+        "errors": recorder.errors,
+        "clientFailures": len(failures),
+        "server": {
+            "cpuSeconds": None if cpu_seconds is None else round(cpu_seconds, 3),
+            "cpuPercent": None if cpu_seconds is None else round(100 * cpu_seconds / elapsed, 1),
+            "rssMb": usage.get("rss_mb"),
+        },
+    }
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.max_regression)
+        if regressions:
+            print(f"p99 regression in: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
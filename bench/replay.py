@@ -0,0 +1,191 @@
+# Replays a traffic capture (app.py --capture FILE) through the message
+# engine, in process, and checks the match ends in the recorded state.
+#
+#   python bench/replay.py CAPTURE [--speed 1] [--no-rate-limit]
+#
+# --speed 1 keeps the original timing, 2 runs twice as fast, 0 as fast as
+# possible. Frames are handed to the engine in recorded order, each one
+# handled before the next, and rate limits run on the recorded timestamps,
+# so the same frames are throttled as on the day at any speed. Reports
+# throughput and compares the final counters (values and seq) and timers
+# with the STATE recorded when the capture ended; exits 1 on a mismatch.
+# Timers are only compared at --speed 1, since how far a running timer got
+# depends on wall time; the same goes for a match that sat empty long
+# enough to be closed (rooms.ROOM_IDLE_TIMEOUT) during the capture.
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import capture
+from message_engine import MessageEngine
+from metrics import registry as metrics
+from rooms import RoomRegistry
+from server_log import setup_logging, stop_logging
+
+
+class ReplayRequest:
+    def __init__(self, path):
+        self.path = path
+
+
+class ReplayWebSocket:
+    # Stands in for a client connection: frames come from the capture,
+    # whatever the server sends is counted and dropped
+    def __init__(self, connection_id, path):
+        self.request = ReplayRequest(path)
+        self.remote_address = ("replay", connection_id)
+        self.frames = asyncio.Queue()
+        # Resolved when the engine asks for the next frame, i.e. the last one was handled
+        self.waiter = None
+        self.sent = 0
+        self.sent_bytes = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+        frame = await self.frames.get()
+        if frame is None:
+            raise StopAsyncIteration
+        return frame
+
+    def feed(self, frame):
+        # Queue a frame (None ends the connection); await the result to wait until it's handled
+        self.waiter = asyncio.get_running_loop().create_future()
+        self.frames.put_nowait(frame)
+        return self.waiter
+
+    async def send(self, payload):
+        self.sent += 1
+        self.sent_bytes += len(payload)
+
+    async def close(self, code=1000, reason=""):
+        self.frames.put_nowait(None)
+
+
+def comparable(snapshot, with_timers):
+    state = {}
+    for match_id, room in snapshot.items():
+        entry = {"counters": room.get("counters", {}), "seq": room.get("seq", 0)}
+        if with_timers:
+            timer = room.get("timer", {})
+            entry["timer"] = (timer.get("type"), timer.get("duration"))
+        state[match_id] = entry
+    return state
+
+
+def differences(expected, actual):
+    lines = []
+    for match_id in sorted(set(expected) | set(actual)):
+        if expected.get(match_id) != actual.get(match_id):
+            lines.append(f"  {match_id}: recorded {expected.get(match_id)}, replayed {actual.get(match_id)}")
+    return lines
+
+
+async def replay(args):
+    rooms = RoomRegistry()
+    engine = MessageEngine(rooms, rate_limit=not args.no_rate_limit)
+    # Rate limits see the time each frame was recorded at
+    now = [0.0]
+    engine.clock = lambda: now[0]
+
+    connections = {}
+    websockets = []
+    tasks = []
+    initial = final = None
+    frames = 0
+    opened = 0
+    replay_start = time.perf_counter()
+    first_time = None
+
+    for seconds, connection_id, kind, payload in capture.read_capture(args.capture):
+        if kind == capture.STATE:
+            if initial is None:
+                initial = payload
+                for match_id, state in payload.items():
+                    rooms.get(match_id).restore(state)
+            else:
+                final = payload
+            continue
+
+        if first_time is None:
+            first_time = seconds
+        if args.speed:
+            # Keep the recorded spacing, scaled
+            delay = (seconds - first_time) / args.speed - (time.perf_counter() - replay_start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        now[0] = seconds
+
+        if kind == capture.OPEN:
+            websocket = connections[connection_id] = ReplayWebSocket(connection_id, payload)
+            websockets.append(websocket)
+            websocket.waiter = asyncio.get_running_loop().create_future()
+            tasks.append(asyncio.create_task(engine.handle_connection(websocket)))
+            # Connected once the engine waits for its first frame
+            await websocket.waiter
+            opened += 1
+        elif kind in (capture.TEXT, capture.BINARY):
+            websocket = connections.get(connection_id)
+            if websocket is not None:
+                await websocket.feed(payload)
+                frames += 1
+        elif kind == capture.CLOSE:
+            websocket = connections.pop(connection_id, None)
+            if websocket is not None:
+                websocket.feed(None)
+
+    # Connections still open when the capture ended
+    for websocket in connections.values():
+        websocket.feed(None)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - replay_start
+    sent = sum(websocket.sent for websocket in websockets)
+    sent_bytes = sum(websocket.sent_bytes for websocket in websockets)
+
+    print(f"Replayed {frames} frames on {opened} connections in {elapsed:.3f} s "
+          f"({frames / elapsed if elapsed else 0:,.0f} frames/s, speed {args.speed or 'max'})")
+    print(f"  sent {sent} messages, {sent_bytes / 1024:.1f} KiB to clients")
+    for message_type, count in sorted(metrics.messages.items()):
+        print(f"  {message_type:24} {count}")
+    print(f"  rejected {metrics.rejected}, throttled {sum(metrics.throttled.values())}")
+
+    if final is None:
+        print("No final state in the capture (cut short?), nothing to compare")
+        return 0
+    with_timers = args.speed == 1
+    diff = differences(comparable(final, with_timers), comparable(rooms.snapshot(), with_timers))
+    if diff:
+        print("Final state differs from the recording:")
+        print("\n".join(diff))
+        return 1
+    print(f"Final state matches the recording ({len(final)} match(es)"
+          f"{', counters and timers' if with_timers else ', counters'})")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("capture", help="capture file written by app.py --capture")
+    parser.add_argument("--speed", type=float, default=0,
+                        help="1 = original timing, 2 = twice as fast, 0 = as fast as possible (default)")
+    parser.add_argument("--no-rate-limit", action="store_true", help="replay without per-client rate limits")
+    parser.add_argument("--log-level", default="ERROR", help="server log level during the replay (default: ERROR)")
+    args = parser.parse_args()
+    setup_logging(args.log_level)
+    try:
+        status = asyncio.run(replay(args))
+    finally:
+        stop_logging()
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
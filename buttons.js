@@ -1,8 +1,6 @@
 document.addEventListener('DOMContentLoaded', function() {
     // Initialize the counter manager
-    const wsHost = window.location.hostname || 'localhost';
-    const wsPort = '8765'; // Keep the same port
-    const wsUrl = `ws://${wsHost}:${wsPort}`;
+    const wsUrl = CounterManager.defaultServerUrl();
     
     // Initialize the counter manager with dynamic WebSocket URL
     const counterManager = new CounterManager(wsUrl);
@@ -162,11 +160,12 @@ document.addEventListener('DOMContentLoaded', function() {
     counterManager.connect = function() {
         console.log('Creating WebSocket connection to:', this.serverUrl);
         
-        this.socket = new WebSocket(this.serverUrl);
+        this.socket = new WebSocket(this.socketUrl());
         
         this.socket.onopen = () => {
             this.connected = true;
             this.log('Connected to server');
+            this.sendHello();
             if (this.onConnectionChange) {
                 this.onConnectionChange(true);
             }
@@ -195,9 +194,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 console.log("Message received:", data);
                 
                 // First handle counter updates
-                if (data.type === 'counters' && data.values) {
-                    this.counters = data.values;
-                    
+                if (this.applyCounterMessage(data)) {
                     // Update UI elements
                     if (value1) value1.textContent = this.counters.Hong || 0;
                     if (value2) value2.textContent = this.counters.Chung || 0;
@@ -240,18 +237,9 @@ document.addEventListener('DOMContentLoaded', function() {
             }
         };
         
-        // Start ping interval to keep connection alive
-        if (this._pingInterval) {
-            clearInterval(this._pingInterval);
-        }
-        
-        this._pingInterval = setInterval(() => {
-            if (this.connected) {
-                this.sendPing();
-            }
-        }, 30000);
+        // No keepalive timer needed: the server sends WebSocket pings and the browser answers them
     };
     
-    // Connect to the server
-    counterManager.connect();
+    // Find the server (its port may not be the page's), then connect
+    counterManager.discover().then(() => counterManager.connect());
 });
\ No newline at end of file
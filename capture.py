@@ -0,0 +1,161 @@
+# Traffic capture: every frame clients send, with when and on which
+# connection, so a match that went wrong can be replayed exactly
+# (bench/replay.py) and real tournament traffic can serve as a benchmark.
+#
+# The file starts with MAGIC, followed by records of
+#   <f64 seconds since capture start> <u32 connection> <u8 kind> <u32 length> payload
+# little-endian, 17 bytes of header per record. Kinds:
+#   STATE   payload is the JSON of RoomRegistry.snapshot(); written when the
+#           capture starts and again when it is closed, so a replay can
+#           start from the same state and check it ends in the same one
+#   OPEN    a connection, payload is its request path (?match=, ?role=, ?lastSeq=)
+#   TEXT    a text frame, UTF-8
+#   BINARY  a binary frame
+#   CLOSE   the connection went away
+#
+# Recording only appends to a list on the event loop; a background thread
+# writes the records out every FLUSH_INTERVAL. A capture cut short by a
+# crash is read up to its last complete record.
+
+import json
+import struct
+import threading
+import time
+import urllib.parse
+
+from server_log import get_logger
+
+MAGIC = b"SCCAP1\n"
+
+HEADER = struct.Struct("<dIBI")
+
+STATE = 0
+OPEN = 1
+TEXT = 2
+BINARY = 3
+CLOSE = 4
+
+# Seconds between writes of whatever was recorded
+FLUSH_INTERVAL = 0.2
+
+log = get_logger("capture")
+
+
+def request_path(websocket):
+    request = getattr(websocket, "request", None)
+    path = request.path if request is not None else getattr(websocket, "path", "") or ""
+    # A relay's token has no business in a capture file
+    parts = urllib.parse.urlsplit(path)
+    query = [(name, value) for name, value in urllib.parse.parse_qsl(parts.query) if name != "token"]
+    return urllib.parse.urlunsplit(("", "", parts.path, urllib.parse.urlencode(query), ""))
+
+
+class CaptureRecorder:
+    def __init__(self, path, rooms, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.rooms = rooms
+        self.flush_interval = flush_interval
+
+        self.records = 0
+        self.connections = 0
+
+        self._start = None
+        self._next_id = 1
+        self._pending = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+
+    def start(self):
+        capture_file = open(self.path, "wb")
+        capture_file.write(MAGIC)
+        self._start = time.monotonic()
+        self._thread = threading.Thread(target=self._run, args=(capture_file,), name="capture", daemon=True)
+        self._thread.start()
+        self._state()
+        log.info("Capturing client traffic to %s", self.path, extra={"event": "capture"})
+
+    def _append(self, connection_id, kind, payload):
+        if self._closed:
+            return
+        record = HEADER.pack(time.monotonic() - self._start, connection_id, kind, len(payload)) + payload
+        with self._cond:
+            self._pending.append(record)
+        self.records += 1
+
+    def _state(self):
+        self._append(0, STATE, json.dumps(self.rooms.snapshot()).encode("utf-8"))
+
+    def opened(self, websocket):
+        # A new connection; returns its ID for received() and closed()
+        connection_id = self._next_id
+        self._next_id += 1
+        self.connections += 1
+        self._append(connection_id, OPEN, request_path(websocket).encode("utf-8"))
+        return connection_id
+
+    def received(self, connection_id, frame):
+        if isinstance(frame, str):
+            self._append(connection_id, TEXT, frame.encode("utf-8"))
+        else:
+            self._append(connection_id, BINARY, bytes(frame))
+
+    def closed(self, connection_id):
+        self._append(connection_id, CLOSE, b"")
+
+    def close(self):
+        # Record the final state and write out everything
+        if self._thread is None:
+            return
+        self._state()
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self, capture_file):
+        while True:
+            with self._cond:
+                if not self._closed:
+                    self._cond.wait(self.flush_interval)
+                batch, self._pending = self._pending, []
+                closed = self._closed
+            try:
+                if batch:
+                    capture_file.write(b"".join(batch))
+                    capture_file.flush()
+            except OSError as e:
+                log.error("Error writing capture: %s", e)
+            if closed:
+                break
+        capture_file.close()
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "records": self.records,
+            "connections": self.connections,
+        }
+
+
+def read_capture(path):
+    # Yields (seconds, connection ID, kind, payload); TEXT payloads as str,
+    # STATE as the decoded snapshot
+    with open(path, "rb") as capture_file:
+        if capture_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a capture file")
+        while True:
+            header = capture_file.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            seconds, connection_id, kind, length = HEADER.unpack(header)
+            payload = capture_file.read(length)
+            if len(payload) < length:
+                # Cut off mid-record
+                return
+            if kind == TEXT or kind == OPEN:
+                payload = payload.decode("utf-8")
+            elif kind == STATE:
+                payload = json.loads(payload)
+            yield seconds, connection_id, kind, payload
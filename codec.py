@@ -0,0 +1,23 @@
+# JSON codec used for every WebSocket frame. Callers go through
+# codec.loads()/codec.dumps() so a faster implementation can be swapped in
+# with set_codec() without touching the message handlers.
+
+import json
+
+name = "json"
+
+
+def _json_dumps(obj):
+    return json.dumps(obj)
+
+
+loads = json.loads
+dumps = _json_dumps
+
+
+def set_codec(codec_name, codec_loads, codec_dumps):
+    # codec_dumps must return str so frames stay text frames
+    global name, loads, dumps
+    name = codec_name
+    loads = codec_loads
+    dumps = codec_dumps
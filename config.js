@@ -2,9 +2,10 @@
 
 // Server configuration
 const SERVER_CONFIG = {
-    // WebSocket server URL
-    // Replace with your actual server IP address
-    websocketUrl: 'ws://localhost:8765',
+    // WebSocket server URL: the port the page came from, except the
+    // two-port layout's pages port 8000
+    websocketUrl: `ws://${window.location.hostname || 'localhost'}:${
+        (window.location.port && window.location.port !== '8000') ? window.location.port : '8765'}`,
     
     // How often to send ping messages (in milliseconds)
     pingInterval: 30000
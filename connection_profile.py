@@ -0,0 +1,85 @@
+# WebSocket connection settings shared by app.py and websocket_server.py.
+#
+# Keepalive is done with WebSocket ping frames: the server pings every
+# PING_INTERVAL, browsers answer on their own, and a peer that doesn't
+# answer within PING_TIMEOUT is closed and its slot freed. Clients no
+# longer need to send {"type": "ping"} (it is still answered).
+#
+# What a connection may hold is bounded on both sides: inbound frames are
+# capped at the message engine's MAX_MESSAGE_SIZE and at most MAX_QUEUE of
+# them are buffered before reading stops; outbound, the transport buffers
+# up to WRITE_LIMIT bytes before the fan-out queue (fanout.MAX_QUEUE
+# messages) takes over.
+#
+# Our frames are tiny JSON objects, so compression saves little per frame.
+# The "default" profile still offers permessage-deflate but without context
+# takeover, so an idle connection keeps no zlib state (the websockets
+# default keeps ~64 KiB per connection). The "scale" profile, for
+# thousands of mostly-idle screens, turns compression off, shrinks the
+# buffers and raises the listen backlog and the open file limit.
+
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+
+from message_engine import MAX_MESSAGE_SIZE
+
+PING_INTERVAL = 20
+PING_TIMEOUT = 20
+
+# Seconds a client gets to finish the opening handshake / closing handshake
+OPEN_TIMEOUT = 10
+CLOSE_TIMEOUT = 5
+
+MAX_QUEUE = 8
+WRITE_LIMIT = 16 * 1024
+
+PROFILES = ("default", "scale")
+
+
+def small_frame_compression():
+    return [ServerPerMessageDeflateFactory(
+        server_no_context_takeover=True,
+        client_no_context_takeover=True,
+        server_max_window_bits=12,
+        client_max_window_bits=12,
+        compress_settings={"memLevel": 5},
+    )]
+
+
+def serve_options(profile="default"):
+    # Keyword arguments for websockets.serve()
+    options = {
+        "ping_interval": PING_INTERVAL,
+        "ping_timeout": PING_TIMEOUT,
+        "open_timeout": OPEN_TIMEOUT,
+        "close_timeout": CLOSE_TIMEOUT,
+        "max_size": MAX_MESSAGE_SIZE,
+        "max_queue": MAX_QUEUE,
+        "write_limit": WRITE_LIMIT,
+    }
+    if profile == "scale":
+        options.update({
+            "compression": None,
+            "max_queue": 4,
+            "write_limit": 4 * 1024,
+            "backlog": 1024,
+        })
+    else:
+        options.update({
+            "compression": None,
+            "extensions": small_frame_compression(),
+        })
+    return options
+
+
+def raise_file_limit():
+    # One descriptor per connection; lift the soft limit to the hard one
+    try:
+        import resource
+    except ImportError:
+        # Windows: the C runtime limit doesn't apply to sockets
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        return hard
+    return soft
@@ -16,9 +16,7 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     // Initialize the counter manager
-    const wsHost = window.location.hostname || 'localhost';
-    const wsPort = '8765'; // Keep the same port
-    const wsUrl = `ws://${wsHost}:${wsPort}`;
+    const wsUrl = CounterManager.defaultServerUrl();
     
     // Initialize the counter manager with dynamic WebSocket URL
     const counterManager = new CounterManager(wsUrl);
@@ -53,6 +51,6 @@ document.addEventListener('DOMContentLoaded', function() {
     // Set up the button
     counterManager.setupButton(counterButton, counterId);
     
-    // Connect to the server
-    counterManager.connect();
+    // Find the server (its port may not be the page's), then connect
+    counterManager.discover().then(() => counterManager.connect());
 });
\ No newline at end of file
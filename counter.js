@@ -5,6 +5,14 @@ class CounterManager {
         this.serverUrl = serverUrl;
         this.socket = null;
         this.counters = {};
+        this.seq = null;
+        this.syncPending = false;
+        
+        // Match to follow, from ?match=<id> on the page URL; ?role=spectator
+        // makes this a read-only screen that gets throttled updates
+        const pageParams = new URLSearchParams(window.location.search);
+        this.matchId = pageParams.get('match');
+        this.role = pageParams.get('role');
         this.onConnectionChange = null;
         this.onCounterUpdate = null;
         this.connected = false;
@@ -18,11 +26,12 @@ class CounterManager {
     connect() {
         this.log('Connecting to WebSocket server...');
         
-        this.socket = new WebSocket(this.serverUrl);
+        this.socket = new WebSocket(this.socketUrl());
         
         this.socket.onopen = () => {
             this.connected = true;
             this.log('Connected to server');
+            this.sendHello();
             if (this.onConnectionChange) {
                 this.onConnectionChange(true);
             }
@@ -48,8 +57,7 @@ class CounterManager {
                 const data = JSON.parse(event.data);
                 this.log(`Received: ${JSON.stringify(data)}`);
                 
-                if (data.type === 'counters' && data.values) {
-                    this.counters = data.values;
+                if (this.applyCounterMessage(data)) {
                     if (this.onCounterUpdate) {
                         this.onCounterUpdate(this.counters);
                     }
@@ -59,16 +67,7 @@ class CounterManager {
             }
         };
         
-        // Start ping interval to keep connection alive
-        if (this._pingInterval) {
-            clearInterval(this._pingInterval);
-        }
-        
-        this._pingInterval = setInterval(() => {
-            if (this.connected) {
-                this.sendPing();
-            }
-        }, 30000);
+        // No keepalive timer needed: the server sends WebSocket pings and the browser answers them
     }
     
     // Set up a counter button
@@ -128,6 +127,127 @@ class CounterManager {
         }));
     }
     
+    // Ask the server where its WebSocket is and what the match looks like
+    // now, so the first frame can be drawn before the socket is open. Tries
+    // the page's own server, then the discovery port. Resolves with the
+    // discovery document (plus clockOffset/rtt from its X-Server-Time), or
+    // null if neither answers.
+    async discover() {
+        const query = this.matchId ? `?match=${encodeURIComponent(this.matchId)}` : '';
+        const host = window.location.hostname || 'localhost';
+        const urls = [
+            `/discover${query}`,
+            `http://${host}:${CounterManager.DISCOVERY_PORT}/discover${query}`
+        ];
+        for (const url of urls) {
+            try {
+                const sentAt = Date.now();
+                const options = { cache: 'no-cache' };
+                if (window.AbortSignal && AbortSignal.timeout) {
+                    options.signal = AbortSignal.timeout(CounterManager.DISCOVERY_TIMEOUT);
+                }
+                const response = await fetch(url, options);
+                if (!response.ok) continue;
+                const info = await response.json();
+                const receivedAt = Date.now();
+                const serverTime = Number(response.headers.get('X-Server-Time'));
+                info.rtt = receivedAt - sentAt;
+                info.clockOffset = serverTime ? serverTime - (sentAt + receivedAt) / 2 : 0;
+                
+                if (info.websocket) {
+                    this.serverUrl = info.websocket;
+                }
+                // The socket then connects with this seq and only gets what changed since
+                if (info.counters && this.applyCounterMessage(info.counters) && this.onCounterUpdate) {
+                    this.onCounterUpdate(this.counters);
+                }
+                this.log(`Discovered ${this.serverUrl} in ${info.rtt}ms`);
+                return info;
+            } catch (e) {
+                // Not served by ScoreCounter here, try the next one
+            }
+        }
+        return null;
+    }
+    
+    // Server URL with the match and, on reconnect, the last seq we saw so
+    // the server only has to send the updates we missed
+    socketUrl() {
+        const url = new URL(this.serverUrl);
+        if (this.matchId) {
+            url.searchParams.set('match', this.matchId);
+        }
+        if (this.role) {
+            url.searchParams.set('role', this.role);
+        }
+        if (this.seq !== null) {
+            url.searchParams.set('lastSeq', this.seq);
+        }
+        return url.toString();
+    }
+    
+    // Tell the server which match we follow and that we understand counter deltas
+    sendHello() {
+        this.syncPending = false;
+        const hello = {
+            type: 'hello',
+            deltas: true
+        };
+        if (this.matchId) {
+            hello.matchId = this.matchId;
+        }
+        if (this.seq !== null) {
+            hello.lastSeq = this.seq;
+        }
+        this.socket.send(JSON.stringify(hello));
+    }
+    
+    // Apply a counters snapshot or delta; returns true if the counters changed
+    applyCounterMessage(data) {
+        if (data.type === 'counters' && data.values) {
+            this.counters = Object.assign({}, data.values);
+            this.seq = typeof data.seq === 'number' ? data.seq : null;
+            this.syncPending = false;
+            return true;
+        }
+        
+        if (data.type === 'counters-delta') {
+            // Already covered by a newer snapshot
+            if (this.seq !== null && data.seq <= this.seq) {
+                return false;
+            }
+            
+            // Missed an update, ask for a fresh snapshot. Coalesced deltas
+            // cover several updates and say which seq they follow on from
+            const since = typeof data.since === 'number' ? data.since : data.seq - 1;
+            if (this.seq === null || since !== this.seq) {
+                this.requestCounterSync();
+                return false;
+            }
+            
+            if (data.reset) {
+                this.counters = {};
+            }
+            Object.assign(this.counters, data.changes || {});
+            this.seq = data.seq;
+            return true;
+        }
+        
+        return false;
+    }
+    
+    // Request a full counters snapshot
+    requestCounterSync() {
+        if (this.syncPending || !this.connected) {
+            return;
+        }
+        this.syncPending = true;
+        this.log('Counter update missed, requesting snapshot');
+        this.socket.send(JSON.stringify({
+            type: 'counters-sync-request'
+        }));
+    }
+    
     // Get current value of a counter
     getCounterValue(counterId) {
         return this.counters[counterId] || 0;
@@ -161,14 +281,30 @@ class CounterManager {
     
     // Clean up resources
     disconnect() {
-        if (this._pingInterval) {
-            clearInterval(this._pingInterval);
-        }
         if (this.socket) {
             this.socket.close();
         }
     }
 }
 
+// Port that answers /discover when the pages come from somewhere else
+CounterManager.DISCOVERY_PORT = 8766;
+CounterManager.DISCOVERY_TIMEOUT = 2000;
+
+// Pages port of the --two-port layout, whose WebSocket is on WS_PORT
+CounterManager.HTTP_PORT = '8000';
+CounterManager.WS_PORT = '8765';
+
+// The WebSocket is on the port the page came from (app.py --port), except
+// in the two-port layout; discover() replaces this with the exact URL
+CounterManager.defaultServerUrl = function() {
+    const host = window.location.hostname || 'localhost';
+    let port = window.location.port || CounterManager.WS_PORT;
+    if (port === CounterManager.HTTP_PORT) {
+        port = CounterManager.WS_PORT;
+    }
+    return `ws://${host}:${port}`;
+};
+
 // Export the CounterManager class
 window.CounterManager = CounterManager;
\ No newline at end of file
@@ -0,0 +1,206 @@
+# Discovery: GET /discover tells a page where the WebSocket is, what the
+# server can do and what the match looks like right now, in one round trip,
+# so a display can draw its first frame before its socket is open.
+#
+#   {"websocket": "ws://<host the page used>:8765/",
+#    "endpoints": ["ws://192.168.1.10:8765/", ...],
+#    "capabilities": {...},
+#    "counters": {"type": "counters", ...},
+#    "timer": {"type": "timer-...", ...}}
+#
+# ?match= selects the match (default match otherwise). "counters" and
+# "timer" are the same frames the WebSocket would send first, spliced in
+# from the room's encoded-message cache; the whole body is kept as bytes
+# until the counters seq or the timer version moves, and answered with 304
+# on a matching ETag. X-Server-Time carries the server clock in ms for a
+# first clock offset before timer-clock samples come in.
+#
+# It is served on the main port next to the pages and on DISCOVERY_PORT
+# (8766), which answers nothing else but the /history exports. Addresses come from the interfaces
+# themselves, so this works on a network without a route to the internet.
+
+import asyncio
+import ipaddress
+import socket
+import struct
+import sys
+import time
+
+import codec
+from match_state import CounterState, TimerState, PROTOCOL_DELTA, PROTOCOL_FULL
+from message_engine import MAX_BATCH_OPS, MAX_MESSAGE_SIZE
+from rooms import ROLES, normalize_match_id
+from static_server import Response, StaticServer
+
+DISCOVERY_PORT = 8766
+
+# Linux ioctl for an interface's IPv4 address
+SIOCGIFADDR = 0x8915
+
+# Bodies kept per (match, host); a venue has a handful of each
+MAX_CACHED_BODIES = 256
+
+
+def interface_addresses():
+    # IPv4 address of every interface that is up, read from the kernel
+    if not sys.platform.startswith("linux"):
+        return []
+    import fcntl
+
+    addresses = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        for _, name in socket.if_nameindex():
+            try:
+                request = struct.pack("256s", name.encode("utf-8")[:15])
+                reply = fcntl.ioctl(s.fileno(), SIOCGIFADDR, request)
+            except OSError:
+                # No IPv4 address on this interface
+                continue
+            addresses.append(socket.inet_ntoa(reply[20:24]))
+    return addresses
+
+
+def hostname_addresses():
+    # Addresses the host name resolves to; on Windows and macOS that is every interface
+    try:
+        infos = socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET, socket.SOCK_DGRAM)
+    except (socket.gaierror, UnicodeError):
+        return []
+    return [info[4][0] for info in infos]
+
+
+def local_addresses():
+    # LAN addresses of this machine, private ranges first; no packets are sent
+    found = {}
+    for address in interface_addresses() + hostname_addresses():
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            continue
+        if ip.is_loopback or ip.is_link_local or ip.is_unspecified:
+            continue
+        found[address] = ip
+
+    def rank(address):
+        ip = found[address]
+        # 192.168.x.x is what venue Wi-Fi routers hand out
+        return (not ip.is_private, not address.startswith("192.168."), ip)
+    return sorted(found, key=rank)
+
+
+def local_ip():
+    addresses = local_addresses()
+    return addresses[0] if addresses else "localhost"
+
+
+def request_hostname(request):
+    # Host the client used to reach us, without the port
+    host = request.headers.get("host", "")
+    if host.startswith("["):
+        return host[:host.find("]") + 1] or "localhost"
+    return host.rsplit(":", 1)[0] or "localhost"
+
+
+class Discovery:
+    def __init__(self, rooms, engine, ws_port, addresses=None):
+        self.rooms = rooms
+        self.engine = engine
+        self.ws_port = ws_port
+        self.addresses = local_addresses() if addresses is None else addresses
+        self.endpoints = [f"ws://{address}:{ws_port}/" for address in self.addresses]
+        # (match ID, host) -> (seq, timer version, etag, body)
+        self.bodies = {}
+        self.requests = 0
+        self.cache_hits = 0
+        # State of a match nobody has opened yet
+        self.empty_counters = codec.dumps(CounterState().snapshot())
+        self.empty_timer = codec.dumps(TimerState().state)
+
+    def capabilities(self):
+        return {
+            "protocols": [PROTOCOL_FULL, PROTOCOL_DELTA],
+            "roles": sorted(ROLES),
+            "maxMessageSize": MAX_MESSAGE_SIZE,
+            "maxBatchOps": MAX_BATCH_OPS,
+            "timerClock": True,
+            "history": self.engine.history is not None,
+            "relay": self.engine.upstream is not None,
+        }
+
+    def body(self, match_id, hostname):
+        # Cached response body and its ETag for one match as seen from one host
+        room = self.rooms.rooms.get(match_id)
+        if room is not None:
+            seq, version = room.counters.seq, room.timer.version
+        else:
+            seq, version = None, None
+
+        key = (match_id, hostname)
+        cached = self.bodies.get(key)
+        if cached is not None and cached[0] == seq and cached[1] == version:
+            self.cache_hits += 1
+            return cached[2], cached[3]
+
+        if room is not None:
+            counters, timer = room.encoded_counters(), room.encoded_timer()
+        else:
+            counters, timer = self.empty_counters, self.empty_timer
+        head = codec.dumps({
+            "match": match_id,
+            "websocket": f"ws://{hostname}:{self.ws_port}/",
+            "endpoints": self.endpoints,
+            "capabilities": self.capabilities(),
+        })
+        # Splice the frames in as they are instead of decoding them again
+        body = f'{head[:-1]}, "counters": {counters}, "timer": {timer}}}'.encode("utf-8")
+        etag = f'"{seq}-{version}"'
+
+        if len(self.bodies) >= MAX_CACHED_BODIES and key not in self.bodies:
+            self.bodies.clear()
+        self.bodies[key] = (seq, version, etag, body)
+        return etag, body
+
+    def respond(self, request):
+        self.requests += 1
+        match_id = normalize_match_id(request.query.get("match", [None])[-1])
+        etag, body = self.body(match_id, request_hostname(request))
+        headers = {
+            "Cache-Control": "no-cache",
+            "ETag": etag,
+            "X-Server-Time": str(round(time.time() * 1000)),
+            # Pages on the main port fetch this from DISCOVERY_PORT too
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Expose-Headers": "ETag, X-Server-Time",
+        }
+        if request.headers.get("if-none-match") == etag:
+            return Response(304, headers=headers)
+        return Response(200, body, headers, "application/json")
+
+    def route(self, loop=None):
+        # /discover handler for StaticServer.add_route(). Rooms are read on
+        # loop (the WebSocket loop) when the HTTP server runs on another thread.
+        async def handle(request):
+            if loop is None or loop is asyncio.get_running_loop():
+                return self.respond(request)
+            future = asyncio.run_coroutine_threadsafe(self._respond_async(request), loop)
+            return await asyncio.wrap_future(future)
+        return handle
+
+    async def _respond_async(self, request):
+        return self.respond(request)
+
+    async def serve(self, host="0.0.0.0", port=DISCOVERY_PORT, routes=None):
+        # Listener on DISCOVERY_PORT that answers /discover and the given
+        # routes (path -> handler) and nothing else; responses are streamed
+        server = StaticServer(None)
+        server.add_route("/discover", self.route())
+        for path, route in (routes or {}).items():
+            server.add_route(path, route)
+        return await server.start(host, port)
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "cacheHits": self.cache_hits,
+            "endpoints": self.endpoints,
+        }
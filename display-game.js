@@ -6,8 +6,11 @@ document.addEventListener('DOMContentLoaded', function() {
     
     
     const wsHost = window.location.hostname || 'localhost';
-    const wsPort = '8765';
-    const socket = new WebSocket(`ws://${wsHost}:${wsPort}`);
+    // Same port as the page, except the two-port layout's pages port
+    const wsPort = (window.location.port && window.location.port !== '8000') ? window.location.port : '8765';
+    const matchId = new URLSearchParams(window.location.search).get('match');
+    const matchQuery = matchId ? `?match=${encodeURIComponent(matchId)}` : '';
+    const socket = new WebSocket(`ws://${wsHost}:${wsPort}/${matchQuery}`);
     
     // Connection opened
     socket.onopen = function() {
@@ -65,11 +68,4 @@ document.addEventListener('DOMContentLoaded', function() {
             element.style.transform = 'scale(1)';
         }, 200);
     }
-    
-    // Keep-alive ping
-    setInterval(function() {
-        if (socket.readyState === WebSocket.OPEN) {
-            socket.send(JSON.stringify({type: 'ping'}));
-        }
-    }, 30000);
 });
\ No newline at end of file
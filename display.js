@@ -232,12 +232,8 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     // Initialize the counter manager
-    const wsHost = window.location.hostname || 'localhost';
-    const wsPort = '8765'; // Keep the same port
-    const wsUrl = `ws://${wsHost}:${wsPort}`;
+    const wsUrl = CounterManager.defaultServerUrl();
     const counterManager = new CounterManager(wsUrl);
-    console.log("CounterManager WebSocket:", counterManager.socket);
-    counterManager.connect();
 
     // Set up debug logging
     counterManager.setDebugElement(debug);
@@ -359,6 +355,9 @@ document.addEventListener('DOMContentLoaded', function() {
         // Replace the message handler after a small delay to ensure socket is created
         setTimeout(() => {
             if (this.socket) {
+                // Timer messages go out on the new socket, which also syncs the clock
+                timerManager.websocket = this.socket;
+
                 // Store the original handler
                 const originalOnMessage = this.socket.onmessage;
                 
@@ -371,14 +370,13 @@ document.addEventListener('DOMContentLoaded', function() {
                         this.log(`Received message: ${event.data}`);
                         
                         // Handle counters update with direct DOM manipulation
-                        if (data.type === 'counters' && data.values) {
-                            console.log("Counter update received:", data.values);
-                            this.counters = data.values;
+                        if (this.applyCounterMessage(data)) {
+                            console.log("Counter update received:", this.counters);
                             
-                            // Update counter displays
-                            for (const [id, value] of Object.entries(data.values)) {
-                                const element = counterValues[id];
-                                if (element) {
+                            // Update counter displays that changed
+                            for (const [id, element] of Object.entries(counterValues)) {
+                                const value = this.counters[id] || 0;
+                                if (element.textContent !== String(value)) {
                                     console.log(`Updating ${id} to ${value}`);
                                     element.textContent = value;
                                     
@@ -396,6 +394,10 @@ document.addEventListener('DOMContentLoaded', function() {
                                 this.onCounterUpdate(this.counters);
                             }
                         }
+                        else if (data.type === 'counters' || data.type === 'counters-delta') {
+                            // Deliberately ignored: applyCounterMessage() already dropped this stale or
+                            // out-of-order update, and the original handler below must not apply it again
+                        }
                         // Handle timer messages
                         else if (data.type && data.type.startsWith('timer-')) {
                             timerManager.handleServerMessage(data);
@@ -534,6 +536,22 @@ document.addEventListener('DOMContentLoaded', function() {
     `;
     document.head.appendChild(style);
     
-    // Connect to the server
-    counterManager.connect();
+    // Draw the match as /discover has it, then connect; the socket only
+    // has to bring what changed since
+    counterManager.discover().then((info) => {
+        if (info) {
+            for (const [id, element] of Object.entries(counterValues)) {
+                element.textContent = counterManager.getCounterValue(id);
+            }
+            timerManager.clockOffset = info.clockOffset;
+            if (info.timer) {
+                timerManager.handleServerMessage(info.timer);
+            }
+            if (startPauseButton) {
+                startPauseButton.innerHTML = timerManager.isRunning ? '<i class="fa-solid fa-pause"></i>' :
+            '<i class="fa-solid fa-play"></i>';
+            }
+        }
+        counterManager.connect();
+    });
 });
\ No newline at end of file
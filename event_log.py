@@ -0,0 +1,203 @@
+# Append-only log of accepted match mutations so a crash or a sleeping
+# laptop doesn't lose the match.
+#
+# Every record is one JSON line with a log index "n". Writes are handed to
+# a background thread that group-commits them: whatever piled up while the
+# previous fsync ran is written and fsynced together, so the event loop
+# never waits on the disk. Every SNAPSHOT_EVERY records the full state is
+# written to a snapshot file (atomically, via rename) and the log is
+# truncated. Recovery loads the snapshot and replays the records after it.
+
+import json
+import os
+import threading
+import time
+
+from server_log import get_logger
+
+LOG_FILENAME = "events.log"
+SNAPSHOT_FILENAME = "snapshot.json"
+
+# Records between snapshots; bounds how much log has to be replayed
+SNAPSHOT_EVERY = 2000
+
+# Minimum seconds between fsyncs; more records get batched into each one
+COMMIT_INTERVAL = 0.005
+
+log = get_logger("event_log")
+
+
+class _Snapshot:
+    def __init__(self, data):
+        self.data = data
+
+
+class EventLog:
+    def __init__(self, directory, snapshot_every=SNAPSHOT_EVERY, commit_interval=COMMIT_INTERVAL):
+        self.directory = directory
+        self.log_path = os.path.join(directory, LOG_FILENAME)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILENAME)
+        self.snapshot_every = snapshot_every
+        self.commit_interval = commit_interval
+
+        # Called on the event loop thread to capture state for a snapshot
+        self.snapshot_provider = None
+
+        self.next_index = 1
+        self.records_since_snapshot = 0
+        self.appended = 0
+        self.commits = 0
+        self.snapshots = 0
+
+        self._pending = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._file = None
+        self._thread = None
+        # Length of the log up to its last complete record, set by load()
+        self._good_length = None
+
+    def load(self):
+        # Returns (snapshot state or None, records logged after it)
+        snapshot = None
+        last_index = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "rb") as f:
+                snapshot = json.loads(f.read())
+            last_index = snapshot.get("n", 0)
+
+        records = []
+        self._good_length = None
+        if os.path.exists(self.log_path):
+            good_length = 0
+            with open(self.log_path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # Torn write at the tail from a crash mid-append
+                        break
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    good_length += len(line)
+                    # Already covered by the snapshot (crash before truncation)
+                    if record.get("n", 0) > last_index:
+                        records.append(record)
+            self._good_length = good_length
+
+        last_logged = records[-1]["n"] if records else last_index
+        self.next_index = last_logged + 1
+        return (snapshot.get("state") if snapshot else None), records
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if self._good_length is not None and os.path.getsize(self.log_path) > self._good_length:
+            # Cut off the torn tail so new records don't get glued onto it
+            log.warning("Dropping %d bytes of torn record at the end of %s",
+                        os.path.getsize(self.log_path) - self._good_length, self.log_path)
+            os.truncate(self.log_path, self._good_length)
+        self._file = open(self.log_path, "ab")
+        self._thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+        self._thread.start()
+
+    def append(self, record):
+        record["n"] = self.next_index
+        self.next_index += 1
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._cond:
+            self._pending.append(line)
+            self._cond.notify()
+
+        self.appended += 1
+        self.records_since_snapshot += 1
+        if self.snapshot_provider is not None and self.records_since_snapshot >= self.snapshot_every:
+            self._snapshot_from_provider()
+
+    def _snapshot_from_provider(self):
+        # A failed snapshot must not fail the append that triggered it (and
+        # every one after it); the log keeps the records and it is retried
+        # after another snapshot_every
+        try:
+            self.snapshot(self.snapshot_provider())
+        except Exception as e:
+            log.error("Error taking snapshot, keeping the log: %s", e)
+            self.records_since_snapshot = 0
+
+    def snapshot(self, state):
+        # The snapshot covers every record appended so far
+        data = json.dumps({"n": self.next_index - 1, "state": state}, separators=(",", ":"))
+        with self._cond:
+            self._pending.append(_Snapshot(data.encode("utf-8")))
+            self._cond.notify()
+        self.records_since_snapshot = 0
+
+    def close(self):
+        if self._thread is None:
+            return
+        if self.snapshot_provider is not None and self.records_since_snapshot:
+            self._snapshot_from_provider()
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending and self._closed:
+                    return
+                batch, self._pending = self._pending, []
+
+            try:
+                self._commit(batch)
+            except OSError as e:
+                log.error("Error writing event log: %s", e)
+
+            # Let the next batch build up instead of fsyncing every record
+            if self.commit_interval and not self._closed:
+                time.sleep(self.commit_interval)
+
+    def _commit(self, batch):
+        lines = []
+        for item in batch:
+            if isinstance(item, _Snapshot):
+                # Records before the snapshot are part of it, no need to write them
+                lines = []
+                self._write_snapshot(item.data)
+            else:
+                lines.append(item)
+
+        if lines:
+            self._file.write(b"".join(lines))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self.commits += 1
+
+    def _write_snapshot(self, data):
+        temp_path = self.snapshot_path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.snapshot_path)
+
+        # The snapshot is durable, the log can start over
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.snapshots += 1
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            "appended": self.appended,
+            "pending": pending,
+            "commits": self.commits,
+            "snapshots": self.snapshots,
+        }
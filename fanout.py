@@ -0,0 +1,241 @@
+import asyncio
+import collections
+import time
+import websockets
+
+import codec
+from metrics import registry as metrics
+from server_log import get_logger
+
+# Maximum number of messages waiting to be written to a single client
+DEFAULT_QUEUE_SIZE = 64
+
+# What to do with a client whose outbound queue overflows
+OVERFLOW_LATEST = "latest"  # Keep only the newest message of each kind
+OVERFLOW_DROP = "drop"      # Disconnect the client
+
+# Close code sent to clients evicted for being too slow ("try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+log = get_logger("fanout")
+
+
+def encode_message(message):
+    # Messages are encoded once per broadcast, never once per client
+    if isinstance(message, (str, bytes)):
+        return message
+    return codec.dumps(message)
+
+
+def message_key(message, key=None):
+    # Messages with the same key carry the same piece of state, so only the
+    # newest one matters to a client that is behind
+    if key is None and isinstance(message, dict):
+        key = message.get("type")
+    return key
+
+
+class ClientChannel:
+    def __init__(self, websocket, hub, protocol=None):
+        self.websocket = websocket
+        self.hub = hub
+        self.protocol = protocol
+        self.queue = collections.deque()
+        self.latest_only = False
+        self.closed = False
+        self._ready = asyncio.Event()
+        # Cleared while the queue is backed up; the reader waits on it
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._task = asyncio.create_task(self._writer())
+
+    def enqueue(self, payload, key=None):
+        if self.closed:
+            return False
+
+        # While catching up, a new message replaces the queued one of the same kind
+        if self.latest_only and key is not None:
+            self._discard_key(key)
+
+        if len(self.queue) >= self.hub.max_queue:
+            if self.hub.overflow == OVERFLOW_DROP:
+                self.hub.evict(self)
+                return False
+
+            # Switch to "latest state only" until the queue drains
+            self.latest_only = True
+            self._collapse()
+            if key is not None:
+                self._discard_key(key)
+            if len(self.queue) >= self.hub.max_queue:
+                # Nothing left to collapse, the client cannot keep up at all
+                self.hub.evict(self)
+                return False
+
+        self.queue.append((key, payload, time.perf_counter()))
+        self._ready.set()
+        if len(self.queue) >= self.hub.pause_depth:
+            self._drained.clear()
+        return True
+
+    @property
+    def backed_up(self):
+        return not self._drained.is_set()
+
+    async def wait_drained(self):
+        await self._drained.wait()
+
+    def _discard_key(self, key):
+        before = len(self.queue)
+        self.queue = collections.deque(item for item in self.queue if item[0] != key)
+        self.hub.dropped_messages += before - len(self.queue)
+        metrics.dropped_messages += before - len(self.queue)
+
+    def _collapse(self):
+        # Keep unkeyed messages and the newest message for every key, in order
+        before = len(self.queue)
+        last_index = {}
+        for index, (key, _, _) in enumerate(self.queue):
+            if key is not None:
+                last_index[key] = index
+        self.queue = collections.deque(
+            item for index, item in enumerate(self.queue)
+            if item[0] is None or last_index[item[0]] == index
+        )
+        self.hub.dropped_messages += before - len(self.queue)
+        metrics.dropped_messages += before - len(self.queue)
+
+    async def _writer(self):
+        try:
+            while True:
+                if not self.queue:
+                    # Fully caught up, go back to delivering every message
+                    self.latest_only = False
+                    self._drained.set()
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+
+                _, payload, enqueued_at = self.queue.popleft()
+                metrics.send_delay.observe(time.perf_counter() - enqueued_at)
+                if len(self.queue) <= self.hub.resume_depth:
+                    self._drained.set()
+                self.hub.in_flight += 1
+                try:
+                    await self.websocket.send(payload)
+                finally:
+                    self.hub.in_flight -= 1
+        except asyncio.CancelledError:
+            pass
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        except Exception as e:
+            log.error("Error writing to client: %s", e, extra={"event": "send-error"})
+        finally:
+            self.closed = True
+            self.queue.clear()
+            self._drained.set()
+            self.hub.channels.pop(self.websocket, None)
+
+    def close(self):
+        self.closed = True
+        self.queue.clear()
+        self._drained.set()
+        self._task.cancel()
+
+
+class FanoutHub:
+    def __init__(self, max_queue=DEFAULT_QUEUE_SIZE, overflow=OVERFLOW_LATEST):
+        self.max_queue = max_queue
+        self.overflow = overflow
+        # Stop reading from a client at pause_depth queued messages, resume at resume_depth
+        self.pause_depth = max(1, max_queue // 2)
+        self.resume_depth = max_queue // 4
+        self.channels = {}
+        self.in_flight = 0
+        self.broadcasts = 0
+        self.dropped_messages = 0
+        self.evicted_clients = 0
+
+    def __len__(self):
+        return len(self.channels)
+
+    def __contains__(self, websocket):
+        return websocket in self.channels
+
+    def __iter__(self):
+        return iter(list(self.channels))
+
+    def add(self, websocket, protocol=None):
+        channel = self.channels.get(websocket)
+        if channel is None:
+            channel = ClientChannel(websocket, self, protocol)
+            self.channels[websocket] = channel
+        return channel
+
+    def remove(self, websocket):
+        channel = self.channels.pop(websocket, None)
+        if channel is not None:
+            channel.close()
+
+    def evict(self, channel):
+        # Drop a client that cannot keep up so it stops holding memory
+        self.evicted_clients += 1
+        metrics.evicted_clients += 1
+        self.remove(channel.websocket)
+        asyncio.create_task(self._close_slow_client(channel.websocket))
+
+    async def _close_slow_client(self, websocket):
+        try:
+            await websocket.close(code=SLOW_CONSUMER_CLOSE_CODE, reason="slow consumer")
+        except Exception:
+            pass
+
+    def send(self, websocket, message, key=None):
+        channel = self.channels.get(websocket)
+        if channel is None:
+            return False
+        return channel.enqueue(encode_message(message), message_key(message, key))
+
+    def has_protocol(self, protocol):
+        return any(channel.protocol == protocol for channel in self.channels.values())
+
+    def set_protocol(self, websocket, protocol):
+        channel = self.channels.get(websocket)
+        if channel is not None:
+            channel.protocol = protocol
+
+    def broadcast(self, message, key=None, protocol=None):
+        # Only clients speaking the given protocol get this message (None means everyone)
+        targets = [
+            channel for channel in self.channels.values()
+            if protocol is None or channel.protocol == protocol
+        ]
+        if not targets:
+            return 0
+
+        # Encode once, then enqueue without waiting on any socket
+        start = time.perf_counter()
+        payload = encode_message(message)
+        key = message_key(message, key)
+        self.broadcasts += 1
+        metrics.broadcasts += 1
+        delivered = 0
+        for channel in targets:
+            if channel.enqueue(payload, key):
+                delivered += 1
+        metrics.fanout_latency.observe(time.perf_counter() - start)
+        return delivered
+
+    def stats(self):
+        queued = [len(channel.queue) for channel in self.channels.values()]
+        return {
+            "clients": len(self.channels),
+            "inFlight": self.in_flight,
+            "queued": sum(queued),
+            "maxQueueDepth": max(queued, default=0),
+            "latestOnlyClients": sum(1 for channel in self.channels.values() if channel.latest_only),
+            "broadcasts": self.broadcasts,
+            "droppedMessages": self.dropped_messages,
+            "evictedClients": self.evicted_clients,
+        }
@@ -10,6 +10,9 @@ class GameStateManager {
         this.scores = {}; // Track scores by round
         this.roundWinners = []; // Track which team won each round
         this.roundInfoElement = null;
+        this.gameId = null; // Identifies this game in the server's match history
+        this.startedAt = null;
+        this.court = new URLSearchParams(window.location.search).get('court');
         
         // Bind timer end event
         this.timerManager.setOnTimerEnd(() => this.handleRoundEnd());
@@ -128,18 +131,11 @@ class GameStateManager {
         this.isGameInProgress = true; // Set game in progress
         this.scores = {};
         this.roundWinners = [];
+        this.startedAt = Date.now();
+        this.gameId = `${this.startedAt}-${Math.random().toString(36).slice(2, 8)}`;
         
-        // Reset counters via WebSocket
-        this.resetAllCounters();
-        
-        // Reset timer
-        this.timerManager.reset();
-        
-        // Set timer duration (2 minutes per round)
-        this.timerManager.setDuration(60);
-        
-        // Start timer for first round
-        this.timerManager.start();
+        // Reset counters and start the first round's timer (60 seconds)
+        this.startRoundClock(60);
         
         // Update round info
         this.updateRoundInfo();
@@ -168,6 +164,14 @@ class GameStateManager {
         const roundWinner = this.determineRoundWinner(this.currentRound);
         this.roundWinners.push(roundWinner);
         
+        // Record the round on the server so it survives a reload
+        this.sendResult({
+            type: 'round-end',
+            round: this.currentRound,
+            scores: this.scores[`round${this.currentRound}`],
+            winner: roundWinner
+        });
+        
         // Announce round result
         this.announceGameState(`Round ${this.currentRound} complete! Winner: ${roundWinner}`);
         
@@ -193,12 +197,8 @@ class GameStateManager {
 
         this.currentRound++;
         
-        // Reset counters for new round
-        this.resetAllCounters();
-        
-        // Reset and start timer
-        this.timerManager.reset();
-        this.timerManager.start();
+        // Reset counters and restart the timer for the new round
+        this.startRoundClock();
         
         // Update round info
         this.updateRoundInfo();
@@ -207,16 +207,41 @@ class GameStateManager {
         this.announceGameState(`Round ${this.currentRound} started!`);
     }
     
-    // Reset all counters to zero
-    resetAllCounters() {
-        // Send reset message via WebSocket
-        if (this.counterManager.socket && this.counterManager.socket.readyState === WebSocket.OPEN) {
-            this.counterManager.socket.send(JSON.stringify({
-                type: 'reset-counters'
-            }));
+    // Reset counters and restart the timer in one batch message, so
+    // displays get a single update instead of each step in turn
+    startRoundClock(duration) {
+        const timerOps = this.timerManager.collectOps(() => {
+            this.timerManager.reset();
+            if (duration) {
+                this.timerManager.setDuration(duration);
+            }
+            this.timerManager.start();
+        });
+        this.sendBatch([{ type: 'reset-counters' }, ...timerOps]);
+    }
+
+    // Apply several counter/timer operations atomically on the server
+    sendBatch(ops) {
+        this.send({ type: 'batch', ops: ops });
+    }
+    
+    // Report a finished round or match for the server's match history
+    sendResult(result) {
+        result.gameId = this.gameId;
+        if (this.court) {
+            result.court = this.court;
         }
+        this.send(result);
     }
     
+    send(message) {
+        if (this.counterManager.socket && this.counterManager.socket.readyState === WebSocket.OPEN) {
+            this.counterManager.socket.send(JSON.stringify(message));
+        } else {
+            console.warn("WebSocket not ready, message not sent:", message);
+        }
+    }
+
     // Announce game state changes
     announceGameState(message) {
         console.log(message);
@@ -353,6 +378,16 @@ class GameStateManager {
             }
         }
         
+        // Record the match result on the server
+        this.sendResult({
+            type: 'match-end',
+            rounds: this.roundWinners.length,
+            winner: overallWinner,
+            roundWinners: this.roundWinners,
+            totals: this.calculateTotalScores(),
+            startedAt: this.startedAt
+        });
+        
         // Update round info
         if (this.roundInfoElement) {
             this.roundInfoElement.textContent = `Game Over! Winner: ${overallWinner}`;
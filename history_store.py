@@ -0,0 +1,325 @@
+# Results of finished rounds and matches, kept across reloads and restarts.
+#
+# Displays report {"type": "round-end"} and {"type": "match-end"} and the
+# rows go into an SQLite database in WAL mode, indexed by match ID, court
+# and time. Writes are handed to a background thread that commits whatever
+# piled up in one transaction, so the event loop never waits on the disk.
+#
+# GET /history/rounds and /history/matches answer queries with JSON or CSV
+# (?format=csv), filtered by ?match=, ?court=, ?game=, ?since=, ?until=
+# (epoch seconds or ISO dates) and ?limit=. Rows are read in pages of
+# PAGE_SIZE on an executor thread and streamed out page by page, so an
+# export of a whole tournament day never sits in memory at once.
+
+import asyncio
+import csv
+import datetime
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from server_log import get_logger
+from static_server import Response
+
+DB_FILENAME = "history.sqlite3"
+
+# Rows fetched per query while streaming a result
+PAGE_SIZE = 500
+
+# Minimum seconds between commits; more rows get batched into each one
+COMMIT_INTERVAL = 0.05
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rounds (
+    id INTEGER PRIMARY KEY,
+    match_id TEXT NOT NULL,
+    court TEXT NOT NULL,
+    game_id TEXT NOT NULL,
+    round INTEGER NOT NULL,
+    winner TEXT,
+    scores TEXT NOT NULL,
+    ended_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rounds_match ON rounds (match_id, ended_at);
+CREATE INDEX IF NOT EXISTS rounds_court ON rounds (court, ended_at);
+CREATE INDEX IF NOT EXISTS rounds_game ON rounds (game_id, ended_at);
+CREATE INDEX IF NOT EXISTS rounds_time ON rounds (ended_at);
+
+CREATE TABLE IF NOT EXISTS matches (
+    id INTEGER PRIMARY KEY,
+    match_id TEXT NOT NULL,
+    court TEXT NOT NULL,
+    game_id TEXT NOT NULL,
+    rounds INTEGER NOT NULL,
+    winner TEXT,
+    round_winners TEXT NOT NULL,
+    totals TEXT NOT NULL,
+    started_at REAL,
+    ended_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS matches_match ON matches (match_id, ended_at);
+CREATE INDEX IF NOT EXISTS matches_court ON matches (court, ended_at);
+CREATE INDEX IF NOT EXISTS matches_game ON matches (game_id, ended_at);
+CREATE INDEX IF NOT EXISTS matches_time ON matches (ended_at);
+"""
+
+# Columns per table as (column, output name, kind); "json" columns hold
+# encoded objects, "time" columns epoch seconds
+COLUMNS = {
+    "rounds": (
+        ("match_id", "matchId", "text"),
+        ("court", "court", "text"),
+        ("game_id", "gameId", "text"),
+        ("round", "round", "int"),
+        ("winner", "winner", "text"),
+        ("scores", "scores", "json"),
+        ("ended_at", "endedAt", "time"),
+    ),
+    "matches": (
+        ("match_id", "matchId", "text"),
+        ("court", "court", "text"),
+        ("game_id", "gameId", "text"),
+        ("rounds", "rounds", "int"),
+        ("winner", "winner", "text"),
+        ("round_winners", "roundWinners", "json"),
+        ("totals", "totals", "json"),
+        ("started_at", "startedAt", "time"),
+        ("ended_at", "endedAt", "time"),
+    ),
+}
+
+# Query parameter -> column it filters on by equality
+FILTERS = {"match": "match_id", "court": "court", "game": "game_id"}
+
+log = get_logger("history")
+
+
+class QueryError(Exception):
+    pass
+
+
+def parse_time(value):
+    # Epoch seconds or an ISO 8601 date/datetime (local time unless it has an offset)
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise QueryError(f"invalid time: {value!r}")
+
+
+def format_time(value):
+    if value is None:
+        return None
+    # A row saved before times were checked shouldn't break the export
+    try:
+        return datetime.datetime.fromtimestamp(value, datetime.timezone.utc).isoformat(timespec="seconds")
+    except (OverflowError, OSError, ValueError, TypeError):
+        return None
+
+
+def parse_query(query):
+    # Request query string -> (where clauses, params, limit)
+    clauses = []
+    params = []
+    for name, column in FILTERS.items():
+        if name in query:
+            clauses.append(f"{column} = ?")
+            params.append(query[name][-1])
+    if "since" in query:
+        clauses.append("ended_at >= ?")
+        params.append(parse_time(query["since"][-1]))
+    if "until" in query:
+        clauses.append("ended_at < ?")
+        params.append(parse_time(query["until"][-1]))
+
+    limit = None
+    if "limit" in query:
+        try:
+            limit = int(query["limit"][-1])
+        except ValueError:
+            raise QueryError("invalid limit")
+        if limit < 0:
+            raise QueryError("invalid limit")
+    return clauses, params, limit
+
+
+class HistoryStore:
+    def __init__(self, directory, commit_interval=COMMIT_INTERVAL):
+        self.directory = directory
+        self.path = os.path.join(directory, DB_FILENAME)
+        self.commit_interval = commit_interval
+
+        self.recorded = 0
+        self.commits = 0
+
+        self._pending = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+        self._reader = None
+        self._read_lock = threading.Lock()
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        writer = self._connect()
+        writer.executescript(SCHEMA)
+        self._reader = self._connect()
+        self._thread = threading.Thread(target=self._run, args=(writer,), name="history", daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def record_round(self, match_id, court, game_id, round_number, winner, scores):
+        self._append(
+            "INSERT INTO rounds (match_id, court, game_id, round, winner, scores, ended_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (match_id, court, game_id, round_number, winner, json.dumps(scores), time.time()),
+        )
+
+    def record_match(self, match_id, court, game_id, rounds, winner, round_winners, totals, started_at=None):
+        self._append(
+            "INSERT INTO matches (match_id, court, game_id, rounds, winner, round_winners, totals, started_at, ended_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (match_id, court, game_id, rounds, winner, json.dumps(round_winners), json.dumps(totals),
+             started_at, time.time()),
+        )
+
+    def _append(self, sql, params):
+        with self._cond:
+            self._pending.append((sql, params))
+            self._cond.notify()
+        self.recorded += 1
+
+    def close(self):
+        if self._thread is None:
+            return
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self._thread = None
+        self._reader.close()
+
+    def _run(self, writer):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending and self._closed:
+                    break
+                batch, self._pending = self._pending, []
+
+            try:
+                with writer:
+                    for sql, params in batch:
+                        writer.execute(sql, params)
+                self.commits += 1
+            except sqlite3.Error as e:
+                log.error("Error writing match history: %s", e)
+
+            # Let the next batch build up instead of committing every row
+            if self.commit_interval and not self._closed:
+                time.sleep(self.commit_interval)
+        writer.close()
+
+    def _fetch_page(self, table, clauses, params, after, count):
+        # One page in (ended_at, id) order, starting after the given key
+        columns = ", ".join(column for column, _, _ in COLUMNS[table])
+        where = list(clauses)
+        page_params = list(params)
+        if after is not None:
+            where.append("(ended_at, id) > (?, ?)")
+            page_params.extend(after)
+        sql = f"SELECT id, {columns} FROM {table}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY ended_at, id LIMIT ?"
+        page_params.append(count)
+        with self._read_lock:
+            return self._reader.execute(sql, page_params).fetchall()
+
+    async def rows(self, table, clauses, params, limit=None):
+        # Matching rows as output dicts, read a page at a time off the event loop
+        loop = asyncio.get_running_loop()
+        fields = COLUMNS[table]
+        ended_index = [column for column, _, _ in fields].index("ended_at") + 1
+        after = None
+        remaining = limit
+        while remaining is None or remaining > 0:
+            count = PAGE_SIZE if remaining is None else min(PAGE_SIZE, remaining)
+            page = await loop.run_in_executor(None, self._fetch_page, table, clauses, params, after, count)
+            for row in page:
+                yield {
+                    name: json.loads(value) if kind == "json" else format_time(value) if kind == "time" else value
+                    for (_, name, kind), value in zip(fields, row[1:])
+                }
+            if len(page) < count:
+                return
+            after = (page[-1][ended_index], page[-1][0])
+            if remaining is not None:
+                remaining -= len(page)
+
+    async def export_json(self, table, clauses, params, limit):
+        first = True
+        async for row in self.rows(table, clauses, params, limit):
+            yield (b"[\n" if first else b",\n") + json.dumps(row).encode("utf-8")
+            first = False
+        yield b"[]\n" if first else b"\n]\n"
+
+    async def export_csv(self, table, clauses, params, limit):
+        fields = COLUMNS[table]
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow([name for _, name, _ in fields])
+        rows = 0
+        async for row in self.rows(table, clauses, params, limit):
+            writer.writerow([
+                json.dumps(row[name]) if kind == "json" else row[name]
+                for _, name, kind in fields
+            ])
+            rows += 1
+            # Hand out a chunk per page instead of per row
+            if rows % PAGE_SIZE == 0:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode("utf-8")
+
+    def route(self, table):
+        # /history/<table> handler for StaticServer.add_route()
+        def handle(request):
+            try:
+                clauses, params, limit = parse_query(request.query)
+            except QueryError as e:
+                return Response(400, str(e).encode("utf-8"), content_type="text/plain")
+
+            headers = {"Cache-Control": "no-store"}
+            if request.query.get("format", ["json"])[-1] == "csv":
+                headers["Content-Disposition"] = f'attachment; filename="{table}.csv"'
+                stream = self.export_csv(table, clauses, params, limit)
+                return Response(200, headers=headers, content_type="text/csv; charset=utf-8", stream=stream)
+            stream = self.export_json(table, clauses, params, limit)
+            return Response(200, headers=headers, content_type="application/json", stream=stream)
+        return handle
+
+    def routes(self):
+        # Every /history path, for the listener that serves them
+        return {f"/history/{table}": self.route(table) for table in ("rounds", "matches")}
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            "recorded": self.recorded,
+            "pending": pending,
+            "commits": self.commits,
+        }
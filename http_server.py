@@ -1,9 +1,14 @@
-import http.server
-import socketserver
+import asyncio
+import os
+
+from static_server import StaticServer
 
 PORT = 8000
-Handler = http.server.SimpleHTTPRequestHandler
 
-with socketserver.TCPServer(("0.0.0.0", PORT), Handler) as httpd:
+async def main():
+    server = await StaticServer(os.getcwd()).start("0.0.0.0", PORT)
     print(f"Serving at http://0.0.0.0:{PORT}")
-    httpd.serve_forever()
\ No newline at end of file
+    async with server:
+        await server.serve_forever()
+
+asyncio.run(main())
@@ -0,0 +1,211 @@
+# Is the event loop keeping up? When buttons "feel slow" the cause is
+# usually something holding the loop: a print() to a slow console, encoding
+# a big message, the HTTP thread or the QR window's tkinter holding the GIL.
+#
+# LoopMonitor measures scheduling delay: a probe sleeps PROBE_INTERVAL and
+# records how late it woke up. The lag goes into the
+# scorecounter_loop_lag_seconds histogram and a window of recent samples
+# for percentiles ({"type": "stats"} reports them). A watchdog thread
+# notices when the probe hasn't run for STALL_THRESHOLD past its time,
+# grabs the loop thread's stack while it is still stuck, and logs the stall
+# with that stack once the loop is back (or after STALL_REPORT_AFTER if it
+# stays stuck).
+#
+# SamplingProfiler samples the stacks of every thread every SAMPLE_INTERVAL
+# for a given time and writes them in folded format (one
+# "thread;outer;...;inner count" line per stack, ready for flamegraph.pl
+# or speedscope). It is started and stopped with the admin-only
+# {"type": "profile"} message, so a live match never needs a restart.
+
+import asyncio
+import collections
+import os
+import sys
+import threading
+import time
+import traceback
+
+from metrics import registry as metrics
+from server_log import get_logger
+
+# Seconds between lag probes
+PROBE_INTERVAL = 0.05
+
+# Lag past which the loop counts as stalled, and when a stall still going
+# on is reported anyway
+STALL_THRESHOLD = 0.1
+STALL_REPORT_AFTER = 5.0
+
+# Recent lag samples kept for percentiles (about a minute)
+LAG_WINDOW = 1200
+
+# Profiler: seconds between samples, default and longest run
+SAMPLE_INTERVAL = 0.005
+DEFAULT_PROFILE_SECONDS = 30
+MAX_PROFILE_SECONDS = 600
+
+log = get_logger("loop")
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def thread_stack(thread_id):
+    frame = sys._current_frames().get(thread_id)
+    if frame is None:
+        return ""
+    return "".join(traceback.format_stack(frame))
+
+
+class LoopMonitor:
+    def __init__(self, interval=PROBE_INTERVAL, stall_threshold=STALL_THRESHOLD):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.samples = collections.deque(maxlen=LAG_WINDOW)
+        self.stalls = 0
+        self.last_stall = None
+        self.beat = time.monotonic()
+        self.task = None
+        self._thread = None
+        self._thread_id = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        # Call from the event loop thread
+        self._thread_id = threading.get_ident()
+        self.beat = time.monotonic()
+        self.task = asyncio.get_running_loop().create_task(self._probe())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+
+    async def _probe(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self.samples.append(lag)
+            metrics.loop_lag.observe(lag)
+            self.beat = now
+
+    def _watch(self):
+        stall_start = None
+        stack = None
+        reported = False
+        while not self._stopped.wait(self.stall_threshold / 2):
+            beat = self.beat
+            overdue = time.monotonic() - beat - self.interval
+            if stall_start is None:
+                if overdue > self.stall_threshold:
+                    # Take the stack now, while the loop is still inside the culprit
+                    stall_start = beat
+                    stack = thread_stack(self._thread_id)
+                    reported = False
+                continue
+
+            if beat != stall_start:
+                self._stalled(beat - stall_start - self.interval, stack, reported)
+                stall_start = None
+            elif overdue > STALL_REPORT_AFTER and not reported:
+                log.warning("Event loop blocked for %.1f s so far in:\n%s", overdue, stack,
+                            extra={"event": "loop-stall"})
+                reported = True
+
+    def _stalled(self, duration, stack, reported):
+        self.stalls += 1
+        metrics.loop_stalls += 1
+        self.last_stall = {"duration": round(duration * 1000), "at": time.time(), "stack": stack}
+        if not reported:
+            log.warning("Event loop blocked for %.0f ms in:\n%s", duration * 1000, stack,
+                        extra={"event": "loop-stall"})
+
+    def stats(self):
+        ordered = sorted(self.samples)
+        return {
+            "lagMs": {
+                "p50": round(percentile(ordered, 0.5) * 1000, 2),
+                "p90": round(percentile(ordered, 0.9) * 1000, 2),
+                "p99": round(percentile(ordered, 0.99) * 1000, 2),
+                "max": round((ordered[-1] if ordered else 0.0) * 1000, 2),
+            },
+            "stalls": self.stalls,
+            "lastStall": self.last_stall,
+        }
+
+
+class SamplingProfiler:
+    def __init__(self, directory, interval=SAMPLE_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.path = None
+        self.until = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds=DEFAULT_PROFILE_SECONDS, on_done=None):
+        # Sample for seconds on a thread of its own; on_done(path, samples)
+        # is called from that thread once the file is written
+        if self.running:
+            return False
+        seconds = max(1, min(seconds, MAX_PROFILE_SECONDS))
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, time.strftime("profile-%Y%m%d-%H%M%S.folded"))
+        self.until = time.time() + seconds
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(seconds, self.path, on_done),
+                                        name="profiler", daemon=True)
+        self._thread.start()
+        log.info("Profiling for %d s into %s", seconds, self.path, extra={"event": "profile"})
+        return True
+
+    def stop(self):
+        # Ends the run early; the file is still written
+        if not self.running:
+            return False
+        self._stop.set()
+        return True
+
+    def _run(self, seconds, path, on_done):
+        me = threading.get_ident()
+        names = {}
+        counts = collections.Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                if thread_id not in names:
+                    names.update((thread.ident, thread.name) for thread in threading.enumerate())
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                counts[";".join(reversed(stack))] += 1
+            samples += 1
+
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in counts.most_common():
+                    f.write(f"{stack} {count}\n")
+            log.info("Profile written to %s (%d samples)", path, samples, extra={"event": "profile"})
+        except OSError as e:
+            log.error("Error writing profile: %s", e)
+            path = None
+        self.until = None
+        if on_done is not None:
+            on_done(path, samples)
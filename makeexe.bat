@@ -1,6 +1,6 @@
 @echo off
 echo Building ScoreCounter executable...
-pip install pyinstaller qrcode pillow websockets
+pip install pyinstaller qrcode pillow websockets orjson winloop
 pyinstaller --name ScoreCounter --onefile ^
   --add-data "*.html;." ^
   --add-data "*.js;." ^
@@ -8,6 +8,8 @@ pyinstaller --name ScoreCounter --onefile ^
   --hidden-import=PIL._tkinter ^
   --hidden-import=PIL._imagingtk ^
   --hidden-import=PIL._tkinter_finder ^
+  --hidden-import=orjson ^
+  --collect-submodules=winloop ^
   app.py
 
 echo.
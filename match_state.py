@@ -0,0 +1,226 @@
+# State of a single match: the counters and the timer.
+#
+# Counters carry a sequence number so clients can apply small deltas
+# instead of receiving every counter on every click:
+#   {"type": "counters", "values": {...}, "seq": n}
+#       Full snapshot. Sent on connect, on request and to legacy clients.
+#   {"type": "counters-delta", "seq": n, "changes": {...}, "reset": true?}
+#       Only the counters that changed. "reset" means clear all counters
+#       before applying "changes". Coalesced deltas also carry "since", the
+#       seq they apply on top of (otherwise seq - 1). A client whose last seq
+#       doesn't match sends {"type": "counters-sync-request"} for a snapshot.
+#
+# The timer is one of "timer-sync" (never started), "timer-start" (running),
+# "timer-pause", "timer-reset" or "timer-ended" (ran out; the server sends
+# it when the time is up, which is what ends a round on the displays).
+
+import time
+
+# Protocols a client can be on; legacy clients never announce one
+PROTOCOL_FULL = "full"
+PROTOCOL_DELTA = "delta"
+
+# Timer duration in seconds until a client sets one, and the durations a
+# client may set (anything else would overflow when the message is built)
+DEFAULT_DURATION = 60
+MIN_DURATION = 1
+MAX_DURATION = 24 * 3600
+
+# Timer phases and the message type each one is sent as
+PHASE_IDLE = "idle"
+PHASE_RUNNING = "running"
+PHASE_PAUSED = "paused"
+PHASE_RESET = "reset"
+PHASE_ENDED = "ended"
+PHASE_TYPES = {
+    PHASE_IDLE: "timer-sync",
+    PHASE_RUNNING: "timer-start",
+    PHASE_PAUSED: "timer-pause",
+    PHASE_RESET: "timer-reset",
+    PHASE_ENDED: "timer-ended",
+}
+
+
+# Counters stay within +-MAX_COUNTER_VALUE and move at most MAX_COUNTER_STEP
+# per message, so no sum can overflow into Infinity
+MAX_COUNTER_VALUE = 10**9
+MAX_COUNTER_STEP = 1000
+
+
+def clamp_counter(value):
+    return max(-MAX_COUNTER_VALUE, min(value, MAX_COUNTER_VALUE))
+
+
+def valid_duration(duration):
+    return (isinstance(duration, (int, float)) and not isinstance(duration, bool)
+            and MIN_DURATION <= duration <= MAX_DURATION)
+
+
+class CounterState:
+    def __init__(self):
+        self.values = {}
+        self.seq = 0
+
+    def increment(self, counter_id, value=1):
+        # Create the counter if it doesn't exist
+        new_value = clamp_counter(self.values.get(counter_id, 0) + value)
+        self.values[counter_id] = new_value
+        return self._delta({counter_id: new_value})
+
+    def subtract(self, counter_id, value=1):
+        # Prevent negative values
+        new_value = clamp_counter(max(0, self.values.get(counter_id, 0) - value))
+        self.values[counter_id] = new_value
+        return self._delta({counter_id: new_value})
+
+    def reset(self):
+        self.values.clear()
+        return self._delta({}, reset=True)
+
+    def _delta(self, changes, reset=False):
+        self.seq += 1
+        delta = {"type": "counters-delta", "seq": self.seq, "changes": changes}
+        if reset:
+            delta["reset"] = True
+        return delta
+
+    def snapshot(self):
+        return {"type": "counters", "values": self.values, "seq": self.seq}
+
+    def apply(self, delta):
+        # Replay a delta produced earlier (e.g. from the event log)
+        if delta.get("reset"):
+            self.values.clear()
+        self.values.update(delta.get("changes", {}))
+        self.seq = delta.get("seq", self.seq + 1)
+
+
+class TimerState:
+    # The server owns the timer. It runs on time.monotonic(), so wall-clock
+    # jumps on the server don't move it, and whatever times clients send
+    # are ignored. Messages carry "startTime" in server wall-clock ms (the
+    # moment elapsed time was zero); clients map it to their own clock with
+    # the offset they measure through "timer-clock" (see the engine).
+    def __init__(self, duration=DEFAULT_DURATION):
+        self.phase = PHASE_IDLE
+        self.duration = duration
+        # Monotonic second at which elapsed time was zero, while running
+        self.anchor = 0.0
+        # Milliseconds left, while paused
+        self.remaining = duration * 1000
+        self._state = None
+        # Bumped on every change so encoded copies can be cached
+        self.version = 0
+
+    @property
+    def running(self):
+        return self.phase == PHASE_RUNNING
+
+    def elapsed_ms(self):
+        if self.running:
+            return (time.monotonic() - self.anchor) * 1000
+        return self.duration * 1000 - self.remaining
+
+    def remaining_ms(self):
+        return max(0, self.duration * 1000 - self.elapsed_ms())
+
+    def expires_in(self):
+        # Seconds until the running timer reaches zero, or None
+        return self.remaining_ms() / 1000 if self.running else None
+
+    def _changed(self, phase):
+        self.phase = phase
+        self._state = None
+        self.version += 1
+
+    def start(self, data=None):
+        # Start from the top, or resume where a pause left off
+        duration = (data or {}).get("duration")
+        if self.running:
+            return self.state
+        if self.phase in (PHASE_IDLE, PHASE_RESET, PHASE_ENDED) or self.remaining <= 0:
+            if valid_duration(duration):
+                self.duration = duration
+            self.remaining = self.duration * 1000
+        self.anchor = time.monotonic() - (self.duration * 1000 - self.remaining) / 1000
+        self._changed(PHASE_RUNNING)
+        return self.state
+
+    def pause(self, data=None):
+        if self.running:
+            self.remaining = self.remaining_ms()
+            self._changed(PHASE_PAUSED)
+        return self.state
+
+    def reset(self, data=None):
+        duration = (data or {}).get("duration")
+        if valid_duration(duration):
+            self.duration = duration
+        self.remaining = self.duration * 1000
+        self._changed(PHASE_RESET)
+        return self.state
+
+    def expire(self):
+        # Time is up: stop at zero
+        self.remaining = 0
+        self._changed(PHASE_ENDED)
+        return self.state
+
+    @property
+    def state(self):
+        # The timer message, built once per change
+        if self._state is None:
+            self._state = self._message()
+        return self._state
+
+    @state.setter
+    def state(self, message):
+        # Load a timer message (journal, snapshot or upstream server)
+        duration = message.get("duration")
+        if valid_duration(duration):
+            self.duration = duration
+        message_type = message.get("type")
+        if message.get("isRunning") and message.get("startTime"):
+            elapsed = time.time() * 1000 - message["startTime"]
+            self.anchor = time.monotonic() - elapsed / 1000
+            if elapsed >= self.duration * 1000:
+                self.remaining = 0
+                self._changed(PHASE_ENDED)
+            else:
+                self._changed(PHASE_RUNNING)
+            return
+        paused = message.get("pausedTimeRemaining", message.get("pausedTime"))
+        if message_type == "timer-ended":
+            self.remaining = 0
+            self._changed(PHASE_ENDED)
+        elif message_type == "timer-pause" and isinstance(paused, (int, float)):
+            self.remaining = max(0, min(paused, self.duration * 1000))
+            self._changed(PHASE_PAUSED)
+        elif message_type == "timer-reset":
+            self.remaining = self.duration * 1000
+            self._changed(PHASE_RESET)
+        else:
+            self.remaining = self.duration * 1000
+            self._changed(PHASE_IDLE)
+
+    def _message(self):
+        # No elapsedTime: the message is cached and sent long after it was
+        # built, clients count from startTime (on the server clock)
+        if self.running:
+            return {
+                "type": "timer-start",
+                "isRunning": True,
+                "startTime": round(time.time() * 1000 - self.elapsed_ms()),
+                "pausedTime": 0,
+                "pausedTimeRemaining": 0,
+                "duration": self.duration,
+            }
+        remaining = round(self.remaining)
+        return {
+            "type": PHASE_TYPES[self.phase],
+            "isRunning": False,
+            "startTime": 0,
+            "pausedTime": remaining,
+            "pausedTimeRemaining": remaining,
+            "duration": self.duration,
+        }
@@ -0,0 +1,683 @@
+# Shared WebSocket message engine for app.py and websocket_server.py.
+#
+# Handlers are registered per message type with @handler(type, **schema).
+# Every frame goes through one fast path: size check, decode with the
+# pluggable codec, dict lookup of the handler, then a compact schema check.
+# Malformed frames are answered with {"type": "error"} and dropped before
+# any match state is touched; the connection stays open.
+#
+# In relay mode (engine.upstream set) every message that isn't a local read
+# is passed to the upstream server as received instead of being handled.
+
+import asyncio
+import hmac
+import inspect
+import math
+import time
+
+from websockets.exceptions import ConnectionClosedError
+
+import codec
+from metrics import registry as metrics
+from rate_limit import ACTION_MERGE, DEFAULT_LIMITS, RELAY_LIMIT_FACTOR, ClientLimiter, scaled_limits
+from server_log import get_logger
+from match_state import MAX_COUNTER_STEP, MAX_DURATION, MIN_DURATION, PROTOCOL_DELTA, PROTOCOL_FULL
+from loop_monitor import DEFAULT_PROFILE_SECONDS
+from rooms import (ROLE_RELAY, ROLE_SPECTATOR, ROLES, last_seq_from_request, match_id_from_request, request_query,
+                   role_from_request)
+
+# Largest frame the engine will try to decode
+MAX_MESSAGE_SIZE = 16 * 1024
+
+# {"type": "ping"} exactly as clients send it, answered without decoding
+PING_FRAME = '{"type":"ping"}'
+PONG_FRAME = '{"type": "pong"}'
+
+# Most operations one batch message may carry
+MAX_BATCH_OPS = 32
+
+# Client kinds reported in metrics
+KIND_DISPLAY = "display"
+KIND_CONTROLLER = "controller"
+KIND_SPECTATOR = "spectator"
+KIND_RELAY = "relay"
+
+# Field types for schemas
+STRING = (str,)
+NUMBER = (int, float)
+BOOLEAN = (bool,)
+MATCH_ID = (str, int)
+LIST = (list,)
+OBJECT = (dict,)
+
+HANDLERS = {}
+
+log = get_logger("engine")
+
+
+class MessageError(Exception):
+    pass
+
+
+class Handler:
+    def __init__(self, message_type, func, schema, mutates=False):
+        self.message_type = message_type
+        self.func = func
+        self.mutates = mutates
+        self.is_async = inspect.iscoroutinefunction(func)
+        # (field, allowed types, required, (low, high) or None) tuples, checked in order
+        self.fields = tuple(
+            (field, spec[0], spec[1], spec[2]) for field, spec in schema.items()
+        )
+
+    def validate(self, data):
+        for field, types, required, bounds in self.fields:
+            value = data.get(field)
+            if value is None:
+                if required:
+                    raise MessageError(f"{self.message_type}: missing {field}")
+                continue
+            # bool is an int subclass but never a valid number here
+            if not isinstance(value, types) or (value is True or value is False) and bool not in types:
+                raise MessageError(f"{self.message_type}: invalid {field}")
+            # NaN and Infinity would be broadcast as JSON no browser parses
+            if isinstance(value, float) and not math.isfinite(value):
+                raise MessageError(f"{self.message_type}: invalid {field}")
+            if bounds is not None and not bounds[0] <= value <= bounds[1]:
+                raise MessageError(f"{self.message_type}: {field} out of range")
+
+
+def required(types, bounds=None):
+    return (types, True, bounds)
+
+
+def optional(types, bounds=None):
+    return (types, False, bounds)
+
+
+def handler(message_type, mutates=False, **schema):
+    # Register func(session, data) as the handler for message_type;
+    # mutates marks messages that change match state
+    def register(func):
+        HANDLERS[message_type] = Handler(message_type, func, schema, mutates)
+        return func
+    return register
+
+
+def decode_frame(frame):
+    if len(frame) > MAX_MESSAGE_SIZE:
+        raise MessageError("message too large")
+    try:
+        data = codec.loads(frame)
+    except ValueError:
+        raise MessageError("invalid JSON")
+    if not isinstance(data, dict):
+        raise MessageError("message must be an object")
+
+    entry = HANDLERS.get(data.get("type"))
+    if entry is None:
+        raise MessageError(f"unknown message type: {data.get('type')!r}")
+    entry.validate(data)
+    return entry, data
+
+
+def reject(session, reason):
+    # Refuse a message that passed the schema check but not the handler's own
+    metrics.rejected += 1
+    log.warning("Rejected message from %s: %s", session.client_info, reason, extra={"event": "rejected"})
+    session.send({"type": "error", "reason": reason})
+
+
+def initial_kind(role):
+    # Every client counts as a display until it changes something
+    if role == ROLE_SPECTATOR:
+        return KIND_SPECTATOR
+    if role == ROLE_RELAY:
+        return KIND_RELAY
+    return KIND_DISPLAY
+
+
+class Session:
+    def __init__(self, engine, websocket):
+        self.engine = engine
+        self.websocket = websocket
+        self.room = None
+        self.role = role_from_request(websocket)
+        self.limiter = engine.limiter_for(websocket, self.role)
+        # Throttled requests waiting for a token: type -> [data, timer handle]
+        self.deferred = {}
+        self.kind = initial_kind(self.role)
+        # Set when the client was caught up from its lastSeq on connect, or
+        # sent a full snapshot it hasn't said hello since
+        self.resumed = False
+        self.snapshotted = False
+        # Last round trip and clock offset (ms) the client reported from timer-clock
+        self.rtt = None
+        self.clock_offset = None
+        address = websocket.remote_address or ("unknown", 0)
+        self.client_info = f"{address[0]}:{address[1]}"
+
+    def send(self, message, key=None):
+        self.room.hub(self.websocket).send(self.websocket, message, key)
+
+    def set_role(self, role):
+        if role == self.role or role not in ROLES:
+            return False
+        self.room.set_role(self.websocket, role)
+        self.role = role
+        metrics.client_removed(self.kind)
+        self.kind = initial_kind(role)
+        metrics.client_added(self.kind)
+        return True
+
+    def mutated(self):
+        # The client changed match state, so it is a controller now
+        if self.kind == KIND_DISPLAY:
+            metrics.client_removed(self.kind)
+            self.kind = KIND_CONTROLLER
+            metrics.client_added(self.kind)
+
+    def close(self):
+        for _, handle in self.deferred.values():
+            handle.cancel()
+        self.deferred.clear()
+
+
+class MessageEngine:
+    def __init__(self, rooms, limits=None, rate_limit=True, history=None, upstream=None):
+        self.rooms = rooms
+        # Per-type rate limits, see rate_limit.DEFAULT_LIMITS
+        self.limits = limits
+        self.rate_limit = rate_limit
+        # Where finished rounds and matches are recorded (history_store.HistoryStore)
+        self.history = history
+        # Server this one relays for (relay.Relay); also set on rooms.upstream
+        self.upstream = upstream
+        # Inbound traffic is recorded here when set (capture.CaptureRecorder)
+        self.capture = None
+        # Time source for rate limits; a capture replay runs them on recorded time
+        self.clock = time.monotonic
+        # Event loop lag (loop_monitor.LoopMonitor) and the profiler the
+        # "profile" message drives, allowed only with admin_token
+        self.loop_monitor = None
+        self.profiler = None
+        self.admin_token = None
+
+    def relay_authorized(self, websocket):
+        # A relay proves it is one of ours with ?token=<admin token>
+        token = self.admin_token
+        supplied = request_query(websocket).get("token", [""])[0]
+        return bool(token) and hmac.compare_digest(supplied.encode(), token.encode())
+
+    def limiter_for(self, websocket, role):
+        if not self.rate_limit:
+            return None
+        limits = DEFAULT_LIMITS if self.limits is None else self.limits
+        if role == ROLE_RELAY:
+            # An authorized relay's clients were limited where they connected;
+            # anyone else can claim ?role=relay, so only gets roomier limits
+            if self.relay_authorized(websocket):
+                return None
+            limits = scaled_limits(limits, RELAY_LIMIT_FACTOR)
+        return ClientLimiter(limits, self.clock)
+
+    async def handle_connection(self, websocket):
+        session = Session(self, websocket)
+        log.info("Client connected: %s", session.client_info, extra={"event": "connection"})
+
+        # Clients start on full snapshots until they say they understand deltas;
+        # a client resuming with its last seq, or a relay, already does
+        last_seq = last_seq_from_request(websocket)
+        protocol = PROTOCOL_FULL if last_seq is None and session.role != ROLE_RELAY else PROTOCOL_DELTA
+        session.room = self.rooms.join(websocket, match_id_from_request(websocket), protocol, session.role)
+        metrics.client_added(session.kind)
+        capture = self.capture
+        connection_id = capture.opened(websocket) if capture is not None else None
+        try:
+            # Send initial counter values and timer state, or only what was missed
+            if last_seq is None:
+                session.room.send_snapshot(websocket)
+                session.snapshotted = True
+            else:
+                session.room.send_resume(websocket, last_seq)
+                session.resumed = True
+            log.debug("Sent initial values to %s for match %s", session.client_info, session.room.match_id,
+                      extra={"event": "snapshot"})
+
+            async for frame in websocket:
+                if capture is not None:
+                    capture.received(connection_id, frame)
+                await self.dispatch(session, frame)
+
+                # Stop reading while this client's outbound queue is backed up
+                channel = session.room.hub(websocket).channels.get(websocket)
+                if channel is not None and channel.backed_up:
+                    metrics.read_pauses += 1
+                    await channel.wait_drained()
+        except ConnectionClosedError as e:
+            # Gone without a close frame, or silent through the keepalive pings
+            metrics.dead_peers += 1
+            log.info("Client %s dropped: %s", session.client_info, e, extra={"event": "connection"})
+        except Exception as e:
+            log.error("Error handling client %s: %s", session.client_info, e)
+        finally:
+            if capture is not None:
+                capture.closed(connection_id)
+            session.close()
+            self.rooms.leave(websocket, session.room)
+            metrics.client_removed(session.kind)
+            log.info("Client disconnected: %s", session.client_info, extra={"event": "connection"})
+
+    async def dispatch(self, session, frame):
+        log.debug("Received message from %s: %s", session.client_info, frame, extra={"event": "message"})
+        if frame == PING_FRAME:
+            self.pong(session)
+            return
+        try:
+            entry, data = decode_frame(frame)
+        except MessageError as e:
+            metrics.rejected += 1
+            log.warning("Rejected message from %s: %s", session.client_info, e, extra={"event": "rejected"})
+            session.send({"type": "error", "reason": str(e)})
+            return
+
+        if session.limiter is not None and not session.limiter.allow(entry.message_type):
+            self.throttle(session, entry, data)
+            return
+        if entry.mutates and session.role == ROLE_SPECTATOR:
+            metrics.rejected += 1
+            session.send({"type": "error", "reason": f"{entry.message_type}: spectators are read-only"})
+            return
+        if self.upstream is not None and self.upstream.forwards(entry.message_type):
+            if entry.mutates:
+                session.mutated()
+            if not self.upstream.forward(session.room, frame):
+                reject(session, f"{entry.message_type}: upstream unavailable")
+            return
+        await self.run(session, entry, data)
+
+    def pong(self, session):
+        # Keepalive from older clients: same limits and metrics as any message
+        if session.limiter is not None and not session.limiter.allow("ping"):
+            self.throttle(session, HANDLERS["ping"], None)
+            return
+        start = time.perf_counter()
+        session.send(PONG_FRAME)
+        metrics.observe_message("ping", time.perf_counter() - start)
+
+    def throttle(self, session, entry, data):
+        message_type = entry.message_type
+        metrics.throttled[message_type] = metrics.throttled.get(message_type, 0) + 1
+        action = session.limiter.action(message_type)
+
+        if action == ACTION_MERGE:
+            # Answer the latest request once a token is available
+            pending = session.deferred.get(message_type)
+            if pending is not None:
+                pending[0] = data
+            else:
+                handle = asyncio.get_running_loop().call_later(
+                    session.limiter.wait_time(message_type), self.run_deferred, session, entry
+                )
+                session.deferred[message_type] = [data, handle]
+
+        notice = session.limiter.notice(message_type, action)
+        if notice is not None:
+            log.warning("Throttled %s from %s (%s)", message_type, session.client_info, action,
+                        extra={"event": "throttled"})
+            session.send(notice)
+
+    def run_deferred(self, session, entry):
+        pending = session.deferred.get(entry.message_type)
+        if pending is None:
+            return
+        if not session.limiter.allow(entry.message_type):
+            pending[1] = asyncio.get_running_loop().call_later(
+                session.limiter.wait_time(entry.message_type), self.run_deferred, session, entry
+            )
+            return
+        del session.deferred[entry.message_type]
+        asyncio.create_task(self.run(session, entry, pending[0]))
+
+    async def run(self, session, entry, data):
+        if entry.mutates:
+            session.mutated()
+
+        start = time.perf_counter()
+        if entry.is_async:
+            await entry.func(session, data)
+        else:
+            entry.func(session, data)
+        metrics.observe_message(entry.message_type, time.perf_counter() - start)
+
+    def stats(self):
+        return {
+            "messages": dict(metrics.messages),
+            "rejected": metrics.rejected,
+            "clients": dict(metrics.client_kinds),
+        }
+
+
+# Counter messages
+
+# Largest step one increment or subtract may take
+COUNTER_STEP = (-MAX_COUNTER_STEP, MAX_COUNTER_STEP)
+
+@handler("increment", mutates=True, counterId=required(STRING), value=optional(NUMBER, COUNTER_STEP), flush=optional(BOOLEAN))
+def handle_increment(session, data):
+    room = session.room
+    delta = room.counters.increment(data["counterId"], data.get("value", 1))
+    log.debug("Incremented %s to %s", data["counterId"], room.counters.values[data["counterId"]], extra={"event": "counter"})
+
+    # Broadcast the changed counter
+    room.broadcast_counters(delta, data.get("flush", False))
+
+
+@handler("subtract-counter", mutates=True, counterId=required(STRING), value=optional(NUMBER, COUNTER_STEP), flush=optional(BOOLEAN))
+def handle_subtract_counter(session, data):
+    # Subtract without going negative
+    delta = session.room.counters.subtract(data["counterId"], data.get("value", 1))
+
+    # Broadcast the changed counter
+    session.room.broadcast_counters(delta, data.get("flush", False))
+
+
+@handler("reset-counters", mutates=True, flush=optional(BOOLEAN))
+def handle_reset_counters(session, data):
+    # Reset all counters to zero
+    delta = session.room.counters.reset()
+    log.info("All counters reset in match %s", session.room.match_id)
+
+    # Broadcast the reset
+    session.room.broadcast_counters(delta, data.get("flush", False))
+
+
+@handler("counters-sync-request")
+def handle_counters_sync_request(session, data):
+    # Client detected a gap in the delta sequence
+    session.room.send_counters(session.websocket)
+
+
+# Batches
+
+def batch_increment(room, op):
+    return room.counters.increment(op["counterId"], op.get("value", 1))
+
+
+def batch_subtract(room, op):
+    return room.counters.subtract(op["counterId"], op.get("value", 1))
+
+
+def batch_reset_counters(room, op):
+    return room.counters.reset()
+
+
+def batch_timer_start(room, op):
+    room.timer.start(op)
+
+
+def batch_timer_pause(room, op):
+    room.timer.pause(op)
+
+
+def batch_timer_reset(room, op):
+    room.timer.reset(op)
+
+
+# Operations a batch may carry; counter ops return their delta, timer ops None
+BATCH_OPS = {
+    "increment": batch_increment,
+    "subtract-counter": batch_subtract,
+    "reset-counters": batch_reset_counters,
+    "timer-start": batch_timer_start,
+    "timer-pause": batch_timer_pause,
+    "timer-reset": batch_timer_reset,
+}
+
+
+def validate_batch(ops):
+    # Check every operation before any of them is applied
+    if not ops:
+        raise MessageError("batch: no ops")
+    if len(ops) > MAX_BATCH_OPS:
+        raise MessageError(f"batch: more than {MAX_BATCH_OPS} ops")
+    for index, op in enumerate(ops):
+        if not isinstance(op, dict) or op.get("type") not in BATCH_OPS:
+            raise MessageError(f"batch: invalid op {index}")
+        try:
+            HANDLERS[op["type"]].validate(op)
+        except MessageError as e:
+            raise MessageError(f"batch: op {index}: {e}")
+
+
+@handler("batch", mutates=True, ops=required(LIST))
+def handle_batch(session, data):
+    ops = data["ops"]
+    try:
+        validate_batch(ops)
+    except MessageError as e:
+        reject(session, str(e))
+        return
+
+    # Apply in order, then send one counter update and one timer update at most
+    room = session.room
+    deltas = []
+    timer_version = room.timer.version
+    for op in ops:
+        delta = BATCH_OPS[op["type"]](room, op)
+        if delta is not None:
+            deltas.append(delta)
+    # No timer broadcast or journal record for ops that left it as it was
+    timer_changed = room.timer.version != timer_version
+    log.debug("Applied batch of %d ops in match %s", len(ops), room.match_id, extra={"event": "batch"})
+    room.broadcast_batch(deltas, timer_changed)
+
+
+# Subscription
+
+@handler("hello", matchId=optional(MATCH_ID), deltas=optional(BOOLEAN), lastSeq=optional(NUMBER), role=optional(STRING))
+@handler("subscribe", matchId=optional(MATCH_ID), deltas=optional(BOOLEAN), lastSeq=optional(NUMBER), role=optional(STRING))
+def handle_hello(session, data):
+    engine = session.engine
+
+    # Switch match if the client asked for one
+    room = session.room
+    if "matchId" in data:
+        session.room = engine.rooms.move(session.websocket, session.room, data.get("matchId"))
+        log.debug("Client %s subscribed to match %s", session.client_info, session.room.match_id, extra={"event": "subscribe"})
+
+    # Spectators move to the throttled read-only tier
+    role_changed = "role" in data and session.set_role(data["role"])
+
+    # Newer clients opt in to counter deltas; others stay on full snapshots
+    if data.get("deltas"):
+        session.room.hub(session.websocket).set_protocol(session.websocket, PROTOCOL_DELTA)
+
+    # A hello right after the connect snapshot needs nothing more: anything
+    # that changed since went out to this client as it happened
+    last_seq = data.get("lastSeq")
+    just_snapshotted = session.snapshotted
+    session.snapshotted = False
+    if session.room is not room or role_changed:
+        session.room.send_snapshot(session.websocket)
+    elif last_seq is None:
+        if not just_snapshotted:
+            session.room.send_snapshot(session.websocket)
+    elif not session.resumed:
+        session.room.send_resume(session.websocket, int(last_seq))
+    # Otherwise the client was already caught up when it connected
+
+
+# Timer messages
+
+# Durations a client may set, in seconds
+DURATION_RANGE = (MIN_DURATION, MAX_DURATION)
+
+# The server keeps the time: startTime/elapsedTime/pausedTime* sent by older
+# clients are accepted but ignored, only a new duration is taken.
+@handler("timer-start", mutates=True, duration=optional(NUMBER, DURATION_RANGE), startTime=optional(NUMBER), elapsedTime=optional(NUMBER))
+def handle_timer_start(session, data):
+    version = session.room.timer.version
+    timer_state = session.room.timer.start(data)
+    log.debug("Timer started with duration: %s", timer_state["duration"], extra={"event": "timer"})
+    broadcast_timer_change(session, version)
+
+
+@handler("timer-pause", mutates=True, pausedTime=optional(NUMBER), pausedTimeRemaining=optional(NUMBER))
+def handle_timer_pause(session, data):
+    version = session.room.timer.version
+    session.room.timer.pause(data)
+    broadcast_timer_change(session, version)
+
+
+@handler("timer-reset", mutates=True, duration=optional(NUMBER, DURATION_RANGE))
+def handle_timer_reset(session, data):
+    version = session.room.timer.version
+    session.room.timer.reset(data)
+    broadcast_timer_change(session, version)
+
+
+def broadcast_timer_change(session, version):
+    # Broadcast to all clients in the match, once; a start while running or
+    # a pause while stopped changes nothing, so only the sender hears back
+    if session.room.timer.version != version:
+        session.room.broadcast_timer()
+    else:
+        session.room.send_timer(session.websocket)
+
+
+@handler("timer-sync-request")
+def handle_timer_sync_request(session, data):
+    # Send current timer state to the client
+    session.room.send_timer(session.websocket)
+
+
+@handler("timer-clock", clientTime=required(NUMBER), rtt=optional(NUMBER), offset=optional(NUMBER))
+def handle_timer_clock(session, data):
+    # One clock sample: echo the client's send time with ours (epoch ms).
+    # The client takes offset = serverTime - (clientTime + receive time) / 2
+    # from its lowest-RTT samples and reports what it settled on.
+    session.send({"type": "timer-clock", "clientTime": data["clientTime"], "serverTime": time.time() * 1000})
+    if "rtt" in data and 0 <= data["rtt"] < 60000:
+        session.rtt = data["rtt"]
+        session.clock_offset = data.get("offset")
+        metrics.client_rtt.observe(data["rtt"] / 1000)
+
+
+# Match history
+
+# Round numbers and round counts a match can have
+ROUND_RANGE = (1, 1000)
+# When a match can have started, epoch ms (2000-01-01 to 2100-01-01)
+STARTED_AT_RANGE = (946684800000, 4102444800000)
+
+
+def valid_scores(scores):
+    return all(isinstance(value, NUMBER) and not isinstance(value, bool) and math.isfinite(value)
+               for value in scores.values())
+
+
+def whole(value):
+    return isinstance(value, int) or value.is_integer()
+
+
+@handler("round-end", round=required(NUMBER, ROUND_RANGE), scores=required(OBJECT), winner=optional(STRING),
+         gameId=optional(MATCH_ID), court=optional(STRING))
+def handle_round_end(session, data):
+    history = session.engine.history
+    if history is None:
+        return
+    if session.role == ROLE_SPECTATOR:
+        reject(session, "round-end: spectators are read-only")
+        return
+    if not whole(data["round"]):
+        reject(session, "round-end: invalid round")
+        return
+    if not valid_scores(data["scores"]):
+        reject(session, "round-end: invalid scores")
+        return
+
+    room = session.room
+    history.record_round(room.match_id, data.get("court") or room.match_id, str(data.get("gameId", "")),
+                         int(data["round"]), data.get("winner"), data["scores"])
+    log.info("Round %s recorded for match %s", data["round"], room.match_id, extra={"event": "history"})
+
+
+@handler("match-end", rounds=required(NUMBER, ROUND_RANGE), winner=optional(STRING), roundWinners=optional(LIST),
+         totals=optional(OBJECT), startedAt=optional(NUMBER, STARTED_AT_RANGE), gameId=optional(MATCH_ID), court=optional(STRING))
+def handle_match_end(session, data):
+    history = session.engine.history
+    if history is None:
+        return
+    if session.role == ROLE_SPECTATOR:
+        reject(session, "match-end: spectators are read-only")
+        return
+    if not whole(data["rounds"]):
+        reject(session, "match-end: invalid rounds")
+        return
+    totals = data.get("totals", {})
+    if not valid_scores(totals):
+        reject(session, "match-end: invalid totals")
+        return
+
+    room = session.room
+    started_at = data.get("startedAt")
+    history.record_match(room.match_id, data.get("court") or room.match_id, str(data.get("gameId", "")),
+                         int(data["rounds"]), data.get("winner"), data.get("roundWinners", []), totals,
+                         started_at / 1000 if started_at is not None else None)
+    log.info("Match result recorded for match %s: %s", room.match_id, data.get("winner"), extra={"event": "history"})
+
+
+# Connection upkeep
+
+@handler("ping")
+def handle_ping(session, data):
+    # Just respond with a pong to keep the connection alive
+    session.send(PONG_FRAME)
+
+
+@handler("stats")
+def handle_stats(session, data):
+    # Report fan-out health (queue depths, sends in flight, evictions)
+    room = session.room
+    session.send({
+        "type": "stats",
+        "matchId": room.match_id,
+        "fanout": room.clients.stats(),
+        "spectatorFanout": room.spectators.stats(),
+        "snapshotCache": room.cache_stats(),
+        "rooms": session.engine.rooms.stats(),
+        "engine": session.engine.stats(),
+        "loop": session.engine.loop_monitor.stats() if session.engine.loop_monitor is not None else None,
+    })
+
+
+@handler("profile", action=required(STRING), token=required(STRING), seconds=optional(NUMBER))
+def handle_profile(session, data):
+    # Admin only: {"action": "start", "seconds": n} or {"action": "stop"}; the
+    # client is told {"type": "profile", "state": ...} and gets the file name
+    # once the profile is written
+    engine = session.engine
+    token = engine.admin_token
+    if not token or engine.profiler is None or not hmac.compare_digest(data["token"].encode(), token.encode()):
+        reject(session, "profile: not allowed")
+        return
+
+    profiler = engine.profiler
+    action = data["action"]
+    if action == "start":
+        loop = asyncio.get_running_loop()
+
+        def done(path, samples):
+            loop.call_soon_threadsafe(session.send, {"type": "profile", "state": "written", "file": path,
+                                                     "samples": samples})
+        if not profiler.start(data.get("seconds", DEFAULT_PROFILE_SECONDS), done):
+            reject(session, "profile: already running")
+            return
+        session.send({"type": "profile", "state": "running", "file": profiler.path,
+                      "until": round(profiler.until * 1000)})
+    elif action == "stop":
+        if not profiler.stop():
+            reject(session, "profile: not running")
+    else:
+        reject(session, f"profile: unknown action {action!r}")
@@ -0,0 +1,220 @@
+# Server metrics in the Prometheus text format, served at /metrics.
+#
+# Counters and histograms are updated in place on the hot path (a dict
+# increment, or a perf_counter pair and a bisect), so they stay on in
+# production. Gauges such as connected clients and queue depths are read
+# from the live objects only when /metrics is scraped.
+#
+# Histograms use fixed buckets in seconds:
+#   scorecounter_handle_seconds      time to handle one received message
+#   scorecounter_fanout_seconds      time for one broadcast() to encode and enqueue
+#   scorecounter_send_delay_seconds  time a message waits in a client's queue
+#   scorecounter_client_rtt_seconds  round trip to a client, as its timer clock sync saw it
+#   scorecounter_loop_lag_seconds    how late the event loop ran a callback due now
+
+import asyncio
+import bisect
+import os
+
+from static_server import Response
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+)
+
+# Round trips over the venue network rather than inside the server
+RTT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels=""):
+        # Cumulative buckets, as Prometheus expects
+        separator = "," if labels else ""
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels}{separator}le="{bound:g}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels}{separator}le="+Inf"}} {self.count}'
+        label_block = f"{{{labels}}}" if labels else ""
+        yield f"{name}_sum{label_block} {self.sum:.6f}"
+        yield f"{name}_count{label_block} {self.count}"
+
+
+class Metrics:
+    def __init__(self):
+        self.messages = {}
+        self.rejected = 0
+        self.throttled = {}
+        self.read_pauses = 0
+        # Reconnects by outcome: "replay", "current" or "snapshot"
+        self.resumes = {}
+        self.handle_latency = {}
+        self.fanout_latency = Histogram()
+        self.send_delay = Histogram()
+        self.client_rtt = Histogram(RTT_BUCKETS)
+        self.loop_lag = Histogram()
+        # Times the event loop was blocked past loop_monitor.STALL_THRESHOLD
+        self.loop_stalls = 0
+        self.broadcasts = 0
+        self.dropped_messages = 0
+        self.evicted_clients = 0
+        # Connections that went away without a closing handshake, including
+        # those closed for missing keepalive pings
+        self.dead_peers = 0
+        # Connected clients by kind: "spectator", or "display" until a client
+        # sends a mutation and then "controller"
+        self.client_kinds = {}
+        # Active backends.select() choices, {"loop": ..., "codec": ...}
+        self.backends = None
+
+    def observe_message(self, message_type, seconds):
+        self.messages[message_type] = self.messages.get(message_type, 0) + 1
+        histogram = self.handle_latency.get(message_type)
+        if histogram is None:
+            histogram = self.handle_latency[message_type] = Histogram()
+        histogram.observe(seconds)
+
+    def client_added(self, kind):
+        self.client_kinds[kind] = self.client_kinds.get(kind, 0) + 1
+
+    def client_removed(self, kind):
+        self.client_kinds[kind] = self.client_kinds.get(kind, 0) - 1
+
+    def render(self, rooms, event_log=None, static_server=None):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+
+        metric("scorecounter_messages_total", "counter", "WebSocket messages handled, by type.",
+               [f'scorecounter_messages_total{{type="{t}"}} {n}' for t, n in sorted(self.messages.items())])
+        metric("scorecounter_rejected_messages_total", "counter", "Malformed or unknown messages rejected.",
+               [f"scorecounter_rejected_messages_total {self.rejected}"])
+
+        metric("scorecounter_throttled_messages_total", "counter", "Messages over a client's rate limit, by type.",
+               [f'scorecounter_throttled_messages_total{{type="{t}"}} {n}' for t, n in sorted(self.throttled.items())])
+        metric("scorecounter_read_pauses_total", "counter", "Times reading from a client paused for its backed-up queue.",
+               [f"scorecounter_read_pauses_total {self.read_pauses}"])
+
+        metric("scorecounter_resumes_total", "counter", "Reconnecting clients, by how they were caught up.",
+               [f'scorecounter_resumes_total{{outcome="{o}"}} {n}' for o, n in sorted(self.resumes.items())])
+
+        samples = []
+        for message_type, histogram in sorted(self.handle_latency.items()):
+            samples.extend(histogram.lines("scorecounter_handle_seconds", f'type="{message_type}"'))
+        metric("scorecounter_handle_seconds", "histogram", "Time to handle one message.", samples)
+        metric("scorecounter_fanout_seconds", "histogram", "Time for one broadcast to encode and enqueue.",
+               list(self.fanout_latency.lines("scorecounter_fanout_seconds")))
+        metric("scorecounter_send_delay_seconds", "histogram", "Time a message waits in a client queue.",
+               list(self.send_delay.lines("scorecounter_send_delay_seconds")))
+        metric("scorecounter_client_rtt_seconds", "histogram", "Round trip to clients, from timer clock sync.",
+               list(self.client_rtt.lines("scorecounter_client_rtt_seconds")))
+        metric("scorecounter_loop_lag_seconds", "histogram", "Event loop scheduling delay.",
+               list(self.loop_lag.lines("scorecounter_loop_lag_seconds")))
+        metric("scorecounter_loop_stalls_total", "counter", "Times the event loop was blocked.",
+               [f"scorecounter_loop_stalls_total {self.loop_stalls}"])
+        if self.backends:
+            labels = ",".join(f'{kind}="{name}"' for kind, name in sorted(self.backends.items()))
+            metric("scorecounter_backend_info", "gauge", "Event loop and codec in use.",
+                   [f"scorecounter_backend_info{{{labels}}} 1"])
+
+        # Live state, read at scrape time
+        hubs = [hub for room in rooms.rooms.values() for hub in (room.clients, room.spectators)]
+        channels = [channel for hub in hubs for channel in hub.channels.values()]
+        queued = [len(channel.queue) for channel in channels]
+        metric("scorecounter_clients", "gauge", "Connected WebSocket clients, by kind.",
+               [f'scorecounter_clients{{kind="{k}"}} {n}' for k, n in sorted(self.client_kinds.items())])
+        metric("scorecounter_rooms", "gauge", "Open matches.", [f"scorecounter_rooms {len(rooms.rooms)}"])
+        metric("scorecounter_queued_messages", "gauge", "Messages waiting in client queues.",
+               [f"scorecounter_queued_messages {sum(queued)}"])
+        metric("scorecounter_queued_bytes", "gauge", "Bytes waiting in client queues.",
+               [f"scorecounter_queued_bytes {sum(len(item[1]) for channel in channels for item in channel.queue)}"])
+        metric("scorecounter_max_queue_depth", "gauge", "Deepest client queue.",
+               [f"scorecounter_max_queue_depth {max(queued, default=0)}"])
+        metric("scorecounter_write_buffer_bytes", "gauge", "Bytes buffered in client sockets.",
+               [f"scorecounter_write_buffer_bytes {sum(write_buffer_size(channel.websocket) for channel in channels)}"])
+        metric("scorecounter_sends_in_flight", "gauge", "Socket writes in progress.",
+               [f"scorecounter_sends_in_flight {sum(hub.in_flight for hub in hubs)}"])
+        metric("scorecounter_latest_only_clients", "gauge", "Clients that are behind and only get the latest state.",
+               [f"scorecounter_latest_only_clients {sum(1 for channel in channels if channel.latest_only)}"])
+
+        metric("scorecounter_broadcasts_total", "counter", "Broadcasts sent.",
+               [f"scorecounter_broadcasts_total {self.broadcasts}"])
+        metric("scorecounter_dropped_messages_total", "counter", "Queued messages replaced by newer state.",
+               [f"scorecounter_dropped_messages_total {self.dropped_messages}"])
+        metric("scorecounter_evicted_clients_total", "counter", "Clients disconnected for being too slow.",
+               [f"scorecounter_evicted_clients_total {self.evicted_clients}"])
+        metric("scorecounter_dead_peers_total", "counter", "Connections dropped without a close, e.g. missed pings.",
+               [f"scorecounter_dead_peers_total {self.dead_peers}"])
+
+        resident = resident_memory()
+        if resident is not None:
+            metric("process_resident_memory_bytes", "gauge", "Resident memory size in bytes.",
+                   [f"process_resident_memory_bytes {resident}"])
+
+        if event_log is not None:
+            stats = event_log.stats()
+            metric("scorecounter_event_log_appended_total", "counter", "Records appended to the event log.",
+                   [f"scorecounter_event_log_appended_total {stats['appended']}"])
+            metric("scorecounter_event_log_pending", "gauge", "Records waiting to be written.",
+                   [f"scorecounter_event_log_pending {stats['pending']}"])
+        if static_server is not None:
+            metric("scorecounter_http_requests_total", "counter", "HTTP requests served.",
+                   [f"scorecounter_http_requests_total {static_server.requests}"])
+
+        lines.append("")
+        return "\n".join(lines)
+
+    def route(self, rooms, event_log=None, static_server=None, loop=None):
+        # /metrics handler for StaticServer.add_route(). State is read on
+        # loop (the WebSocket loop) when the HTTP server runs on another thread.
+        async def handle(request):
+            if loop is None or loop is asyncio.get_running_loop():
+                text = self.render(rooms, event_log, static_server)
+            else:
+                future = asyncio.run_coroutine_threadsafe(self._render_async(rooms, event_log, static_server), loop)
+                text = await asyncio.wrap_future(future)
+            return Response(200, text.encode("utf-8"), {"Cache-Control": "no-store"}, CONTENT_TYPE)
+        return handle
+
+    async def _render_async(self, rooms, event_log, static_server):
+        return self.render(rooms, event_log, static_server)
+
+
+def resident_memory():
+    # Resident set size in bytes, where the platform makes it cheap to read
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def write_buffer_size(websocket):
+    transport = getattr(websocket, "transport", None)
+    if transport is None:
+        return 0
+    try:
+        return transport.get_write_buffer_size()
+    except Exception:
+        return 0
+
+
+# Shared by the engine and the fan-out hubs
+registry = Metrics()
@@ -0,0 +1,88 @@
+# QR code window for the desktop app. Only imported when the GUI is shown,
+# so headless starts never load tkinter or the QR libraries.
+#
+# The QR code PNG is cached on disk keyed by the URL it encodes. Later
+# launches on the same network load the file with Tk directly, without
+# importing qrcode or PIL at all.
+
+import hashlib
+import os
+import tkinter as tk
+
+
+def qr_code_path(url, cache_dir):
+    # Cached PNG for url, generated on first use
+    path = os.path.join(cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".png")
+    if os.path.exists(path):
+        return path
+
+    import qrcode
+
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(url)
+    qr.make(fit=True)
+    qr_img = qr.make_image(fill_color="black", back_color="white")
+
+    # Write next to the final name first so a crash never leaves half a PNG
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = path + ".tmp"
+    qr_img.save(temp_path, format="PNG")
+    os.replace(temp_path, path)
+    return path
+
+
+class QRCodeWindow:
+    def __init__(self, url, server_info_text, cache_dir):
+        self.root = tk.Tk()
+        self.root.title("Score Counter - Mobile Controls")
+
+        # Window dimensions and positioning
+        window_width = 400
+        window_height = 500
+        screen_width = self.root.winfo_screenwidth()
+        screen_height = self.root.winfo_screenheight()
+        x_position = screen_width - window_width - 20
+        y_position = 20
+        self.root.geometry(f"{window_width}x{window_height}+{x_position}+{y_position}")
+
+        # Create and pack main frame
+        main_frame = tk.Frame(self.root, padx=20, pady=20)
+        main_frame.pack(fill=tk.BOTH, expand=True)
+
+        # Title
+        title = tk.Label(main_frame, text="Score Counter", font=("Arial", 18, "bold"))
+        title.pack(pady=(0, 20))
+
+        # Instructions
+        instructions = tk.Label(main_frame,
+                                text="Scan this QR code with your mobile device\nto control the score counter",
+                                font=("Arial", 12),
+                                justify=tk.CENTER)
+        instructions.pack(pady=(0, 15))
+
+        # Load the QR code (Tk reads PNG files natively)
+        img = tk.PhotoImage(file=qr_code_path(url, cache_dir))
+
+        # Display QR code
+        qr_label = tk.Label(main_frame, image=img)
+        qr_label.image = img  # Keep a reference to prevent garbage collection
+        qr_label.pack(pady=10)
+
+        # URL text display
+        url_label = tk.Label(main_frame, text=url, font=("Arial", 10), fg="blue")
+        url_label.pack(pady=5)
+
+        # Add server info
+        server_info = tk.Label(main_frame,
+                               text=server_info_text,
+                               font=("Arial", 10),
+                               justify=tk.CENTER)
+        server_info.pack(pady=(20, 0))
+
+    def run(self):
+        self.root.mainloop()
@@ -0,0 +1,109 @@
+# Per-connection rate limits for incoming messages.
+#
+# Every client gets a token bucket per message type: "rate" tokens per
+# second, up to "burst" saved up. A frame that finds its bucket empty is
+# either dropped (mutations, so a stuck button can't run up the score) or
+# merged (requests that only ask for current state: the last one is kept
+# and answered once a token is available). Either way the client is told
+# with {"type": "throttled", "messageType": ..., "retryAfter": ms,
+# "action": "dropped" | "merged"}, at most once per NOTICE_INTERVAL per type.
+
+import time
+
+ACTION_DROP = "dropped"
+ACTION_MERGE = "merged"
+
+# message type -> (tokens per second, burst, action)
+DEFAULT_LIMITS = {
+    "increment": (20, 40, ACTION_DROP),
+    "subtract-counter": (20, 40, ACTION_DROP),
+    "reset-counters": (2, 4, ACTION_DROP),
+    "timer-start": (5, 10, ACTION_DROP),
+    "timer-pause": (5, 10, ACTION_DROP),
+    "timer-reset": (5, 10, ACTION_DROP),
+    "batch": (2, 4, ACTION_DROP),
+    "round-end": (2, 5, ACTION_DROP),
+    "match-end": (2, 5, ACTION_DROP),
+    "counters-sync-request": (2, 5, ACTION_MERGE),
+    "timer-sync-request": (2, 5, ACTION_MERGE),
+    "timer-clock": (4, 10, ACTION_DROP),
+    "hello": (2, 5, ACTION_MERGE),
+    "subscribe": (2, 5, ACTION_MERGE),
+    "ping": (2, 10, ACTION_DROP),
+    "stats": (1, 5, ACTION_MERGE),
+    "profile": (1, 3, ACTION_DROP),
+}
+
+# Limit for message types not listed above
+FALLBACK_LIMIT = (10, 20, ACTION_DROP)
+
+# A relay without the shared token carries many clients' messages on one
+# connection, so it gets this many times a client's limits
+RELAY_LIMIT_FACTOR = 10
+
+# Seconds between "throttled" notices for the same message type
+NOTICE_INTERVAL = 1.0
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self):
+        # Seconds until the next token
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+def scaled_limits(limits, factor):
+    return {message_type: (rate * factor, burst * factor, action)
+            for message_type, (rate, burst, action) in limits.items()}
+
+
+class ClientLimiter:
+    def __init__(self, limits=None, clock=time.monotonic):
+        self.limits = DEFAULT_LIMITS if limits is None else limits
+        # Seconds source; capture replay passes the recorded timestamps
+        self.clock = clock
+        self.buckets = {}
+        self.last_notice = {}
+        self.throttled = 0
+
+    def allow(self, message_type):
+        bucket = self.buckets.get(message_type)
+        if bucket is None:
+            rate, burst, _ = self.limits.get(message_type, FALLBACK_LIMIT)
+            bucket = self.buckets[message_type] = TokenBucket(rate, burst, self.clock())
+        if bucket.take(self.clock()):
+            return True
+        self.throttled += 1
+        return False
+
+    def action(self, message_type):
+        return self.limits.get(message_type, FALLBACK_LIMIT)[2]
+
+    def wait_time(self, message_type):
+        return self.buckets[message_type].wait_time()
+
+    def notice(self, message_type, action):
+        # The throttled notice, or None if one went out recently
+        now = self.clock()
+        if now - self.last_notice.get(message_type, -NOTICE_INTERVAL) < NOTICE_INTERVAL:
+            return None
+        self.last_notice[message_type] = now
+        return {
+            "type": "throttled",
+            "messageType": message_type,
+            "retryAfter": round(self.wait_time(message_type) * 1000),
+            "action": action,
+        }
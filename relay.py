@@ -0,0 +1,231 @@
+# Relay mode: this server mirrors matches from an upstream ScoreCounter
+# instead of owning them, so screens on another network segment can hang
+# off a nearby machine rather than the scoring laptop's Wi-Fi.
+#
+# For every local room the relay keeps one WebSocket to the upstream,
+# connected as ?role=relay with the room's match ID. Relay connections get
+# every counter delta (no spectator throttling). With the upstream's admin
+# token (--admin-token, sent as ?token=) they skip per-client rate limits,
+# which are enforced where the clients connect; without it they get
+# rate_limit.RELAY_LIMIT_FACTOR times a client's limits. State coming down is
+# applied to the local room and fanned out to local clients as usual;
+# mutations from local controllers are forwarded upstream unchanged and
+# come back down like everyone else's.
+#
+# When the link drops the relay reconnects with ?lastSeq= and is caught up
+# from the upstream's replay buffer, or gets a snapshot. Local clients keep
+# the last known state meanwhile; their mutations are refused with an error
+# until the link is back. A relay's clients may themselves be relays, so
+# relays can be chained.
+#
+# Running timers are sent as a wall-clock start time, so each link also
+# estimates how far the upstream's clock is from ours with timer-clock
+# samples, like the browsers do, and shifts timer states onto local time.
+
+import asyncio
+import time
+import urllib.parse
+
+import websockets
+
+import codec
+from rooms import ROLE_RELAY, TIMER_TYPES
+from server_log import get_logger
+
+# Seconds between reconnect attempts, doubling up to the maximum
+RECONNECT_DELAY = 0.5
+MAX_RECONNECT_DELAY = 10
+
+# Forwarded frames queued per link before new ones are refused
+MAX_OUTBOX = 256
+
+# Clock samples taken after connecting and then every CLOCK_RESYNC seconds
+CLOCK_SAMPLES = 5
+CLOCK_SAMPLE_INTERVAL = 0.25
+CLOCK_RESYNC = 300
+
+# Offset change (ms) worth re-applying a running timer for
+CLOCK_TOLERANCE = 25
+
+# Message types applied locally even in relay mode (they only read state)
+LOCAL_TYPES = {"counters-sync-request", "timer-sync-request", "timer-clock", "hello", "subscribe", "ping", "stats",
+               "profile"}
+
+log = get_logger("relay")
+
+
+def upstream_url(base, match_id, last_seq=None, token=None):
+    # ws:// URL for one match on the upstream; http:// is accepted too
+    parts = urllib.parse.urlsplit(base)
+    scheme = {"http": "ws", "https": "wss"}.get(parts.scheme, parts.scheme)
+    query = urllib.parse.parse_qsl(parts.query)
+    query.extend([("match", match_id), ("role", ROLE_RELAY)])
+    if token:
+        query.append(("token", token))
+    if last_seq is not None:
+        query.append(("lastSeq", str(last_seq)))
+    return urllib.parse.urlunsplit((scheme, parts.netloc, parts.path or "/", urllib.parse.urlencode(query), ""))
+
+
+class UpstreamLink:
+    def __init__(self, relay, room):
+        self.relay = relay
+        self.room = room
+        self.websocket = None
+        self.outbox = asyncio.Queue(MAX_OUTBOX)
+        # Whether the local room holds upstream state we can resume from
+        self.synced = False
+        self.connects = 0
+        # Upstream clock minus ours in ms, from the lowest-RTT sample of the last round
+        self.clock_offset = 0
+        self.rtt = None
+        self.clock_samples = []
+        # Last timer state from the upstream, as sent
+        self.timer_message = None
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    @property
+    def connected(self):
+        return self.websocket is not None
+
+    async def run(self):
+        delay = RECONNECT_DELAY
+        while True:
+            last_seq = self.room.counters.seq if self.synced else None
+            url = upstream_url(self.relay.url, self.room.match_id, last_seq, self.relay.token)
+            try:
+                async with websockets.connect(url) as websocket:
+                    self.websocket = websocket
+                    self.connects += 1
+                    delay = RECONNECT_DELAY
+                    log.info("Relaying match %s from %s", self.room.match_id, self.relay.url,
+                             extra={"event": "relay"})
+                    sender = asyncio.create_task(self.send_forwarded(websocket))
+                    clock = asyncio.create_task(self.sync_clock(websocket))
+                    try:
+                        async for frame in websocket:
+                            self.receive(websocket, frame)
+                    finally:
+                        sender.cancel()
+                        clock.cancel()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("Upstream link for match %s failed: %s", self.room.match_id, e,
+                            extra={"event": "relay"})
+            finally:
+                self.websocket = None
+
+            # Frames forwarded while the link was down would be stale by now
+            while not self.outbox.empty():
+                self.outbox.get_nowait()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    async def send_forwarded(self, websocket):
+        while True:
+            frame = await self.outbox.get()
+            await websocket.send(frame)
+
+    async def sync_clock(self, websocket):
+        while True:
+            self.clock_samples = []
+            for _ in range(CLOCK_SAMPLES):
+                await websocket.send(codec.dumps({"type": "timer-clock", "clientTime": time.time() * 1000}))
+                await asyncio.sleep(CLOCK_SAMPLE_INTERVAL)
+            await asyncio.sleep(CLOCK_RESYNC)
+
+    def clock_sample(self, message):
+        now = time.time() * 1000
+        client_time = message.get("clientTime")
+        server_time = message.get("serverTime")
+        if not isinstance(client_time, (int, float)) or not isinstance(server_time, (int, float)):
+            return
+        rtt = now - client_time
+        if rtt < 0:
+            return
+        self.clock_samples.append((rtt, server_time - (client_time + now) / 2))
+        rtt, offset = min(self.clock_samples)
+        self.rtt = rtt
+        previous, self.clock_offset = self.clock_offset, offset
+        # Move a running timer if our idea of the upstream clock changed
+        if abs(offset - previous) > CLOCK_TOLERANCE and self.timer_message is not None and self.room.timer.running:
+            self.room.apply_upstream(self.timer_message, self.clock_offset)
+
+    def receive(self, websocket, frame):
+        try:
+            message = codec.loads(frame)
+        except ValueError:
+            return
+        if not isinstance(message, dict):
+            return
+
+        message_type = message.get("type")
+        if message_type == "error":
+            log.warning("Upstream refused a forwarded message for match %s: %s", self.room.match_id,
+                        message.get("reason"), extra={"event": "relay"})
+            return
+        if message_type == "timer-clock":
+            self.clock_sample(message)
+            return
+        if message_type in TIMER_TYPES:
+            self.timer_message = message
+        if not self.room.apply_upstream(message, self.clock_offset):
+            # A delta that doesn't follow our seq: ask for a snapshot
+            asyncio.create_task(websocket.send(codec.dumps({"type": "counters-sync-request"})))
+            return
+        if message_type == "counters":
+            self.synced = True
+
+    def forward(self, frame):
+        if self.websocket is None:
+            return False
+        try:
+            self.outbox.put_nowait(frame)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    def close(self):
+        self.task.cancel()
+
+
+class Relay:
+    def __init__(self, url, token=None):
+        self.url = url
+        # Upstream's admin token, so its rate limits trust this relay
+        self.token = token
+        self.links = {}
+        self.forwarded = 0
+        self.refused = 0
+
+    def forwards(self, message_type):
+        return message_type not in LOCAL_TYPES
+
+    def open(self, room):
+        if room.match_id not in self.links:
+            self.links[room.match_id] = UpstreamLink(self, room)
+
+    def close(self, room):
+        link = self.links.pop(room.match_id, None)
+        if link is not None:
+            link.close()
+
+    def forward(self, room, frame):
+        # Pass a local client's frame upstream; False if the link is down
+        link = self.links.get(room.match_id)
+        if link is None or not link.forward(frame):
+            self.refused += 1
+            return False
+        self.forwarded += 1
+        return True
+
+    def stats(self):
+        return {
+            "upstream": self.url,
+            "links": len(self.links),
+            "connected": sum(1 for link in self.links.values() if link.connected),
+            "clockOffsets": {match_id: round(link.clock_offset, 1) for match_id, link in self.links.items()},
+            "forwarded": self.forwarded,
+            "refused": self.refused,
+        }
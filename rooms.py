@@ -0,0 +1,553 @@
+# Matches ("rooms") keyed by match ID. Each room owns its own counters,
+# timer and subscriber set, so a click on one court only reaches that
+# court's clients.
+#
+# Clients pick a room with ?match=<id> on the WebSocket URL, or switch with
+# {"type": "subscribe", "matchId": "<id>"} (also accepted in "hello").
+# Clients that never choose one land in the default room.
+#
+# With a coalescing window set, counter mutations still apply immediately
+# but their broadcast goes out at most once per window, carrying the net
+# change as a single delta with "since" set to the seq it applies on top of.
+# Timer events and messages sent with "flush": true are never delayed.
+#
+# When an event log is attached, every accepted mutation is journaled and
+# the registry is restored from it at startup.
+#
+# Full counter and timer snapshots are kept pre-encoded, keyed by the state
+# version, so connects, sync requests and legacy broadcasts reuse the same
+# bytes until the next mutation.
+#
+# Each room also keeps its last REPLAY_BUFFER_SIZE counter deltas. A client
+# reconnecting with ?lastSeq=<n> (or "lastSeq" in hello) gets the deltas it
+# missed merged into one, plus the timer, instead of a full snapshot. Only
+# a gap older than the buffer falls back to the snapshot.
+#
+# Clients connect as controllers unless they ask for ?role=spectator (or
+# "role" in hello). Spectators are read-only and live in a separate fan-out
+# hub: instead of every delta they get the latest counters and timer at most
+# every SPECTATOR_INTERVAL, so a wall of displays costs a few encodes per
+# second and never sits between a click and the scorers' screens.
+#
+# A "batch" message applies several mutations at once; its counter deltas
+# go out merged into one (with "since") and the timer at most once, so
+# displays never see the steps in between.
+#
+# A server started as a relay (see relay.py) doesn't own its rooms' state:
+# it is pushed from upstream through apply_upstream() and fanned out from
+# there. Relays connect upstream as ?role=relay and get every delta.
+
+import asyncio
+import collections
+import json
+import urllib.parse
+
+from fanout import FanoutHub, encode_message
+from match_state import CounterState, TimerState, PROTOCOL_DELTA, PROTOCOL_FULL
+from metrics import registry as metrics
+from server_log import get_logger
+
+DEFAULT_MATCH_ID = "default"
+MAX_MATCH_ID_LENGTH = 64
+
+# Seconds an empty room keeps its state before it is torn down, so a
+# Wi-Fi drop that disconnects every client does not lose the match
+ROOM_IDLE_TIMEOUT = 15 * 60
+
+# Seconds to coalesce counter broadcasts for (0 sends every update at once)
+COALESCE_WINDOW = 0
+
+# Counter deltas kept per room for reconnecting clients
+REPLAY_BUFFER_SIZE = 256
+
+ROLE_CONTROLLER = "controller"
+ROLE_SPECTATOR = "spectator"
+ROLE_RELAY = "relay"
+ROLES = (ROLE_CONTROLLER, ROLE_SPECTATOR, ROLE_RELAY)
+
+# Message types carrying the timer state
+TIMER_TYPES = ("timer-start", "timer-pause", "timer-reset", "timer-sync", "timer-ended")
+
+# Seconds between state updates to spectators (10 Hz)
+SPECTATOR_INTERVAL = 0.1
+
+log = get_logger("rooms")
+
+
+def merge_deltas(deltas, since):
+    # Counter deltas applied on top of seq since, as one delta
+    merged = {"type": "counters-delta", "seq": since, "since": since, "changes": {}}
+    for delta in deltas:
+        # A reset wipes out everything merged before it
+        if delta.get("reset"):
+            merged["changes"] = {}
+            merged["reset"] = True
+        merged["changes"].update(delta["changes"])
+        merged["seq"] = delta["seq"]
+    return merged
+
+
+def first_since(delta):
+    # Seq a delta applies on top of; batches and coalesced deltas span several
+    return delta.get("since", delta["seq"] - 1)
+
+
+def normalize_match_id(match_id):
+    if match_id is None:
+        return DEFAULT_MATCH_ID
+    match_id = str(match_id).strip()[:MAX_MATCH_ID_LENGTH]
+    return match_id or DEFAULT_MATCH_ID
+
+
+def request_query(websocket):
+    # websockets >= 13 exposes the handshake request, older versions the path
+    request = getattr(websocket, "request", None)
+    path = request.path if request is not None else getattr(websocket, "path", "") or ""
+    return urllib.parse.parse_qs(urllib.parse.urlsplit(path).query)
+
+
+def match_id_from_request(websocket):
+    return normalize_match_id(request_query(websocket).get("match", [None])[0])
+
+
+def role_from_request(websocket):
+    role = request_query(websocket).get("role", [ROLE_CONTROLLER])[0]
+    return role if role in ROLES else ROLE_CONTROLLER
+
+
+def last_seq_from_request(websocket):
+    # The counter seq a reconnecting client last saw, or None
+    try:
+        return int(request_query(websocket)["lastSeq"][0])
+    except (KeyError, ValueError):
+        return None
+
+
+class Room:
+    def __init__(self, match_id, coalesce_window=COALESCE_WINDOW):
+        self.match_id = match_id
+        self.counters = CounterState()
+        self.timer = TimerState()
+        # Fires when the running timer reaches zero
+        self.expiry_handle = None
+        self.clients = FanoutHub()
+        self.reap_handle = None
+        self.coalesce_window = coalesce_window
+        self.pending_delta = None
+        self.flush_handle = None
+        self.last_flush = None
+        self.journal = None
+        self.encoded_counters_cache = None
+        self.encoded_timer_cache = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # Recent counter deltas, oldest first, and the last catch-up sent
+        self.history = collections.deque(maxlen=REPLAY_BUFFER_SIZE)
+        self.catch_up_cache = None
+        # Read-only tier, updated at most every SPECTATOR_INTERVAL
+        self.spectators = FanoutHub()
+        self.spectator_handle = None
+        self.last_spectator_flush = None
+        self.spectator_sent = (self.counters.seq, self.timer.version)
+
+    def __contains__(self, websocket):
+        return websocket in self.clients or websocket in self.spectators
+
+    def hub(self, websocket):
+        return self.spectators if websocket in self.spectators else self.clients
+
+    def is_empty(self):
+        return not self.clients and not self.spectators
+
+    def broadcast(self, message, key=None, protocol=None):
+        return self.clients.broadcast(message, key, protocol)
+
+    def broadcast_counters(self, delta, flush=False):
+        self._journal("counters", delta)
+        self.history.append(delta)
+        self._schedule_spectators()
+
+        if self.coalesce_window <= 0:
+            self._send_counters(delta)
+            return
+
+        self._merge_pending(delta)
+        if self.flush_handle is not None and not flush:
+            return
+
+        # Send right away unless we already flushed within this window
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if flush or self.last_flush is None or now - self.last_flush >= self.coalesce_window:
+            self.flush_counters()
+        else:
+            self.flush_handle = loop.call_at(self.last_flush + self.coalesce_window, self.flush_counters)
+
+    def broadcast_batch(self, deltas, timer_changed):
+        # One counter update for the whole batch, then the timer once
+        if deltas:
+            self.broadcast_counters(merge_deltas(deltas, first_since(deltas[0])), flush=True)
+        if timer_changed:
+            self.broadcast_timer()
+
+    def _merge_pending(self, delta):
+        pending = self.pending_delta
+        if pending is None:
+            pending = {
+                "type": "counters-delta",
+                "seq": delta["seq"],
+                "since": delta.get("since", delta["seq"] - 1),
+                "changes": {}
+            }
+            self.pending_delta = pending
+
+        # A reset wipes out everything merged before it
+        if delta.get("reset"):
+            pending["changes"] = {}
+            pending["reset"] = True
+        pending["changes"].update(delta["changes"])
+        pending["seq"] = delta["seq"]
+
+    def flush_counters(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.pending_delta is None:
+            return
+
+        delta, self.pending_delta = self.pending_delta, None
+        self.last_flush = asyncio.get_running_loop().time()
+        self._send_counters(delta)
+
+    def _send_counters(self, delta):
+        # Delta clients get only what changed, legacy clients the full dict
+        log.debug("Sending counter update seq %s to %d clients in match %s", delta["seq"], len(self.clients),
+                  self.match_id, extra={"event": "broadcast"})
+        self.clients.broadcast(delta, protocol=PROTOCOL_DELTA)
+        if self.clients.has_protocol(PROTOCOL_FULL):
+            self.clients.broadcast(self.encoded_counters(), key="counters", protocol=PROTOCOL_FULL)
+
+    def broadcast_timer(self, schedule=True):
+        self._journal("timer", {"state": self.timer.state})
+        self._schedule_spectators()
+        if schedule:
+            self.schedule_expiry()
+
+        # Timer events are never delayed; pending counters go first to keep order
+        self.flush_counters()
+        log.debug("Broadcasting %s message to %d clients in match %s", self.timer.state["type"], len(self.clients),
+                  self.match_id, extra={"event": "broadcast"})
+        self.clients.broadcast(self.encoded_timer(), key="timer")
+
+    def schedule_expiry(self):
+        # End the timer on the server when it runs out, not when a client notices
+        if self.expiry_handle is not None:
+            self.expiry_handle.cancel()
+            self.expiry_handle = None
+        expires_in = self.timer.expires_in()
+        if expires_in is not None:
+            self.expiry_handle = asyncio.get_running_loop().call_later(expires_in, self._expire)
+
+    def _expire(self):
+        self.expiry_handle = None
+        if not self.timer.running:
+            return
+        if self.timer.remaining_ms() > 1:
+            # Woken a little early
+            self.schedule_expiry()
+            return
+        self.timer.expire()
+        log.info("Timer ended in match %s", self.match_id, extra={"event": "timer"})
+        self.broadcast_timer()
+
+    def apply_upstream(self, message, clock_offset=0):
+        # State from the upstream server in relay mode. False if a delta
+        # doesn't follow the local seq and a snapshot is needed. Running
+        # timers are moved from the upstream's clock to ours by clock_offset
+        # (upstream minus local, ms); the upstream decides when time is up.
+        message_type = message.get("type")
+        if message_type == "counters":
+            self.flush_counters()
+            self.encoded_counters_cache = None
+            self.catch_up_cache = None
+            self.counters.values.clear()
+            self.counters.values.update(message.get("values", {}))
+            self.counters.seq = message.get("seq", 0)
+            self.history.clear()
+            self._schedule_spectators()
+            self.clients.broadcast(self.encoded_counters(), key="counters")
+        elif message_type == "counters-delta":
+            if first_since(message) != self.counters.seq:
+                return False
+            self.counters.apply(message)
+            self.broadcast_counters(message)
+        elif message_type in TIMER_TYPES:
+            if message.get("isRunning") and message.get("startTime"):
+                message = dict(message, startTime=message["startTime"] - clock_offset)
+            self.timer.state = message
+            if self.expiry_handle is not None:
+                self.expiry_handle.cancel()
+                self.expiry_handle = None
+            self.broadcast_timer(schedule=False)
+        return True
+
+    def _schedule_spectators(self):
+        if not self.spectators or self.spectator_handle is not None:
+            return
+
+        # The first change after a quiet spell goes out at once, the rest wait for the interval
+        loop = asyncio.get_running_loop()
+        if self.last_spectator_flush is None:
+            delay = 0
+        else:
+            delay = max(0, self.last_spectator_flush + SPECTATOR_INTERVAL - loop.time())
+        self.spectator_handle = loop.call_later(delay, self.flush_spectators)
+
+    def flush_spectators(self):
+        self.spectator_handle = None
+        self.last_spectator_flush = asyncio.get_running_loop().time()
+
+        # Only the latest state; whatever changed in between is skipped
+        sent_seq, sent_timer = self.spectator_sent
+        if sent_seq != self.counters.seq:
+            self.spectators.broadcast(self.encoded_counters(), key="counters")
+        if sent_timer != self.timer.version:
+            self.spectators.broadcast(self.encoded_timer(), key="timer")
+        self.spectator_sent = (self.counters.seq, self.timer.version)
+
+    def encoded_counters(self):
+        cache = self.encoded_counters_cache
+        if cache is not None and cache[0] == self.counters.seq:
+            self.cache_hits += 1
+            return cache[1]
+        self.cache_misses += 1
+        encoded = encode_message(self.counters.snapshot())
+        self.encoded_counters_cache = (self.counters.seq, encoded)
+        return encoded
+
+    def encoded_timer(self):
+        cache = self.encoded_timer_cache
+        if cache is not None and cache[0] == self.timer.version:
+            self.cache_hits += 1
+            return cache[1]
+        self.cache_misses += 1
+        encoded = encode_message(self.timer.state)
+        self.encoded_timer_cache = (self.timer.version, encoded)
+        return encoded
+
+    def cache_stats(self):
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "hitRate": round(self.cache_hits / lookups, 3) if lookups else 0,
+        }
+
+    def _journal(self, op, fields):
+        if self.journal is None:
+            return
+        record = {"m": self.match_id, "op": op}
+        record.update(fields)
+        record.pop("type", None)
+        self.journal.append(record)
+
+    def snapshot(self):
+        return {
+            "counters": dict(self.counters.values),
+            "seq": self.counters.seq,
+            "timer": dict(self.timer.state),
+        }
+
+    def restore(self, state):
+        self.encoded_counters_cache = None
+        self.counters.values.clear()
+        self.counters.values.update(state.get("counters", {}))
+        self.counters.seq = state.get("seq", 0)
+        self.timer.state = dict(state.get("timer", self.timer.state))
+        self.history.clear()
+
+    def apply_record(self, record):
+        if record["op"] == "counters":
+            self.encoded_counters_cache = None
+            self.counters.apply(record)
+            self.history.append({"seq": record["seq"], "since": first_since(record),
+                                 "changes": record.get("changes", {}), "reset": record.get("reset", False)})
+        elif record["op"] == "timer":
+            self.timer.state = record["state"]
+
+    def encoded_catch_up(self, last_seq):
+        # Deltas after last_seq merged into one; "" if nothing was missed,
+        # None if they are no longer all in the buffer
+        seq = self.counters.seq
+        if last_seq == seq:
+            return ""
+        history = self.history
+        if last_seq > seq or not history or first_since(history[0]) > last_seq or history[-1]["seq"] != seq:
+            return None
+
+        # Every client back from the same drop asks for the same catch-up
+        cache = self.catch_up_cache
+        if cache is not None and cache[0] == last_seq and cache[1] == seq:
+            return cache[2]
+
+        catch_up = merge_deltas((delta for delta in history if delta["seq"] > last_seq), last_seq)
+        encoded = encode_message(catch_up)
+        self.catch_up_cache = (last_seq, seq, encoded)
+        return encoded
+
+    def send_resume(self, websocket, last_seq):
+        catch_up = self.encoded_catch_up(last_seq)
+        if catch_up is None:
+            outcome = "snapshot"
+            self.send_counters(websocket)
+        elif catch_up:
+            outcome = "replay"
+            self.hub(websocket).send(websocket, catch_up, key="counters")
+        else:
+            outcome = "current"
+        metrics.resumes[outcome] = metrics.resumes.get(outcome, 0) + 1
+        self.send_timer(websocket)
+
+    def send_snapshot(self, websocket):
+        self.send_counters(websocket)
+        self.send_timer(websocket)
+
+    def send_counters(self, websocket):
+        self.hub(websocket).send(websocket, self.encoded_counters(), key="counters")
+
+    def send_timer(self, websocket):
+        self.hub(websocket).send(websocket, self.encoded_timer(), key="timer")
+
+    def set_role(self, websocket, role):
+        # Move a client between the controller and spectator hubs
+        current = self.hub(websocket)
+        target = self.spectators if role == ROLE_SPECTATOR else self.clients
+        if current is target:
+            return False
+        channel = current.channels.get(websocket)
+        protocol = channel.protocol if channel is not None else PROTOCOL_FULL
+        current.remove(websocket)
+        target.add(websocket, protocol)
+        return True
+
+
+class RoomRegistry:
+    def __init__(self, idle_timeout=ROOM_IDLE_TIMEOUT, coalesce_window=COALESCE_WINDOW):
+        self.idle_timeout = idle_timeout
+        self.coalesce_window = coalesce_window
+        self.rooms = {}
+        self.journal = None
+        # Relay this registry mirrors its rooms from, if any (relay.Relay)
+        self.upstream = None
+        # Last state of each room that made it into a journal snapshot
+        self.journaled_states = {}
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def get(self, match_id):
+        match_id = normalize_match_id(match_id)
+        room = self.rooms.get(match_id)
+        if room is None:
+            room = Room(match_id, self.coalesce_window)
+            room.journal = self.journal
+            self.rooms[match_id] = room
+            if self.upstream is not None:
+                self.upstream.open(room)
+        return room
+
+    def join(self, websocket, match_id, protocol=PROTOCOL_FULL, role=ROLE_CONTROLLER):
+        room = self.get(match_id)
+
+        # Someone is back, keep the room
+        if room.reap_handle is not None:
+            room.reap_handle.cancel()
+            room.reap_handle = None
+
+        # A timer restored from the event log runs without an expiry until now
+        if room.timer.running and room.expiry_handle is None and self.upstream is None:
+            room.schedule_expiry()
+
+        if role == ROLE_SPECTATOR:
+            room.spectators.add(websocket, protocol)
+        else:
+            room.clients.add(websocket, protocol)
+        return room
+
+    def leave(self, websocket, room):
+        room.clients.remove(websocket)
+        room.spectators.remove(websocket)
+        if room.is_empty() and room.match_id != DEFAULT_MATCH_ID:
+            room.reap_handle = asyncio.get_running_loop().call_later(
+                self.idle_timeout, self._reap, room
+            )
+
+    def move(self, websocket, room, match_id):
+        # Switch a client to another room, keeping its protocol and role
+        match_id = normalize_match_id(match_id)
+        if match_id == room.match_id:
+            return room
+        hub = room.hub(websocket)
+        channel = hub.channels.get(websocket)
+        protocol = channel.protocol if channel is not None else PROTOCOL_FULL
+        role = ROLE_SPECTATOR if hub is room.spectators else ROLE_CONTROLLER
+        self.leave(websocket, room)
+        return self.join(websocket, match_id, protocol, role)
+
+    def _reap(self, room):
+        room.reap_handle = None
+        if room.is_empty() and self.rooms.get(room.match_id) is room:
+            del self.rooms[room.match_id]
+            if room.expiry_handle is not None:
+                room.expiry_handle.cancel()
+            if self.upstream is not None:
+                self.upstream.close(room)
+            if self.journal is not None:
+                self.journal.append({"m": room.match_id, "op": "close"})
+
+    def attach_journal(self, journal):
+        # Restore matches from the snapshot plus the log tail, then journal from here on
+        snapshot, records = journal.load()
+        for match_id, state in (snapshot or {}).items():
+            self.get(match_id).restore(state)
+        for record in records:
+            if record["op"] == "close":
+                self.rooms.pop(record["m"], None)
+            else:
+                self.get(record["m"]).apply_record(record)
+
+        self.journal = journal
+        for room in self.rooms.values():
+            room.journal = journal
+        journal.snapshot_provider = self.journal_snapshot
+        journal.start()
+        return len(records)
+
+    def snapshot(self):
+        return {match_id: room.snapshot() for match_id, room in self.rooms.items()}
+
+    def journal_snapshot(self):
+        # Like snapshot(), but a room whose state can't be built or serialized
+        # keeps its last good state instead of failing every room's snapshot
+        states = {}
+        for match_id, room in self.rooms.items():
+            try:
+                state = room.snapshot()
+                json.dumps(state)
+            except Exception as e:
+                log.error("Can't snapshot match %s, keeping its last saved state: %s", match_id, e,
+                          extra={"event": "journal"})
+                state = self.journaled_states.get(match_id)
+                if state is None:
+                    continue
+            states[match_id] = state
+        self.journaled_states = states
+        return states
+
+    def stats(self):
+        return {
+            "rooms": len(self.rooms),
+            "clients": sum(len(room.clients) for room in self.rooms.values()),
+            "spectators": sum(len(room.spectators) for room in self.rooms.values()),
+            "relay": self.upstream.stats() if self.upstream is not None else None,
+        }
@@ -0,0 +1,128 @@
+# Logging for the servers without blocking the event loop.
+#
+# Records are put on a queue by a QueueHandler and written by a background
+# QueueListener thread, so a slow console (the Windows console in the exe
+# especially) never stalls fan-out. Loggers live under "scorecounter".
+#
+# Hot-path calls tag their records with an event type:
+#   log.debug("Received %s", frame, extra={"event": "message"})
+# Per event type, records can be sampled (keep 1 in N) and rate limited
+# (token bucket, records per second). Rate-limited drops are counted and
+# reported once the event is allowed through again. Untagged records are
+# only filtered by level.
+
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+LOGGER_NAME = "scorecounter"
+
+DEFAULT_LEVEL = "INFO"
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(message)s"
+CONSOLE_FORMAT = "%(message)s"
+
+# Keep 1 in N records of these event types
+DEFAULT_SAMPLE_RATES = {
+    "message": 1,
+    "broadcast": 10,
+}
+
+# Records per second allowed for each event type (bursts up to one second's worth)
+DEFAULT_RATE_LIMIT = 50
+
+# Rotating file log: size per file and number of old files kept
+LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
+
+_listener = None
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = dict(rates)
+        self.seen = {}
+
+    def filter(self, record):
+        event = getattr(record, "event", None)
+        rate = self.rates.get(event, 1)
+        if rate <= 1:
+            return True
+        count = self.seen.get(event, 0)
+        self.seen[event] = count + 1
+        return count % rate == 0
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, per_second):
+        super().__init__()
+        self.per_second = per_second
+        # event -> [tokens, last refill time, suppressed count]
+        self.buckets = {}
+
+    def filter(self, record):
+        event = getattr(record, "event", None)
+        if event is None or not self.per_second:
+            return True
+
+        now = time.monotonic()
+        bucket = self.buckets.get(event)
+        if bucket is None:
+            bucket = self.buckets[event] = [self.per_second, now, 0]
+        else:
+            bucket[0] = min(self.per_second, bucket[0] + (now - bucket[1]) * self.per_second)
+            bucket[1] = now
+
+        if bucket[0] < 1:
+            bucket[2] += 1
+            return False
+        bucket[0] -= 1
+
+        # Tell the reader how much was skipped since the last record got through
+        if bucket[2]:
+            record.msg = f"{record.msg} [{bucket[2]} more '{event}' records suppressed]"
+            bucket[2] = 0
+        return True
+
+
+def setup_logging(level=DEFAULT_LEVEL, log_file=None, sample_rates=None, rate_limit=DEFAULT_RATE_LIMIT):
+    global _listener
+    stop_logging()
+
+    # The writer side: console, plus a rotating file when asked for
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+    handlers = [console]
+    if log_file:
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS, encoding="utf-8")
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handlers.append(file_handler)
+
+    # The event loop side only filters and enqueues
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(SamplingFilter(DEFAULT_SAMPLE_RATES if sample_rates is None else sample_rates))
+    queue_handler.addFilter(RateLimitFilter(rate_limit))
+
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.handlers[:] = [queue_handler]
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return logger
+
+
+def stop_logging():
+    # Flush whatever is still queued
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name):
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
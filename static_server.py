@@ -0,0 +1,412 @@
+# Asyncio HTTP server for the HTML/JS/CSS assets.
+#
+# Assets are read into memory once, precompressed (gzip, plus brotli when
+# the module is installed) and served with an ETag and Cache-Control, so a
+# reload at halftime costs a 304 instead of a disk read. A file is only
+# re-read when its mtime changes. Extra endpoints can be mounted with
+# add_route().
+#
+# The server runs either on its own port (start()) or inside the WebSocket
+# listener through process_request(), which answers plain HTTP requests and
+# lets WebSocket upgrades through to the counter handler on a single port.
+#
+# A route may answer with a stream (an async iterator of bytes) instead of
+# a body. On its own port the stream is sent with chunked encoding as it is
+# produced; inside the WebSocket listener, which needs the whole body up
+# front, it is collected first.
+
+import asyncio
+import email.utils
+import gzip
+import hashlib
+import mimetypes
+import os
+import time
+import urllib.parse
+
+from websockets.datastructures import Headers
+from websockets.http11 import Response as WebSocketResponse
+
+from server_log import get_logger
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Files that may be served, and which of them are loaded at startup
+SERVED_EXTENSIONS = {".html", ".js", ".css", ".png", ".jpg", ".jpeg", ".gif", ".svg", ".ico", ".webp"}
+PRELOAD_EXTENSIONS = {".html", ".js", ".css", ".svg"}
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "image/svg+xml")
+
+# Pages are revalidated on every load, scripts and styles may be reused briefly
+CACHE_CONTROL_HTML = "no-cache"
+CACHE_CONTROL_ASSET = "public, max-age=60"
+
+# Seconds between mtime checks for a cached file
+RELOAD_CHECK_INTERVAL = 1.0
+
+DEFAULT_PAGE = "/display.html"
+
+# Paths where the single-port server accepts WebSocket upgrades
+WEBSOCKET_PATHS = {"/", "/ws"}
+
+MAX_REQUEST_HEAD = 16 * 1024
+KEEPALIVE_TIMEOUT = 15
+
+# websockets can't stream an HTTP response, so on the WebSocket port a
+# streamed route is buffered up to this size and refused beyond it
+MAX_BUFFERED_BODY = 4 * 1024 * 1024
+
+STATUS_TEXT = {
+    200: "OK",
+    204: "No Content",
+    302: "Found",
+    304: "Not Modified",
+    307: "Temporary Redirect",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+log = get_logger("http")
+
+
+class Request:
+    def __init__(self, method, target, version, headers):
+        self.method = method
+        self.version = version
+        self.headers = headers
+        parts = urllib.parse.urlsplit(target)
+        self.path = urllib.parse.unquote(parts.path)
+        self.query = urllib.parse.parse_qs(parts.query)
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+
+class Response:
+    def __init__(self, status=200, body=b"", headers=None, content_type=None, stream=None):
+        self.status = status
+        self.body = body
+        self.stream = stream
+        self.headers = dict(headers or {})
+        if content_type:
+            self.headers["Content-Type"] = content_type
+
+    def head(self, keep_alive):
+        headers = dict(self.headers)
+        if self.stream is not None:
+            headers["Transfer-Encoding"] = "chunked"
+        else:
+            headers["Content-Length"] = str(len(self.body))
+        headers["Connection"] = "keep-alive" if keep_alive else "close"
+        lines = [f"HTTP/1.1 {self.status} {STATUS_TEXT.get(self.status, 'Unknown')}"]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def parse_request(head):
+    try:
+        lines = head.decode("latin-1").split("\r\n")
+        method, target, version = lines[0].split(" ", 2)
+    except ValueError:
+        return None
+
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return Request(method, target, version, headers)
+
+
+def accepted_encodings(request):
+    accepted = set()
+    for item in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = item.strip().partition(";")
+        if params.replace(" ", "") != "q=0":
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+class Asset:
+    def __init__(self, path, stat):
+        self.path = path
+        self.mtime = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.checked = time.monotonic()
+
+        with open(path, "rb") as f:
+            self.body = f.read()
+
+        self.content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if self.content_type.startswith("text/") or self.content_type == "application/javascript":
+            self.content_type += "; charset=utf-8"
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest()[:20] + '"'
+        self.last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+
+        # Precompress once; keep a variant only if it actually saves bytes
+        self.variants = {}
+        if self.content_type.startswith(COMPRESSIBLE_TYPES):
+            if brotli is not None:
+                self._add_variant("br", brotli.compress(self.body, quality=11))
+            self._add_variant("gzip", gzip.compress(self.body, compresslevel=9, mtime=0))
+
+    def _add_variant(self, encoding, body):
+        if len(body) < len(self.body):
+            self.variants[encoding] = body
+
+    def changed(self, stat):
+        return stat.st_mtime_ns != self.mtime or stat.st_size != self.size
+
+    def response(self, request):
+        cache_control = CACHE_CONTROL_HTML if self.content_type.startswith("text/html") else CACHE_CONTROL_ASSET
+        headers = {
+            "Content-Type": self.content_type,
+            "Cache-Control": cache_control,
+            "ETag": self.etag,
+            "Last-Modified": self.last_modified,
+            "Vary": "Accept-Encoding",
+        }
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and (if_none_match.strip() == "*" or self.etag in if_none_match):
+            return Response(304, headers=headers)
+
+        body = self.body
+        accepted = accepted_encodings(request)
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and encoding in accepted:
+                body = self.variants[encoding]
+                headers["Content-Encoding"] = encoding
+                break
+        return Response(200, body, headers)
+
+
+class AssetCache:
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.assets = {}
+        self.hits = 0
+        self.reloads = 0
+
+    def preload(self):
+        for name in sorted(os.listdir(self.root)):
+            if os.path.splitext(name)[1].lower() in PRELOAD_EXTENSIONS:
+                self.get("/" + name)
+        return len(self.assets)
+
+    def resolve(self, url_path):
+        # Map a URL path to a servable file inside root, or None
+        relative = url_path.lstrip("/")
+        if not relative or any(part.startswith(".") for part in relative.split("/")):
+            return None
+        if os.path.splitext(relative)[1].lower() not in SERVED_EXTENSIONS:
+            return None
+        path = os.path.abspath(os.path.join(self.root, relative))
+        if os.path.commonpath([self.root, path]) != self.root:
+            return None
+        return path
+
+    def _lookup(self, url_path):
+        # (cached asset, None) when it is current, (None, (path, stat)) when
+        # it has to be loaded, (None, None) when there is no such file
+        asset = self.assets.get(url_path)
+        now = time.monotonic()
+        if asset is not None and now - asset.checked < RELOAD_CHECK_INTERVAL:
+            self.hits += 1
+            return asset, None
+
+        path = asset.path if asset is not None else self.resolve(url_path)
+        if path is None:
+            return None, None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.assets.pop(url_path, None)
+            return None, None
+
+        if asset is not None and not asset.changed(stat):
+            asset.checked = now
+            self.hits += 1
+            return asset, None
+
+        # New or modified on disk
+        if asset is not None:
+            self.reloads += 1
+        return None, (path, stat)
+
+    def get(self, url_path):
+        # Loads on the calling thread; for preload() before clients connect
+        asset, load = self._lookup(url_path)
+        if load is not None:
+            asset = self.assets[url_path] = Asset(*load)
+        return asset
+
+    async def fetch(self, url_path):
+        # Reading and compressing a changed file (brotli at quality 11) takes
+        # long enough to stall every client, so it runs in the executor
+        asset, load = self._lookup(url_path)
+        if load is not None:
+            asset = await asyncio.get_running_loop().run_in_executor(None, Asset, *load)
+            self.assets[url_path] = asset
+        return asset
+
+
+class StaticServer:
+    def __init__(self, root):
+        # With root None only the mounted routes are served
+        self.assets = AssetCache(root) if root is not None else None
+        self.routes = {}
+        self.requests = 0
+
+    def add_route(self, path, handler):
+        # handler(request) -> Response, may be a coroutine function
+        self.routes[path] = handler
+
+    async def respond(self, request):
+        if request.method not in ("GET", "HEAD"):
+            return Response(405, b"Method Not Allowed", {"Allow": "GET, HEAD"}, "text/plain")
+
+        handler = self.routes.get(request.path)
+        if handler is not None:
+            response = handler(request)
+            if asyncio.iscoroutine(response):
+                response = await response
+            return response
+
+        if self.assets is None:
+            return Response(404, b"Not Found", content_type="text/plain")
+
+        if request.path == "/":
+            return Response(302, headers={"Location": DEFAULT_PAGE})
+
+        asset = await self.assets.fetch(request.path)
+        if asset is None:
+            return Response(404, b"Not Found", content_type="text/plain")
+        return asset.response(request)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+                    break
+
+                request = parse_request(head)
+                if request is None:
+                    writer.write(Response(400, b"Bad Request", content_type="text/plain").head(False) + b"Bad Request")
+                    break
+
+                self.requests += 1
+                try:
+                    response = await self.respond(request)
+                except Exception as e:
+                    log.error("Error serving %s: %s", request.path, e, extra={"event": "http-error"})
+                    response = Response(500, b"Internal Server Error", content_type="text/plain")
+
+                keep_alive = request.keep_alive and response.status != 405
+                writer.write(response.head(keep_alive))
+                if response.stream is not None:
+                    if request.method == "HEAD":
+                        await response.stream.aclose()
+                    elif not await self.write_stream(writer, response.stream, request.path):
+                        break
+                elif request.method != "HEAD":
+                    writer.write(response.body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def write_stream(self, writer, stream, path):
+        # Chunked transfer encoding, waiting for the client between chunks.
+        # The status line is already out, so a failure can only cut the
+        # response short (no final chunk) and drop the connection.
+        try:
+            async for chunk in stream:
+                if chunk:
+                    writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                    await writer.drain()
+        except ConnectionError:
+            raise
+        except Exception as e:
+            log.error("Error streaming %s: %s", path, e, extra={"event": "http-error"})
+            return False
+        finally:
+            await stream.aclose()
+        writer.write(b"0\r\n\r\n")
+        return True
+
+    async def buffer_stream(self, response, path):
+        chunks = []
+        size = 0
+        try:
+            async for chunk in response.stream:
+                size += len(chunk)
+                if size > MAX_BUFFERED_BODY:
+                    log.warning("Not serving %s on the WebSocket port: over %d bytes", path, MAX_BUFFERED_BODY,
+                                extra={"event": "http-error"})
+                    return Response(503, b"Response too large for this port; narrow it with limit= or since=",
+                                    content_type="text/plain")
+                chunks.append(chunk)
+        finally:
+            await response.stream.aclose()
+        response.body = b"".join(chunks)
+        response.stream = None
+        return response
+
+    async def process_request(self, connection, request):
+        # websockets hook: let upgrades through, answer everything else as HTTP
+        path = urllib.parse.urlsplit(request.path).path
+        if path in WEBSOCKET_PATHS and request.headers.get("Upgrade", "").lower() == "websocket":
+            return None
+
+        headers = {name.lower(): value for name, value in request.headers.raw_items()}
+        http_request = Request("GET", request.path, "HTTP/1.1", headers)
+        self.requests += 1
+        try:
+            response = await self.respond(http_request)
+            if response.stream is not None:
+                response = await self.buffer_stream(response, http_request.path)
+        except Exception as e:
+            log.error("Error serving %s: %s", http_request.path, e, extra={"event": "http-error"})
+            response = Response(500, b"Internal Server Error", content_type="text/plain")
+
+        # websockets closes the connection after a non-upgrade response
+        response_headers = Headers(response.headers)
+        response_headers["Content-Length"] = str(len(response.body))
+        response_headers["Connection"] = "close"
+        reason = STATUS_TEXT.get(response.status, "Unknown")
+        return WebSocketResponse(response.status, reason, response_headers, response.body)
+
+    async def start(self, host, port):
+        if self.assets is None:
+            return await asyncio.start_server(self.handle_connection, host, port, limit=MAX_REQUEST_HEAD)
+        count = self.assets.preload()
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_REQUEST_HEAD)
+        encodings = "gzip, br" if brotli is not None else "gzip"
+        print(f"HTTP server started at http://localhost:{port} ({count} assets cached, {encodings})")
+        return server
+
+    def stats(self):
+        if self.assets is None:
+            return {"requests": self.requests}
+        return {
+            "requests": self.requests,
+            "assets": len(self.assets.assets),
+            "cacheHits": self.assets.hits,
+            "reloads": self.assets.reloads,
+        }
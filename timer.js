@@ -10,18 +10,77 @@ class TimerManager {
         this.onTimerUpdate = null;
         this.onTimerEnd = null;
         this.duration = 60; // Default 60 seconds
+        this.pendingOps = null; // Messages held back by collectOps()
+        this.clockOffset = 0; // Server clock minus ours, in ms
+        this.rtt = null; // Round trip of the best clock sample, in ms
+        this.clockSamples = [];
+        this.clockTimeout = null;
     }
 
 
     set websocket(ws) {
         console.log("Setting timer websocket:", ws ? "connected" : "null");
+        const changed = ws !== this._websocket;
         this._websocket = ws;
+        if (ws && changed) {
+            if (ws.readyState === WebSocket.OPEN) {
+                this.syncClock();
+            } else {
+                ws.addEventListener('open', () => this.syncClock(), { once: true });
+            }
+        }
     }
     
     get websocket() {
         return this._websocket;
     }
     
+    // Measure the offset to the server clock: a few quick samples, keeping
+    // the one with the shortest round trip, then again every few minutes
+    syncClock() {
+        clearTimeout(this.clockTimeout);
+        const socket = this.websocket;
+        let sent = 0;
+        const sample = () => {
+            if (socket !== this.websocket || socket.readyState !== WebSocket.OPEN) return;
+            if (sent === 0) this.clockSamples = [];
+            const message = { type: 'timer-clock', clientTime: Date.now() };
+            // Report what we settled on last time, for the server's metrics
+            if (this.rtt !== null) {
+                message.rtt = this.rtt;
+                message.offset = this.clockOffset;
+            }
+            socket.send(JSON.stringify(message));
+            sent++;
+            let delay = TimerManager.CLOCK_SAMPLE_INTERVAL;
+            if (sent >= TimerManager.CLOCK_SAMPLES) {
+                sent = 0;
+                delay = TimerManager.CLOCK_RESYNC_INTERVAL;
+            }
+            this.clockTimeout = setTimeout(sample, delay);
+        };
+        sample();
+    }
+
+    // Take one timer-clock reply into the offset estimate
+    handleClockSample(data) {
+        const now = Date.now();
+        const rtt = now - data.clientTime;
+        if (typeof data.serverTime !== 'number' || isNaN(rtt) || rtt < 0) return;
+        this.clockSamples.push({ rtt: rtt, offset: data.serverTime - (data.clientTime + now) / 2 });
+        const best = this.clockSamples.reduce((a, b) => (b.rtt < a.rtt ? b : a));
+        const previous = this.clockOffset;
+        this.rtt = best.rtt;
+        this.clockOffset = best.offset;
+        // A running countdown was drawn against the old offset
+        if (this.isRunning && this.serverStartTime) {
+            this.startTime = this.serverStartTime - this.clockOffset;
+        }
+        if (Math.abs(previous - this.clockOffset) > 50) {
+            console.log(`Clock offset ${this.clockOffset.toFixed(1)}ms (rtt ${this.rtt}ms)`);
+        }
+    }
+
     // Set the timer duration in seconds
     setDuration(seconds) {
         this.duration = seconds;
@@ -52,26 +111,47 @@ class TimerManager {
         return this;
     }
 
-    // Start the timer
+    // Run fn and return the timer messages it would have sent, unsent,
+    // so they can go out in one batch with other operations
+    collectOps(fn) {
+        this.pendingOps = [];
+        try {
+            fn();
+            return this.pendingOps;
+        } finally {
+            this.pendingOps = null;
+        }
+    }
+
+    // Send a message, or hold it back while collecting ops
+    send(message) {
+        if (this.pendingOps) {
+            this.pendingOps.push(message);
+            return true;
+        }
+        if (this.websocket && this.websocket.readyState === WebSocket.OPEN) {
+            this.websocket.send(JSON.stringify(message));
+            return true;
+        }
+        return false;
+    }
+
+    // Start the timer. The server decides when it started and when it
+    // ends; the local countdown is only drawn until its answer arrives.
     start() {
         console.log("Starting timer with duration:", this.duration);
         if (this.isRunning) return;
     
         this.isRunning = true;
-        if (this.pausedTimeRemaining) {
-            console.log("Resuming timer from paused state with remaining time:", this.pausedTimeRemaining);
-            // Fix: Calculate start time correctly based on remaining time
-            this.startTime = Date.now() - (this.duration * 1000 - this.pausedTimeRemaining);
-            console.log("New calculated start time:", this.startTime);
-            // Don't clear pausedTimeRemaining yet to allow it to be sent to server
-        } else {
-            // Start fresh if not resuming
-            this.startTime = Date.now();
-        }
+        const remaining = this.pausedTimeRemaining || this.duration * 1000;
+        this.startTime = Date.now() - (this.duration * 1000 - remaining);
+        clearInterval(this.intervalId);
         this.intervalId = setInterval(() => this.updateTimer(), 100);
     
         // Wait for WebSocket to be ready
-        if (this.websocket) {
+        if (this.pendingOps) {
+            this.sendTimerStartMessage();
+        } else if (this.websocket) {
             if (this.websocket.readyState === WebSocket.OPEN) {
                 this.sendTimerStartMessage();
             } else {
@@ -93,43 +173,23 @@ class TimerManager {
     
     sendTimerStartMessage() {
         console.log("Sending timer start message to server");
-        
-        // Calculate elapsed time if we're resuming from pause
-        const elapsedTime = this.pausedTimeRemaining ? 
-            (this.duration * 1000 - this.pausedTimeRemaining) : 0;
-            
-        this.websocket.send(JSON.stringify({
+        this.send({
             type: 'timer-start',
-            startTime: this.startTime,
-            duration: this.duration,
-            elapsedTime: elapsedTime, // Add this to help with synchronization
-            pausedTimeRemaining: this.pausedTimeRemaining
-        }));
-        
-        // Now that we've sent the message, clear pausedTimeRemaining
+            duration: this.duration
+        });
         this.pausedTimeRemaining = null;
     }
     
-    // Pause the timer
+    // Pause the timer; the server works out how much time is left
     pause() {
         if (!this.isRunning) return;
         
         this.isRunning = false;
-        
-        // Calculate remaining time
         const elapsed = Date.now() - this.startTime;
         this.pausedTimeRemaining = Math.max(0, this.duration * 1000 - elapsed);
-        
         clearInterval(this.intervalId);
         
-        // Notify server if websocket is available
-        if (this.websocket && this.websocket.readyState === WebSocket.OPEN) {
-            this.websocket.send(JSON.stringify({
-                type: 'timer-pause',
-                pausedTimeRemaining: this.pausedTimeRemaining,
-                pausedTime: this.pausedTimeRemaining // Include both for compatibility
-            }));
-        }
+        this.send({ type: 'timer-pause' });
         
         return this;
     }
@@ -146,12 +206,10 @@ class TimerManager {
         this.updateTimerDisplay(this.pausedTimeRemaining);
         
         // Notify server if websocket is available
-        if (this.websocket && this.websocket.readyState === WebSocket.OPEN) {
-            this.websocket.send(JSON.stringify({
-                type: 'timer-reset',
-                duration: currentDuration  // Send the saved duration
-            }));
-        }
+        this.send({
+            type: 'timer-reset',
+            duration: currentDuration  // Send the saved duration
+        });
         
         return this;
     }
@@ -179,12 +237,9 @@ class TimerManager {
             this.onTimerUpdate(remaining);
         }
         
-        // Check if timer has reached zero
+        // Stop drawing at zero; the round ends when the server sends timer-ended
         if (remaining <= 0) {
-            this.pause();
-            if (this.onTimerEnd) {
-                this.onTimerEnd();
-            }
+            clearInterval(this.intervalId);
         }
     }
     
@@ -216,24 +271,25 @@ class TimerManager {
             this.duration = parseFloat(data.duration);
         }
         
-        if (data.type === 'timer-start') {
-            console.log(`Timer started with duration: ${data.duration || 'not specified'}, startTime: ${data.startTime || 'not specified'}, elapsedTime: ${data.elapsedTime || 'not specified'}`);
+        if (data.type === 'timer-clock') {
+            this.handleClockSample(data);
+            return;
+        }
+
+        if (data.type === 'timer-start' || (data.type === 'timer-sync' && data.isRunning)) {
+            console.log(`Timer started with duration: ${data.duration || 'not specified'}, startTime: ${data.startTime || 'not specified'}`);
             this.isRunning = true;
             
-            // Calculate start time consistently across devices
-            if (typeof data.elapsedTime === 'number' && !isNaN(data.elapsedTime)) {
-                // Use elapsed time to calculate local start time (most reliable)
+            // startTime is on the server's clock; move it onto ours
+            if (typeof data.startTime === 'number' && data.startTime > 0) {
+                this.serverStartTime = data.startTime;
+                this.startTime = data.startTime - this.clockOffset;
+            } else if (typeof data.elapsedTime === 'number' && !isNaN(data.elapsedTime)) {
+                this.serverStartTime = null;
                 this.startTime = Date.now() - data.elapsedTime;
-                console.log(`Using elapsedTime ${data.elapsedTime}ms to calculate startTime: ${this.startTime}`);
-            } else if (data.startTime && !isNaN(data.startTime)) {
-                // Less reliable: using server's startTime directly
-                // This can cause sync issues due to network latency
-                this.startTime = parseInt(data.startTime);
-                console.log(`Using startTime directly: ${this.startTime}`);
             } else {
-                // Fallback, least reliable
+                this.serverStartTime = null;
                 this.startTime = Date.now();
-                console.log(`No time data provided, using current time: ${this.startTime}`);
             }
             
             // Clear any existing interval to prevent duplicates
@@ -243,8 +299,21 @@ class TimerManager {
             // Force a display update
             this.updateTimer();
         }
+        else if (data.type === 'timer-ended') {
+            // The server says time is up; only a timer we saw running ends a round
+            const wasRunning = this.isRunning;
+            this.isRunning = false;
+            this.serverStartTime = null;
+            this.pausedTimeRemaining = 0;
+            clearInterval(this.intervalId);
+            this.updateTimerDisplay(0);
+            if (wasRunning && this.onTimerEnd) {
+                this.onTimerEnd();
+            }
+        }
         else if (data.type === 'timer-pause') {
             this.isRunning = false;
+            this.serverStartTime = null;
             
             // Check both pausedTimeRemaining and pausedTime with strong validation
             let pausedTime = null;
@@ -279,6 +348,7 @@ class TimerManager {
         else if (data.type === 'timer-reset') {
             this.isRunning = false;
             this.startTime = 0;
+            this.serverStartTime = null;
             
             // Get duration from message
             if (typeof data.duration === 'number' && !isNaN(data.duration)) {
@@ -294,37 +364,20 @@ class TimerManager {
             this.updateTimerDisplay(this.pausedTimeRemaining);
         }
         else if (data.type === 'timer-sync') {
-            // For full sync of timer state
-            this.isRunning = !!data.isRunning;
-            
-            if (data.duration && !isNaN(data.duration)) {
-                this.duration = data.duration;
-            }
-            
-            if (this.isRunning) {
-                if (data.startTime && !isNaN(data.startTime)) {
-                    this.startTime = data.startTime;
-                } else {
-                    this.startTime = Date.now();
-                }
-                
-                clearInterval(this.intervalId);
-                this.intervalId = setInterval(() => this.updateTimer(), 100);
-            } else {
-                let pausedTime = data.pausedTimeRemaining || data.pausedTime;
-                
-                if (pausedTime && !isNaN(pausedTime)) {
-                    this.pausedTimeRemaining = pausedTime;
-                } else {
-                    this.pausedTimeRemaining = this.duration * 1000;
-                }
-                
-                clearInterval(this.intervalId);
-                this.updateTimerDisplay(this.pausedTimeRemaining);
-            }
+            // Never started: show the full duration
+            this.isRunning = false;
+            this.serverStartTime = null;
+            this.pausedTimeRemaining = data.pausedTimeRemaining || this.duration * 1000;
+            clearInterval(this.intervalId);
+            this.updateTimerDisplay(this.pausedTimeRemaining);
         }
     }
 }
 
+// Clock sync: samples per round, ms between them, ms between rounds
+TimerManager.CLOCK_SAMPLES = 5;
+TimerManager.CLOCK_SAMPLE_INTERVAL = 250;
+TimerManager.CLOCK_RESYNC_INTERVAL = 5 * 60 * 1000;
+
 // Expose the TimerManager globally
 window.TimerManager = TimerManager;
\ No newline at end of file